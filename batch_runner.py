@@ -0,0 +1,308 @@
+# batch_runner.py - 大批量股票的分片批处理
+"""
+从 CSV 或 JSON Lines 文件读取股票列表，按股票代码的哈希确定性地分片，
+在本机的多个进程中运行，或在多台机器上按分片序号各自运行一个分片。
+每个分片的结果写入独立的输出文件，历史总结、新闻签名和输入指纹不直接写入历史存储，
+全部分片完成后由 merge 步骤统一合并，较新的版本不会被较旧的结果覆盖。
+
+用法:
+    # 本机 4 个进程处理全部 8 个分片
+    python batch_runner.py run universe.csv --shards 8 --workers 4 --output-dir data/batch
+    # 增量模式：输入与上次合并的结果相同的股票直接复用
+    python batch_runner.py run universe.csv --shards 8 --incremental --output-dir data/batch
+    # 多台机器各自处理一个分片
+    python batch_runner.py run universe.csv --shards 8 --shard-index 3 --output-dir data/batch
+    # 合并全部分片的历史总结
+    python batch_runner.py merge --output-dir data/batch
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+def load_universe(path: str) -> List[Dict[str, Any]]:
+    """
+    读取股票列表，返回 [{"symbol", "style", "params"}, ...]
+
+    CSV 文件需要 symbol 列，可选 style 列和 JSON 格式的 params 列，其余非空列也作为提示词参数；
+    JSON Lines 文件每行一个对象，字段含义相同。
+    """
+    records = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    for row in rows:
+        row = dict(row)
+        symbol = (row.pop('symbol', None) or '').strip()
+        if not symbol:
+            continue
+        style = row.pop('style', None) or 'network_effect'
+        params = row.pop('params', None) or {}
+        if isinstance(params, str):
+            params = json.loads(params)
+        params.update({key: value for key, value in row.items() if value not in (None, '')})
+        records.append({"symbol": symbol, "style": style, "params": params})
+    return records
+
+
+def shard_of(symbol: str, num_shards: int) -> int:
+    """按股票代码的哈希计算分片序号，与进程、机器和股票列表顺序无关"""
+    digest = hashlib.md5(symbol.encode('utf-8')).hexdigest()
+    return int(digest, 16) % num_shards
+
+
+def shard_path(output_dir: str, shard_index: int, num_shards: int) -> str:
+    return os.path.join(output_dir, f"shard-{shard_index:04d}-of-{num_shards:04d}.jsonl")
+
+
+def run_shard(
+    records: List[Dict[str, Any]],
+    shard_index: int,
+    num_shards: int,
+    model_name: str,
+    output_dir: str,
+    date: Optional[str] = None,
+    chunk_size: int = 100,
+    pipeline: bool = False,
+    incremental: bool = False
+) -> Dict[str, Any]:
+    """
+    运行一个分片，按 chunk_size 分批调用分析工作流并逐批追加写入分片输出文件
+
+    incremental 为 True 时按合并后的输入指纹复用未变化的股票，并在输出中记录本次的输入指纹，由 merge 步骤写入
+
+    Returns:
+        分片统计：分片序号、股票数、LLM错误数、耗时和输出文件路径
+    """
+    from llm_call import is_error_result
+    from news_agent import AnalyzerSession
+
+    path = shard_path(output_dir, shard_index, num_shards)
+    history_date = date or datetime.now().strftime('%Y-%m-%d')
+    start = time.perf_counter()
+    errors = 0
+    with AnalyzerSession() as session, open(path, 'w', encoding='utf-8') as f:
+        for offset in range(0, len(records), chunk_size):
+            chunk = records[offset:offset + chunk_size]
+            run = session.run_pipeline if pipeline else session.run
+            state = run(
+                model_name,
+                [record["symbol"] for record in chunk],
+                [record["style"] for record in chunk],
+                prompt_params_list=[record["params"] or None for record in chunk],
+                date=date,
+                incremental=incremental,
+                save_history=False
+            )
+            for i, record in enumerate(chunk):
+                analysis_result = state.analysis_results[i]
+                history_result = state.history_results[i]
+                errors += int(is_error_result(analysis_result)) + int(is_error_result(history_result))
+                usage = state.analysis_usage[i] if state.analysis_usage else None
+                f.write(json.dumps({
+                    "symbol": record["symbol"],
+                    "style": record["style"],
+                    "date": history_date,
+                    "analysis_result": analysis_result,
+                    "history_result": history_result,
+                    "analysis_error": state.analysis_errors[i],
+                    "history_error": state.history_errors[i],
+                    "model_name": usage["model_name"] if usage else model_name,
+                    "prompt_hash": state.prompt_hashes[i] if state.prompt_hashes else None,
+                    "usage": usage,
+                    "news_duplicate": state.news_duplicates[i] if state.news_duplicates else None,
+                    "news_signature": state.news_signatures[i] if state.news_signatures else None,
+                    "input_fingerprint": state.input_fingerprints[i] if state.input_fingerprints else None,
+                    "reused": bool(state.reused and state.reused[i]),
+                    "updated_at": time.time()
+                }, ensure_ascii=False) + "\n")
+            f.flush()
+            print(f"分片 {shard_index}: 已完成 {min(offset + chunk_size, len(records))}/{len(records)} 只股票")
+    return {
+        "shard": shard_index,
+        "symbols": len(records),
+        "errors": errors,
+        "seconds": time.perf_counter() - start,
+        "path": path
+    }
+
+
+def run_batch(
+    records: List[Dict[str, Any]],
+    num_shards: int,
+    model_name: str,
+    output_dir: str,
+    shard_indexes: Optional[List[int]] = None,
+    workers: int = 1,
+    date: Optional[str] = None,
+    chunk_size: int = 100,
+    pipeline: bool = False,
+    incremental: bool = False
+) -> List[Dict[str, Any]]:
+    """把股票列表分片后运行指定的分片（默认全部），workers 大于 1 时每个分片在独立进程中运行"""
+    os.makedirs(output_dir, exist_ok=True)
+    shards: Dict[int, List[Dict[str, Any]]] = {i: [] for i in range(num_shards)}
+    for record in records:
+        shards[shard_of(record["symbol"], num_shards)].append(record)
+    if shard_indexes is None:
+        shard_indexes = list(range(num_shards))
+    jobs = [
+        (shards[i], i, num_shards, model_name, output_dir, date, chunk_size, pipeline, incremental)
+        for i in shard_indexes
+    ]
+    if workers <= 1:
+        return [run_shard(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_shard, *zip(*jobs)))
+
+
+def merge_shards(output_dir: str, store=None, results_store=None) -> int:
+    """
+    把全部分片输出中的历史总结合并到历史存储，同时合并从结果中提取的指标数据点、新闻签名和输入指纹，
+    并把分析结果追加到分析结果存储
+
+    与 save_results 一致，提示词编译失败或LLM调用失败的股票不写入历史总结，增量模式复用的结果不重复写入；
+    同一股票同一日期只保留更新时间最晚的版本。
+
+    Returns:
+        实际写入的历史总结条数
+    """
+    from history_store import get_history_store
+    from llm_call import is_error_result
+    from metric_history import combine_metrics, extract_metrics
+    from news_dedup import pack_signature
+    from results_store import get_results_store
+
+    store = store or get_history_store()
+    results_store = results_store or get_results_store()
+    entries = []
+    metric_entries = []
+    signature_entries = []
+    fingerprint_entries = []
+    records = []
+    for path in sorted(glob.glob(os.path.join(output_dir, "shard-*.jsonl"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                # 增量模式复用的结果此前已经合并过
+                if record.get("reused"):
+                    continue
+                analysis_ok = record["analysis_error"] is None and not is_error_result(record["analysis_result"])
+                history_ok = record["history_error"] is None and not is_error_result(record["history_result"])
+                if history_ok:
+                    entries.append((record["symbol"], record["date"], record["history_result"], record["updated_at"]))
+                metrics = combine_metrics(*(
+                    extract_metrics(record[key])
+                    for key in ("analysis_result", "history_result")
+                    if not is_error_result(record[key])
+                ))
+                if metrics is not None:
+                    metric_entries.append((record["symbol"], record["date"], metrics, record["updated_at"]))
+                # 旧版分片输出没有新闻签名和输入指纹
+                if record.get("news_signature") is not None and not is_error_result(record["analysis_result"]):
+                    signature_entries.append((
+                        record["symbol"],
+                        record["date"],
+                        record["style"],
+                        record["model_name"],
+                        pack_signature(record["news_signature"]),
+                        record["analysis_result"],
+                        record["updated_at"]
+                    ))
+                if record.get("input_fingerprint") is not None and analysis_ok and history_ok:
+                    fingerprint_entries.append((
+                        record["symbol"],
+                        record["input_fingerprint"],
+                        record["analysis_result"],
+                        record["history_result"],
+                        record["updated_at"]
+                    ))
+                # 旧版分片输出没有提示词哈希，这些分析结果不写入分析结果存储；
+                # 新闻近似重复时复用的是此前已保存的分析，同样不写入
+                duplicate = record.get("news_duplicate")
+                if (
+                    record.get("prompt_hash") is not None
+                    and not (duplicate and duplicate["reused"])
+                    and analysis_ok
+                ):
+                    usage = record.get("usage")
+                    records.append({
+                        "symbol": record["symbol"],
+                        "date": record["date"],
+                        "style": record["style"],
+                        "model_name": record["model_name"],
+                        "prompt_hash": record["prompt_hash"],
+                        "usage": usage,
+                        "cached": bool(usage and usage["cached"]),
+                        "created_at": record["updated_at"],
+                        "result": record["analysis_result"],
+                    })
+    results_store.append_many(records)
+    # 历史总结、指标、新闻签名和输入指纹在同一个事务内写入，中途失败时都不会只写入一部分
+    written, _ = store.merge_all(entries, metric_entries, signature_entries, fingerprint_entries)
+    return written
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from env_config import load_env
+
+    load_env()
+    parser = argparse.ArgumentParser(description="大批量股票的分片批处理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="运行分析")
+    run_parser.add_argument("universe", help="股票列表文件（.csv 或 .jsonl）")
+    run_parser.add_argument("--model", default="gpt-4o-mini", help="模型名称")
+    run_parser.add_argument("--date", help="分析日期（YYYY-MM-DD），默认当天")
+    run_parser.add_argument("--shards", type=int, default=1, help="分片总数")
+    run_parser.add_argument("--shard-index", type=int, nargs="+", help="只运行指定的分片，用于多机分布式运行")
+    run_parser.add_argument("--workers", type=int, default=1, help="本机并行的进程数")
+    run_parser.add_argument("--chunk-size", type=int, default=100, help="每批调用工作流的股票数")
+    run_parser.add_argument("--pipeline", action="store_true", help="使用逐只股票的流水线模式")
+    run_parser.add_argument("--incremental", action="store_true", help="增量模式，复用输入未变化的股票的结果")
+    run_parser.add_argument("--output-dir", default="data/batch", help="分片输出目录")
+
+    merge_parser = subparsers.add_parser("merge", help="把分片输出中的历史总结合并到历史存储")
+    merge_parser.add_argument("--output-dir", default="data/batch", help="分片输出目录")
+
+    args = parser.parse_args(argv)
+    if args.command == "merge":
+        count = merge_shards(args.output_dir)
+        print(f"已合并 {count} 条历史信息")
+        return
+
+    records = load_universe(args.universe)
+    print(f"读取 {len(records)} 只股票，分为 {args.shards} 个分片")
+    summaries = run_batch(
+        records,
+        args.shards,
+        args.model,
+        args.output_dir,
+        shard_indexes=args.shard_index,
+        workers=args.workers,
+        date=args.date,
+        chunk_size=args.chunk_size,
+        pipeline=args.pipeline,
+        incremental=args.incremental
+    )
+    for summary in summaries:
+        print(
+            f"分片 {summary['shard']}: {summary['symbols']} 只股票，{summary['errors']} 个错误，"
+            f"耗时 {summary['seconds']:.1f}s，输出 {summary['path']}"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
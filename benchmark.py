@@ -0,0 +1,422 @@
+# benchmark.py - 离线性能基准测试
+"""
+在本地模拟的 OpenAI 兼容服务和模拟的 yfinance 行情源上运行完整的分析工作流，
+统计不同股票数量下的吞吐量、单只股票延迟分布和内存峰值，无需真实API密钥和网络。
+
+用法:
+    python benchmark.py --sizes 10 100 1000 --latency 0.2 --error-rate 0.01
+    # 只测量冷启动导入耗时，超出预算或导入了重量级依赖时以非零状态退出
+    python benchmark.py --import-time --import-budget 0.5
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+class FakeLLMServer:
+    """
+    本地 OpenAI 兼容的对话补全服务，可配置延迟、错误率和回复长度，支持 stream=True 的流式回复
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.05,
+        error_rate: float = 0.0,
+        response_size: int = 500,
+        seed: int = 0
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.response_size = response_size
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _next_delay_and_error(self):
+        with self._lock:
+            self.requests += 1
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+            failed = self._random.random() < self.error_rate
+        return delay, failed
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_stream(self, request: Dict[str, Any], content: str, usage: Dict[str, int]) -> None:
+                """按 SSE 格式分段返回回复，最后按 stream_options 附带 usage 并以 [DONE] 结束"""
+                base = {
+                    "id": f"chatcmpl-fake-{server.requests}",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                }
+                step = max(len(content) // 4, 1)
+                chunks = [
+                    dict(base, choices=[{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}])
+                    for i in range(0, len(content), step)
+                ]
+                chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                if request.get("stream_options", {}).get("include_usage"):
+                    chunks.append(dict(base, choices=[], usage=usage))
+                body = "".join(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n" for chunk in chunks)
+                body = (body + "data: [DONE]\n\n").encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                delay, failed = server._next_delay_and_error()
+                time.sleep(delay)
+                if failed:
+                    self._send_json(500, {"error": {"message": "模拟的服务端错误", "type": "server_error"}})
+                    return
+                prompt = request.get("messages", [{}])[-1].get("content", "")
+                content = ("模拟分析结果。" * (server.response_size // 7 + 1))[:server.response_size]
+                if request.get("response_format", {}).get("type") == "json_object":
+                    # 打包请求：按提示词中的 "### 股票代码" 分段逐只返回结果
+                    labels = [line[4:].strip() for line in prompt.splitlines() if line.startswith("### ")]
+                    content = json.dumps({label: content for label in labels}, ensure_ascii=False)
+                prompt_tokens = len(prompt)
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(content),
+                    "total_tokens": prompt_tokens + len(content)
+                }
+                if request.get("stream"):
+                    self._send_stream(request, content, usage)
+                    return
+                self._send_json(200, {
+                    "id": f"chatcmpl-fake-{server.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": usage
+                })
+
+        return Handler
+
+    def start(self) -> "FakeLLMServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeYFinance:
+    """
+    模拟的 yfinance 模块，提供 download 和 Ticker 接口，可配置延迟、失败率和返回字段数量
+    """
+
+    def __init__(self, latency: float = 0.01, error_rate: float = 0.0, response_size: int = 20, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.response_size = response_size
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _fails(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            return self._random.random() < self.error_rate
+
+    def _bar(self) -> List[float]:
+        return [100.0, 101.0, 99.0, 100.5, 1000000]
+
+    def download(self, tickers, start=None, end=None, **kwargs):
+        import pandas as pd
+
+        time.sleep(self.latency)
+        symbols = [tickers] if isinstance(tickers, str) else list(tickers)
+        columns = pd.MultiIndex.from_product(
+            [symbols, ["Open", "High", "Low", "Close", "Volume"]], names=["Ticker", "Price"]
+        )
+        # 区间内的每个工作日一行，区间不足一天时只返回 start 当天
+        days = pd.bdate_range(start, end, inclusive="left") if end else []
+        if len(days) == 0:
+            days = pd.to_datetime([start])
+        rows = []
+        for _ in days:
+            row = []
+            for _ in symbols:
+                row += [float("nan")] * 5 if self._fails() else self._bar()
+            rows.append(row)
+        return pd.DataFrame(rows, index=days, columns=columns)
+
+    def Ticker(self, symbol: str):
+        import pandas as pd
+
+        fake = self
+
+        class Ticker:
+            @property
+            def info(self) -> Dict[str, Any]:
+                time.sleep(fake.latency)
+                if fake._fails():
+                    raise RuntimeError("模拟的行情获取失败")
+                # 真实的 .info 不含新闻，这里附带模拟新闻，使分析和历史总结两个阶段都能运行
+                info = {
+                    "symbol": symbol,
+                    "shortName": symbol,
+                    "currentPrice": 100.0,
+                    "news_summary": f"{symbol} 发布季度财报，用户规模持续增长。"
+                }
+                info.update({f"field_{i}": i for i in range(fake.response_size)})
+                return info
+
+            def history(self, start=None, end=None, **kwargs):
+                time.sleep(fake.latency)
+                if fake._fails():
+                    return pd.DataFrame()
+                return pd.DataFrame(
+                    [fake._bar()],
+                    index=pd.to_datetime([start]),
+                    columns=["Open", "High", "Low", "Close", "Volume"]
+                )
+
+        return Ticker()
+
+
+# 导入 news_agent 时不应加载的重量级依赖，它们只在获取行情、编译工作流或发出LLM请求时才需要
+IMPORT_HEAVY_MODULES = ["yfinance", "pandas", "numpy", "langgraph", "langchain_core", "openai", "httpx"]
+
+
+def measure_import_time(module: str = "news_agent", runs: int = 5) -> Dict[str, Any]:
+    """
+    在全新的子进程中多次导入模块，返回冷启动导入耗时的中位数和最大值，
+    以及导入后已加载的重量级依赖
+    """
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"heavy = [name for name in {IMPORT_HEAVY_MODULES!r} if name in sys.modules]\n"
+        "print(json.dumps({'seconds': elapsed, 'heavy': heavy}))\n"
+    )
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    heavy: List[str] = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True, check=True
+        ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        samples.append(sample["seconds"])
+        heavy = sorted(set(heavy) | set(sample["heavy"]))
+    return {
+        "module": module,
+        "runs": runs,
+        "median": statistics.median(samples),
+        "max": max(samples),
+        "heavy_modules": heavy
+    }
+
+
+def _symbol_latencies(tracer, symbols: int) -> List[float]:
+    """每只股票从运行开始到其全部LLM请求结束（流水线模式下为该股票处理完成）的耗时"""
+    finished: Dict[int, float] = {}
+    for event in tracer.events:
+        if event["type"] == "node" and event["name"] == "process_symbol":
+            finished[event["index"]] = event["timestamp"]
+    if finished:
+        return [finished[i] - tracer.started_at for i in range(symbols) if i in finished]
+    for event in tracer.events:
+        if event["type"] != "llm_call":
+            continue
+        indices = event.get("indices") or ([event["index"]] if event["index"] is not None else [])
+        for index in indices:
+            finished[index] = max(finished.get(index, 0.0), event["timestamp"])
+    return [finished[i] - tracer.started_at for i in range(symbols) if i in finished]
+
+
+def run_benchmark(
+    size: int,
+    model_name: str = "gpt-4o-mini",
+    market_mode: str = "info",
+    track_memory: bool = True,
+    pipeline: bool = False
+) -> Dict[str, Any]:
+    """
+    对指定数量的股票运行一次完整工作流，返回统计结果
+
+    market_mode 为 'info' 时按当天逐只获取行情快照；为 'ohlcv' 时按历史日期批量下载K线，
+    K线中没有新闻，新闻通过提示词参数传入，历史总结阶段会因缺少新闻而跳过。
+    pipeline 为 True 时使用流水线模式运行。
+    """
+    from instrumentation import Tracer, percentile
+    from news_agent import AnalyzerSession
+
+    # 每次运行使用不同的股票代码，避免命中上一轮写入的缓存和历史信息
+    symbols = [f"S{size}_{i:05d}" for i in range(size)]
+    date = None
+    prompt_params_list = None
+    if market_mode == "ohlcv":
+        date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+        prompt_params_list = [{"news_summary": f"{symbol} 发布季度财报，用户规模持续增长。"} for symbol in symbols]
+    session = AnalyzerSession()
+    tracer = Tracer()
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            run = session.run_pipeline if pipeline else session.run
+            state = run(
+                model_name,
+                symbols,
+                ["network_effect"] * size,
+                prompt_params_list=prompt_params_list,
+                date=date,
+                tracer=tracer
+            )
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    finally:
+        if track_memory:
+            tracemalloc.stop()
+        session.close()
+    latencies = _symbol_latencies(tracer, size)
+    return {
+        "symbols": size,
+        "seconds": elapsed,
+        "symbols_per_sec": size / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "peak_memory_mb": peak / 1024 / 1024 if peak is not None else None,
+        "llm_errors": state.perf_summary["llm"]["errors"],
+        "nodes": state.perf_summary["nodes"]
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="离线性能基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="股票数量")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟LLM请求延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="模拟LLM延迟抖动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟LLM请求失败率")
+    parser.add_argument("--response-size", type=int, default=500, help="模拟LLM回复长度（字符）")
+    parser.add_argument("--market-mode", choices=["info", "ohlcv"], default="info",
+                        help="行情获取方式：info 逐只获取当天快照，ohlcv 批量下载历史K线")
+    parser.add_argument("--market-latency", type=float, default=0.01, help="模拟行情请求延迟（秒）")
+    parser.add_argument("--market-error-rate", type=float, default=0.0, help="模拟行情获取失败率")
+    parser.add_argument("--market-fields", type=int, default=20, help="模拟行情快照的字段数量")
+    parser.add_argument("--concurrency", type=int, default=16, help="LLM最大并发请求数")
+    parser.add_argument("--pipeline", action="store_true", help="使用逐只股票的流水线模式运行")
+    parser.add_argument("--pack-budget", type=int, default=0, help="打包模式的单次请求token预算，0 表示不打包")
+    parser.add_argument("--no-memory", action="store_true", help="不统计内存峰值（tracemalloc 会拖慢运行）")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    parser.add_argument("--import-time", action="store_true", help="只测量 news_agent 的冷启动导入耗时")
+    parser.add_argument("--import-runs", type=int, default=5, help="导入耗时的测量次数")
+    parser.add_argument("--import-budget", type=float, help="导入耗时中位数的预算（秒），超出时以非零状态退出")
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        result = measure_import_time(runs=args.import_runs)
+        print(f"导入 {result['module']}: 中位数 {result['median']:.3f}s，最大 {result['max']:.3f}s（{result['runs']} 次）")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+        if result["heavy_modules"]:
+            print(f"导入时加载了重量级依赖: {', '.join(result['heavy_modules'])}")
+            sys.exit(1)
+        if args.import_budget is not None and result["median"] > args.import_budget:
+            print(f"导入耗时超出预算 {args.import_budget:.3f}s")
+            sys.exit(1)
+        return [result]
+
+    workdir = tempfile.mkdtemp(prefix="news_agent_bench_")
+    server = FakeLLMServer(args.latency, args.jitter, args.error_rate, args.response_size).start()
+    # 必须在创建缓存、历史存储和AgentCall之前设置，确保基准测试与本地数据隔离
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": server.base_url,
+        "GPT_MAX_CONCURRENCY": str(args.concurrency),
+        "GPT_RPM": str(10 ** 9),
+        "GPT_TPM": str(10 ** 12),
+        "LLM_CACHE_MODE": "off",
+        "LLM_PACK_TOKEN_BUDGET": str(args.pack_budget or ""),
+        "MARKET_DATA_OFFLINE": "false",
+        "MARKET_CACHE_FILE": os.path.join(workdir, "market_cache.db"),
+        "STOCK_HISTORY_DB": os.path.join(workdir, "stock_history.db"),
+        "STOCK_HISTORY_FILE": os.path.join(workdir, "stock_history.json"),
+        "ANALYSIS_RESULTS_DB": os.path.join(workdir, "analysis_results.db"),
+        # 本地配置的路由和注册表会把请求发到真实服务商
+        "LLM_ROUTES": "",
+        "LLM_REGISTRY_FILE": "",
+    })
+    import news_agent
+
+    news_agent.yf = FakeYFinance(args.market_latency, args.market_error_rate, args.market_fields)
+
+    results = []
+    try:
+        print(f"{'股票数':>8} {'耗时(s)':>9} {'吞吐(只/s)':>11} {'p50(s)':>8} {'p95(s)':>8} {'p99(s)':>8} {'内存峰值(MB)':>12}")
+        for size in args.sizes:
+            result = run_benchmark(
+                size, market_mode=args.market_mode, track_memory=not args.no_memory, pipeline=args.pipeline
+            )
+            results.append(result)
+            memory = f"{result['peak_memory_mb']:.1f}" if result["peak_memory_mb"] is not None else "-"
+            print(
+                f"{size:>8} {result['seconds']:>9.2f} {result['symbols_per_sec']:>11.1f} "
+                f"{result['p50']:>8.2f} {result['p95']:>8.2f} {result['p99']:>8.2f} {memory:>12}"
+            )
+    finally:
+        server.stop()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,135 @@
+# checkpoint_store.py - 分析运行的逐只股票检查点
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+from env_config import load_env
+
+
+def new_run_id() -> str:
+    """生成新的运行ID"""
+    return time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:8]
+
+
+class CheckpointStore:
+    """
+    基于SQLite的逐只股票检查点
+
+    每只股票的分析结果或历史总结一完成就按 (运行ID, 类型, 序号) 持久化，
+    运行中断后使用同一个运行ID重新运行时只处理尚未完成的股票。
+    """
+
+    def __init__(self, db_file: Optional[str] = None):
+        """
+        Args:
+            db_file: 数据库路径，默认读取环境变量 CHECKPOINT_DB
+        """
+        load_env()
+        self.db_file = db_file or os.getenv('CHECKPOINT_DB', 'data/checkpoints.db')
+        directory = os.path.dirname(self.db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    run_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    symbol TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (run_id, kind, idx)
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def start(self, run_id: str) -> bool:
+        """
+        登记一次运行
+
+        Returns:
+            运行ID已存在（即本次为恢复运行）时返回 True
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO runs (run_id, created_at) VALUES (?, ?)", (run_id, time.time())
+            )
+            return cursor.rowcount == 0
+
+    def put(self, run_id: str, kind: str, index: int, symbol: str, result: str) -> None:
+        """保存单只股票的一条结果，kind 为 'analysis' 或 'history'"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (run_id, kind, idx, symbol, result, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, kind, index, symbol, result, time.time())
+            )
+
+    def get_results(self, run_id: str, kind: str, stock_list: List[str]) -> List[Optional[str]]:
+        """按股票列表顺序读取已完成的结果，未完成或股票代码不一致的位置为 None"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT idx, symbol, result FROM results WHERE run_id = ? AND kind = ?", (run_id, kind)
+            ).fetchall()
+        results: List[Optional[str]] = [None] * len(stock_list)
+        for index, symbol, result in rows:
+            if index < len(stock_list) and stock_list[index] == symbol:
+                results[index] = result
+        return results
+
+    def finish(self, run_id: str) -> None:
+        """标记运行已完成（历史信息已保存）"""
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def list_runs(self) -> List[Tuple[str, float, Optional[float], int]]:
+        """按创建时间返回 (运行ID, 创建时间, 完成时间, 已完成结果数)"""
+        with self._connect() as conn:
+            return conn.execute(
+                """SELECT r.run_id, r.created_at, r.finished_at, COUNT(s.idx) FROM runs r
+                   LEFT JOIN results s ON r.run_id = s.run_id
+                   GROUP BY r.run_id ORDER BY r.created_at"""
+            ).fetchall()
+
+    def delete(self, run_id: str) -> None:
+        """删除一次运行的全部检查点"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE run_id = ?", (run_id,))
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+
+_default_store: Optional[CheckpointStore] = None
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """获取进程内共享的默认检查点存储"""
+    global _default_store
+    if _default_store is None:
+        _default_store = CheckpointStore()
+    return _default_store
+
+
+if __name__ == "__main__":
+    load_env()
+    # 用法: python checkpoint_store.py  列出全部运行及其完成进度
+    for run_id, created_at, finished_at, done in get_checkpoint_store().list_runs():
+        status = "已完成" if finished_at else "未完成"
+        print(f"{run_id}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created_at))}  {status}  已保存 {done} 条结果")
@@ -0,0 +1,63 @@
+# conftest.py - 测试共用的本地服务和隔离环境
+import pytest
+
+import checkpoint_store
+import history_store
+import llm_cache
+import llm_call
+import market_cache
+import model_registry
+import results_store
+from benchmark import FakeLLMServer, FakeYFinance
+
+
+@pytest.fixture(scope="session")
+def fake_llm():
+    """本地 OpenAI 兼容服务，整个测试会话共用"""
+    server = FakeLLMServer(latency=0.02, jitter=0.0, response_size=80).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def isolated_env(tmp_path, monkeypatch, fake_llm):
+    """
+    把所有数据库、缓存和LLM请求指向临时目录和本地服务，并重置进程内共享的默认实例，
+    测试之间互不影响，也不会读写本地数据
+    """
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_BASE_URL", fake_llm.base_url)
+    for key, value in {
+        "LLM_CACHE_MODE": "off",
+        "LLM_PACK_TOKEN_BUDGET": "",
+        "LLM_ROUTES": "",
+        "LLM_REGISTRY_FILE": "",
+        "GPT_FALLBACK_MODEL": "",
+        "NEWS_DEDUP_MODE": "off",
+        "MARKET_DATA_OFFLINE": "false",
+        "MARKET_CACHE_FILE": str(tmp_path / "market_cache.db"),
+        "STOCK_HISTORY_DB": str(tmp_path / "stock_history.db"),
+        "STOCK_HISTORY_FILE": str(tmp_path / "stock_history.json"),
+        "CHECKPOINT_DB": str(tmp_path / "checkpoints.db"),
+        "ANALYSIS_RESULTS_DB": str(tmp_path / "analysis_results.db"),
+        "LLM_CACHE_FILE": str(tmp_path / "llm_cache.db"),
+    }.items():
+        monkeypatch.setenv(key, value)
+    for module, name in (
+        (history_store, "_default_store"),
+        (checkpoint_store, "_default_store"),
+        (results_store, "_default_store"),
+        (market_cache, "_default_cache"),
+        (llm_cache, "_default_cache"),
+        (model_registry, "_default_registry"),
+        (model_registry, "_default_router"),
+    ):
+        monkeypatch.setattr(module, name, None)
+    monkeypatch.setattr(llm_call, "_RATE_LIMITERS", {})
+    monkeypatch.setattr(llm_call, "_CONCURRENCY_LIMITERS", {})
+    monkeypatch.setattr(llm_call, "_CIRCUIT_BREAKERS", {})
+
+    import news_agent
+
+    monkeypatch.setattr(news_agent, "yf", FakeYFinance(latency=0.0))
+    return tmp_path
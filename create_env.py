@@ -5,10 +5,64 @@ OPENAI_BASE_URL=https://api.openai.com/v1
 # deepseekAPI配置
 deepseek_API_KEY = your_deepseek_api_key_here
 
+# 并发与限速配置（可选）
+GPT_MAX_CONCURRENCY=4
+GPT_RPM=500
+GPT_TPM=200000
+DEEPSEEK_MAX_CONCURRENCY=4
+DEEPSEEK_RPM=300
+DEEPSEEK_TPM=300000
+
+# 超时、重试、对冲请求与熔断切换配置（可选）
+LLM_TIMEOUT=60
+LLM_DEADLINE=180
+LLM_MAX_RETRIES=2
+LLM_HEDGE_PERCENTILE=0
+LLM_BREAKER_THRESHOLD=5
+LLM_BREAKER_RESET=30
+# 备用模型，例如 GPT_FALLBACK_MODEL=deepseek-chat
+GPT_FALLBACK_MODEL=
+DEEPSEEK_FALLBACK_MODEL=
+
+# 模型注册与任务路由（可选）
+# LLM_PROVIDERS=local
+# LOCAL_BASE_URL=http://localhost:8000/v1
+# LOCAL_MODELS=qwen2.5-7b-instruct
+# LLM_ROUTES=network_effect_history=deepseek-chat,gpt-4o-mini
+LLM_ROUTE_LATENCY_WEIGHT=1.0
+
 # 历史信息文件路径
 STOCK_HISTORY_FILE=data/stock_history.json
+STOCK_HISTORY_DB=data/stock_history.db
+CHECKPOINT_DB=data/checkpoints.db
+ANALYSIS_RESULTS_DB=data/analysis_results.db
 ANALYSIS_RESULTS_FILE=data/analysis_results.json
 ANALYSIS_HISTORY_FILE=data/analysis_history.json
+
+# 提示词中历史指标表格的数据点数和token预算
+HISTORY_POINTS=8
+HISTORY_TOKEN_BUDGET=600
+
+# 新闻近似重复检测（模式: off / flag / reuse）
+NEWS_DEDUP_MODE=off
+NEWS_DEDUP_THRESHOLD=0.7
+NEWS_DEDUP_WINDOW_DAYS=7
+
+# 行情缓存配置
+MARKET_CACHE_FILE=data/market_cache.db
+MARKET_CACHE_TTL=900
+MARKET_CLOSE_TIME=16:00
+MARKET_TIMEZONE=America/New_York
+MARKET_DATA_OFFLINE=false
+MARKET_FETCH_WORKERS=8
+
+# LLM回复缓存配置（模式: off / readwrite / replay）
+LLM_CACHE_MODE=readwrite
+LLM_CACHE_FILE=data/llm_cache.db
+LLM_CACHE_MAX_BYTES=268435456
+
+# 多股票打包请求的token预算（留空不打包）
+LLM_PACK_TOKEN_BUDGET=
 """
     with open('.env', 'w', encoding='utf-8') as f:
         f.write(content)
@@ -0,0 +1,18 @@
+# env_config.py - 环境变量加载
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_env() -> None:
+    """首次调用时从 .env 文件加载环境变量，已经设置的环境变量不会被覆盖"""
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            _loaded = True
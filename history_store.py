@@ -0,0 +1,401 @@
+# history_store.py - 股票历史信息存储
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from env_config import load_env
+
+# 指标时间序列的数据列，增长率和ARPU变化为百分比，strength 为 1（弱）/ 2（中）/ 3（强）
+METRIC_COLUMNS = ["user_growth", "user_growth_text", "arpu_change", "arpu_change_text", "strength", "evidence"]
+
+# 从旧版 JSON 文件导入的历史信息没有分析日期，使用早于任何真实日期的版本日期，按任意日期运行时都能读到
+LEGACY_HISTORY_DATE = "0000-00-00"
+
+
+class HistoryStore:
+    """
+    基于SQLite的历史信息存储
+
+    每只股票按日期保存版本，支持按股票的单点读写和原子批量提交；
+    使用WAL模式和写锁，多个进程同时运行时不会互相覆盖更新。
+    """
+
+    def __init__(self, db_file: Optional[str] = None):
+        """
+        Args:
+            db_file: 数据库路径，默认读取环境变量 STOCK_HISTORY_DB
+        """
+        load_env()
+        self.db_file = db_file or os.getenv('STOCK_HISTORY_DB', 'data/stock_history.db')
+        directory = os.path.dirname(self.db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS history (
+                    symbol TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (symbol, date)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS fingerprints (
+                    symbol TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    analysis_result TEXT,
+                    history_result TEXT,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS metrics (
+                    symbol TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    user_growth REAL,
+                    user_growth_text TEXT,
+                    arpu_change REAL,
+                    arpu_change_text TEXT,
+                    strength INTEGER,
+                    evidence TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (symbol, date)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS news_signatures (
+                    symbol TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    style TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    signature BLOB NOT NULL,
+                    analysis_result TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (symbol, date, style, model_name)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA busy_timeout = 30000")
+            if write:
+                # 立即获取写锁，整个批次在一个事务内提交
+                conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                if write:
+                    conn.execute("ROLLBACK")
+                raise
+            if write:
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def get(self, symbol: str, as_of: Optional[str] = None) -> Optional[str]:
+        """读取单只股票在 as_of 日期（含）之前的最新历史信息"""
+        return self.get_many([symbol], as_of).get(symbol)
+
+    def get_many(self, symbols: List[str], as_of: Optional[str] = None) -> Dict[str, str]:
+        """批量读取多只股票的最新历史信息，as_of 为空时取全部版本中最新的一条"""
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        as_of = as_of or '9999-12-31'
+        placeholders = ",".join("?" * len(symbols))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""SELECT h.symbol, h.content FROM history h
+                    JOIN (
+                        SELECT symbol, MAX(date) AS date FROM history
+                        WHERE date <= ? AND symbol IN ({placeholders})
+                        GROUP BY symbol
+                    ) latest ON h.symbol = latest.symbol AND h.date = latest.date""",
+                [as_of, *symbols]
+            ).fetchall()
+        return dict(rows)
+
+    def get_versions(self, symbol: str) -> List[Dict[str, Any]]:
+        """按日期顺序返回单只股票的全部历史版本"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT date, content, updated_at FROM history WHERE symbol = ? ORDER BY date",
+                (symbol,)
+            ).fetchall()
+        return [{"date": date, "content": content, "updated_at": updated_at} for date, content, updated_at in rows]
+
+    def put(self, symbol: str, content: str, date: Optional[str] = None) -> None:
+        """写入单只股票的历史信息"""
+        self.put_many([(symbol, content)], date)
+
+    def put_many(self, entries: List[Tuple[str, str]], date: Optional[str] = None) -> None:
+        """
+        原子写入一批历史信息，同一股票同一日期的版本会被替换，其他日期的版本保留
+        """
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        now = time.time()
+        with self._connect(write=True) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO history (symbol, date, content, updated_at) VALUES (?, ?, ?, ?)",
+                [(symbol, date, content, now) for symbol, content in entries]
+            )
+
+    def merge_many(self, entries: List[Tuple[str, str, str, float]]) -> int:
+        """
+        合并一批 (股票代码, 日期, 历史信息, 更新时间)，用于汇总分片批处理的结果
+
+        同一股票同一日期已存在更新时间更晚的版本时保留原版本，不会被较旧的结果覆盖。
+
+        Returns:
+            实际写入的条数
+        """
+        return self.merge_all(entries, [])[0]
+
+    def merge_all(
+        self,
+        entries: List[Tuple[str, str, str, float]],
+        metric_entries: List[Tuple[str, str, Dict[str, Any], float]],
+        signature_entries: Optional[List[Tuple[str, str, str, str, bytes, Optional[str], float]]] = None,
+        fingerprint_entries: Optional[List[Tuple[str, str, Optional[str], Optional[str], float]]] = None
+    ) -> Tuple[int, int]:
+        """
+        在一个事务内合并历史信息和指标数据点，参数格式分别同 merge_many 和 merge_metrics；
+        可同时合并新闻签名 (股票代码, 日期, 分析风格, 模型, 新闻签名, 分析结果, 更新时间)
+        和输入指纹 (股票代码, 输入指纹, 分析结果, 历史总结, 更新时间)，同样不会用较旧的记录覆盖较新的
+
+        Returns:
+            (写入的历史信息条数, 写入的指标数据点数)
+        """
+        signature_entries = signature_entries or []
+        fingerprint_entries = fingerprint_entries or []
+        if not entries and not metric_entries and not signature_entries and not fingerprint_entries:
+            return 0, 0
+        with self._connect(write=True) as conn:
+            before = conn.total_changes
+            conn.executemany(
+                """INSERT INTO history (symbol, date, content, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (symbol, date) DO UPDATE SET
+                       content = excluded.content, updated_at = excluded.updated_at
+                   WHERE excluded.updated_at > history.updated_at""",
+                entries
+            )
+            middle = conn.total_changes
+            conn.executemany(
+                f"""INSERT INTO metrics (symbol, date, {", ".join(METRIC_COLUMNS)}, updated_at)
+                    VALUES (?, ?, {", ".join("?" * len(METRIC_COLUMNS))}, ?)
+                    ON CONFLICT (symbol, date) DO UPDATE SET
+                        {", ".join(f"{column} = excluded.{column}" for column in METRIC_COLUMNS)},
+                        updated_at = excluded.updated_at
+                    WHERE excluded.updated_at >= metrics.updated_at""",
+                [
+                    (symbol, date, *(metrics.get(column) for column in METRIC_COLUMNS), updated_at)
+                    for symbol, date, metrics, updated_at in metric_entries
+                ]
+            )
+            written = (middle - before, conn.total_changes - middle)
+            conn.executemany(
+                """INSERT INTO news_signatures
+                       (symbol, date, style, model_name, signature, analysis_result, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (symbol, date, style, model_name) DO UPDATE SET
+                       signature = excluded.signature, analysis_result = excluded.analysis_result,
+                       updated_at = excluded.updated_at
+                   WHERE excluded.updated_at > news_signatures.updated_at""",
+                signature_entries
+            )
+            conn.executemany(
+                """INSERT INTO fingerprints (symbol, fingerprint, analysis_result, history_result, updated_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (symbol) DO UPDATE SET
+                       fingerprint = excluded.fingerprint, analysis_result = excluded.analysis_result,
+                       history_result = excluded.history_result, updated_at = excluded.updated_at
+                   WHERE excluded.updated_at > fingerprints.updated_at""",
+                fingerprint_entries
+            )
+            return written
+
+    def put_metrics(self, entries: List[Tuple[str, Dict[str, Any]]], date: Optional[str] = None) -> int:
+        """原子写入一批 (股票代码, 指标字典) 作为指定日期的数据点，同一股票同一日期的数据点会被替换"""
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        now = time.time()
+        return self.merge_metrics([(symbol, date, metrics, now) for symbol, metrics in entries])
+
+    def merge_metrics(self, entries: List[Tuple[str, str, Dict[str, Any], float]]) -> int:
+        """
+        合并一批 (股票代码, 日期, 指标字典, 更新时间)，与 merge_many 一样不会用较旧的数据点覆盖较新的
+
+        Returns:
+            实际写入的条数
+        """
+        return self.merge_all([], entries)[1]
+
+    def get_metric_series(
+        self,
+        symbols: List[str],
+        as_of: Optional[str] = None,
+        limit: int = 8
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """批量读取多只股票在 as_of 日期（含）之前最近 limit 个数据点，按日期升序排列"""
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols or limit <= 0:
+            return {}
+        as_of = as_of or '9999-12-31'
+        placeholders = ",".join("?" * len(symbols))
+        columns = ["symbol", "date", *METRIC_COLUMNS]
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""SELECT {", ".join(columns)} FROM (
+                        SELECT *, ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY date DESC) AS rank
+                        FROM metrics WHERE date <= ? AND symbol IN ({placeholders})
+                    ) WHERE rank <= ? ORDER BY symbol, date""",
+                [as_of, *symbols, limit]
+            ).fetchall()
+        series: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            series.setdefault(row[0], []).append(dict(zip(columns[1:], row[1:])))
+        return series
+
+    def get_fingerprints(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量读取多只股票上次运行的输入指纹及对应的分析结果和历史总结"""
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        placeholders = ",".join("?" * len(symbols))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT symbol, fingerprint, analysis_result, history_result FROM fingerprints "
+                f"WHERE symbol IN ({placeholders})",
+                symbols
+            ).fetchall()
+        return {
+            symbol: {"fingerprint": fingerprint, "analysis_result": analysis_result, "history_result": history_result}
+            for symbol, fingerprint, analysis_result, history_result in rows
+        }
+
+    def put_fingerprints(self, entries: List[Tuple[str, str, Optional[str], Optional[str]]]) -> None:
+        """
+        原子写入一批 (股票代码, 输入指纹, 分析结果, 历史总结)，每只股票只保留最近一次
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._connect(write=True) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints "
+                "(symbol, fingerprint, analysis_result, history_result, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(symbol, fingerprint, analysis, history, now) for symbol, fingerprint, analysis, history in entries]
+            )
+
+    def get_news_signatures(
+        self,
+        symbols: List[str],
+        start_date: str,
+        end_date: str
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        批量读取多只股票在 [start_date, end_date] 区间内保存的新闻签名，按日期降序排列
+
+        Returns:
+            {股票代码: [{"date", "style", "model_name", "signature", "analysis_result"}]}，signature 为原始字节
+        """
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        placeholders = ",".join("?" * len(symbols))
+        columns = ["symbol", "date", "style", "model_name", "signature", "analysis_result"]
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(columns)} FROM news_signatures "
+                f"WHERE symbol IN ({placeholders}) AND date >= ? AND date <= ? ORDER BY symbol, date DESC",
+                [*symbols, start_date, end_date]
+            ).fetchall()
+        signatures: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            signatures.setdefault(row[0], []).append(dict(zip(columns[1:], row[1:])))
+        return signatures
+
+    def put_news_signatures(self, entries: List[Tuple[str, str, str, str, bytes, Optional[str]]]) -> None:
+        """
+        原子写入一批 (股票代码, 日期, 分析风格, 模型, 新闻签名, 分析结果)，同一键只保留最近一次
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._connect(write=True) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO news_signatures "
+                "(symbol, date, style, model_name, signature, analysis_result, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*entry, now) for entry in entries]
+            )
+
+    def migrate_json(self, json_file: str) -> int:
+        """
+        从旧版 JSON 历史文件一次性导入，版本日期为 LEGACY_HISTORY_DATE
+
+        Returns:
+            实际导入的股票数量，已经导入过或文件不存在时返回 0
+        """
+        if not os.path.exists(json_file):
+            return 0
+        with self._connect(write=True) as conn:
+            marker = f"migrated:{os.path.abspath(json_file)}"
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return 0
+            with open(json_file, 'r', encoding='utf-8') as f:
+                history_data = json.load(f)
+            now = time.time()
+            # 不覆盖已存在的同日版本
+            inserted = conn.executemany(
+                "INSERT OR IGNORE INTO history (symbol, date, content, updated_at) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        symbol,
+                        LEGACY_HISTORY_DATE,
+                        content if isinstance(content, str) else json.dumps(content, ensure_ascii=False),
+                        now
+                    )
+                    for symbol, content in history_data.items()
+                    if content is not None
+                ]
+            ).rowcount
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (marker, str(now)))
+        return inserted
+
+
+_default_store: Optional[HistoryStore] = None
+
+
+def get_history_store() -> HistoryStore:
+    """获取进程内共享的默认历史存储，首次使用时自动导入旧版 JSON 历史文件"""
+    global _default_store
+    if _default_store is None:
+        store = HistoryStore()
+        try:
+            store.migrate_json(os.getenv('STOCK_HISTORY_FILE', 'data/stock_history.json'))
+        except Exception as e:
+            print(f"导入旧版历史文件失败: {e}")
+        _default_store = store
+    return _default_store
+
+
+if __name__ == "__main__":
+    import sys
+
+    load_env()
+    # 用法: python history_store.py [旧版JSON文件路径]
+    json_file = sys.argv[1] if len(sys.argv) > 1 else os.getenv('STOCK_HISTORY_FILE', 'data/stock_history.json')
+    count = HistoryStore().migrate_json(json_file)
+    print(f"已从 {json_file} 导入 {count} 只股票的历史信息")
@@ -0,0 +1,174 @@
+# instrumentation.py - 性能埋点与token统计
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# 钩子函数接收一条事件字典，事件类型见 Tracer.span 和 Tracer.record_llm_call
+TraceHook = Callable[[Dict[str, Any]], None]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """计算百分位数（最近秩法），values 为空时返回 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Tracer:
+    """
+    收集一次运行的节点耗时、LLM请求延迟、重试次数和token用量
+
+    每条事件都会推送给注册的钩子，运行结束后可通过 summary() 获取汇总。
+    """
+
+    def __init__(self, hooks: Optional[List[TraceHook]] = None):
+        self.hooks: List[TraceHook] = list(hooks or [])
+        self.events: List[Dict[str, Any]] = []
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: TraceHook) -> None:
+        self.hooks.append(hook)
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        """记录事件并推送给所有钩子，钩子出错不影响分析流程"""
+        event.setdefault("timestamp", time.time())
+        with self._lock:
+            self.events.append(event)
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                print(f"性能埋点钩子执行失败: {e}")
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[None]:
+        """统计一个节点或阶段的耗时，产出 {"type": "node"} 事件"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.emit({
+                "type": "node",
+                "name": name,
+                "duration": time.perf_counter() - start,
+                "error": error,
+                **attrs
+            })
+
+    def record_llm_call(
+        self,
+        model_name: str,
+        kind: str,
+        latency: float,
+        retries: int = 0,
+        usage: Optional[Dict[str, int]] = None,
+        cached: bool = False,
+        error: Optional[str] = None,
+        tag: Optional[str] = None,
+        index: Optional[int] = None,
+        indices: Optional[List[int]] = None
+    ) -> None:
+        """记录单次LLM请求，产出 {"type": "llm_call"} 事件；打包请求通过 indices 记录包含的全部序号"""
+        self.emit({
+            "type": "llm_call",
+            "model_name": model_name,
+            "kind": kind,
+            "tag": tag,
+            "index": index,
+            "indices": indices,
+            "latency": latency,
+            "retries": retries,
+            "usage": usage,
+            "cached": cached,
+            "error": error
+        })
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        汇总节点耗时、LLM延迟分布、按标签（分析风格）统计的token用量，
+        以及新闻去重的模式、阈值、检测数、命中数和命中率（未检测时为 None）
+        """
+        with self._lock:
+            events = list(self.events)
+        nodes: Dict[str, float] = {}
+        latencies = []
+        llm = {"calls": 0, "cached": 0, "errors": 0, "retries": 0}
+        tokens = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        tokens_by_tag: Dict[str, Dict[str, int]] = {}
+        news_dedup: Optional[Dict[str, Any]] = None
+        for event in events:
+            if event["type"] == "node":
+                nodes[event["name"]] = nodes.get(event["name"], 0.0) + event["duration"]
+            elif event["type"] == "llm_call":
+                llm["calls"] += 1
+                llm["cached"] += int(event["cached"])
+                llm["errors"] += int(event["error"] is not None)
+                llm["retries"] += event["retries"]
+                if not event["cached"]:
+                    latencies.append(event["latency"])
+                usage = event["usage"] or {}
+                tag_tokens = tokens_by_tag.setdefault(event["tag"] or event["kind"], dict.fromkeys(tokens, 0))
+                for key in tokens:
+                    tokens[key] += usage.get(key) or 0
+                    tag_tokens[key] += usage.get(key) or 0
+            elif event["type"] == "news_dedup":
+                if news_dedup is None:
+                    news_dedup = {
+                        "mode": event["mode"],
+                        "threshold": event["threshold"],
+                        "window_days": event["window_days"],
+                        "checked": 0,
+                        "duplicates": 0,
+                        "reused": 0,
+                    }
+                for key in ("checked", "duplicates", "reused"):
+                    news_dedup[key] += event[key]
+        if news_dedup is not None:
+            news_dedup["hit_rate"] = news_dedup["duplicates"] / news_dedup["checked"] if news_dedup["checked"] else 0.0
+        llm["latency"] = {
+            "total": sum(latencies),
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies, default=0.0)
+        }
+        llm["tokens"] = tokens
+        return {
+            "wall_time": time.time() - self.started_at,
+            "nodes": nodes,
+            "llm": llm,
+            "tokens_by_tag": tokens_by_tag,
+            "news_dedup": news_dedup
+        }
+
+
+class JsonTraceExporter:
+    """
+    以 JSON Lines 格式把事件逐条追加写入文件的钩子
+
+    用法: Tracer(hooks=[JsonTraceExporter("data/trace.jsonl")])
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
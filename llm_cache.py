@@ -0,0 +1,141 @@
+# llm_cache.py - LLM回复缓存
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from env_config import load_env
+
+# 缓存模式：off 不使用缓存；readwrite 命中直接返回、未命中调用后写入；
+# replay 只从缓存回放，未命中直接报错（用于CI和基准测试的离线确定性运行）
+CACHE_MODES = ("off", "readwrite", "replay")
+
+
+class CacheMissError(RuntimeError):
+    """回放模式下缓存未命中"""
+
+
+class LLMResponseCache:
+    """
+    基于SQLite的内容寻址LLM回复缓存
+
+    以 (模型名称, 系统消息, 用户提示词, temperature, max_tokens) 的哈希为键，
+    总大小超过 max_bytes 时按最近访问时间淘汰最久未使用的条目。
+    """
+
+    def __init__(self, cache_file: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_file: 缓存数据库路径，默认读取环境变量 LLM_CACHE_FILE
+            max_bytes: 缓存内容的总大小上限（字节），默认读取环境变量 LLM_CACHE_MAX_BYTES
+        """
+        load_env()
+        self.cache_file = cache_file or os.getenv('LLM_CACHE_FILE', 'data/llm_cache.db')
+        self.max_bytes = max_bytes or int(os.getenv('LLM_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses (last_access)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.cache_file, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(
+        model_name: str,
+        system_prompt: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int
+    ) -> str:
+        """计算请求内容的哈希键"""
+        payload = json.dumps(
+            [model_name, system_prompt, prompt, temperature, max_tokens],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存的回复，命中时刷新访问时间"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row is not None else None
+
+    def put(self, key: str, response: str) -> None:
+        """写入回复，超出容量时淘汰最久未访问的条目"""
+        size = len(response.encode('utf-8'))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evict = []
+            for old_key, old_size in conn.execute(
+                "SELECT key, size FROM responses WHERE key != ? ORDER BY last_access", (key,)
+            ):
+                if total <= self.max_bytes:
+                    break
+                evict.append((old_key,))
+                total -= old_size
+            conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+    def stats(self) -> Dict[str, int]:
+        """返回命中统计和缓存占用情况"""
+        with self._connect() as conn:
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
+
+
+_default_cache: Optional[LLMResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """获取进程内共享的默认LLM回复缓存"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMResponseCache()
+        return _default_cache
+
+
+def get_cache_mode() -> str:
+    """读取环境变量 LLM_CACHE_MODE 配置的缓存模式"""
+    load_env()
+    mode = os.getenv('LLM_CACHE_MODE', 'readwrite').lower()
+    if mode not in CACHE_MODES:
+        raise ValueError(f"不支持的缓存模式: {mode}，可选值为 {', '.join(CACHE_MODES)}")
+    return mode
@@ -1,83 +1,1298 @@
-import openai
+import asyncio
+import json
 import os
-from typing import List
-from dotenv import load_dotenv
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
+from env_config import load_env
+from instrumentation import Tracer, percentile
+from llm_cache import CACHE_MODES, CacheMissError, LLMResponseCache, get_cache_mode, get_llm_cache
+from model_registry import get_model_router, get_registry
+
+# openai 和 httpx 的导入较慢，只在真正创建客户端时才导入
+if TYPE_CHECKING:
+    import httpx
+    import openai
+
+# 各服务商默认的并发与限速预算（rpm: 每分钟请求数, tpm: 每分钟token数）
+# 可通过环境变量 GPT_MAX_CONCURRENCY / GPT_RPM / GPT_TPM 等覆盖
+PROVIDER_LIMITS = {
+    "gpt": {"max_concurrency": 4, "rpm": 500, "tpm": 200000},
+    "deepseek": {"max_concurrency": 4, "rpm": 300, "tpm": 300000},
+}
+
+
+def _provider_setting(provider: str, key: str) -> int:
+    """读取服务商限速配置，环境变量优先，其次为注册表中的配置，未知服务商使用 gpt 的默认值"""
+    value = os.getenv(f"{provider.upper()}_{key.upper()}")
+    if value:
+        return int(value)
+    value = get_registry().provider_config(provider).get(key)
+    if value:
+        return int(value)
+    return PROVIDER_LIMITS.get(provider, PROVIDER_LIMITS["gpt"])[key]
+
+
+# 超时、重试、对冲请求和熔断的默认配置，可通过环境变量 LLM_TIMEOUT / LLM_MAX_RETRIES 等覆盖
+# timeout: 单次请求超时（秒）; deadline: 含重试在内的总时限（秒）
+# backoff_base / backoff_max: 指数退避的初始和最大等待时间（秒）
+# hedge_percentile: 请求耗时超过近期延迟的该百分位时再发一个相同请求，取先返回者，0 表示关闭
+# breaker_threshold: 连续失败多少次后熔断; breaker_reset: 熔断后多少秒允许试探请求
+RESILIENCE_DEFAULTS = {
+    "timeout": 60.0,
+    "deadline": 180.0,
+    "max_retries": 2,
+    "backoff_base": 0.5,
+    "backoff_max": 20.0,
+    "hedge_percentile": 0,
+    "breaker_threshold": 5,
+    "breaker_reset": 30.0,
+}
+
+# 对冲阈值至少需要的延迟样本数
+HEDGE_MIN_SAMPLES = 20
+
+
+class EmptyResponseError(RuntimeError):
+    """模型返回了空回复，按调用失败处理，不作为分析结果保存"""
+
+
+class StreamInterruptedError(RuntimeError):
+    """流式请求已经输出部分文本后失败，不再重试或切换备用模型，避免调用方收到重复片段"""
+
+
+def _resilience_setting(key: str) -> float:
+    """读取超时与重试配置，环境变量优先"""
+    value = os.getenv(f"LLM_{key.upper()}")
+    if value:
+        return float(value)
+    return RESILIENCE_DEFAULTS[key]
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗略估算token数（中文约一字一token，按字符数估算偏保守）"""
+    return len(text)
+
+
+class RateLimiter:
+    """滑动窗口限速器，同时限制每分钟请求数和token数，线程安全"""
+
+    def __init__(self, rpm: int, tpm: int, window: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._events = deque()  # (时间戳, token数)
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """预算允许时登记一个请求并返回 0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            while self._events and now - self._events[0][0] >= self.window:
+                self._tokens_in_window -= self._events.popleft()[1]
+            fits_requests = len(self._events) < self.rpm
+            # 单个请求超过整个tpm预算时，只要窗口为空也放行，避免永久阻塞
+            fits_tokens = self._tokens_in_window + tokens <= self.tpm or not self._events
+            if fits_requests and fits_tokens:
+                self._events.append((now, tokens))
+                self._tokens_in_window += tokens
+                return 0.0
+            return max(self.window - (now - self._events[0][0]), 0.01)
+
+    def acquire(self, tokens: int) -> None:
+        """阻塞直到预算允许再发出一个消耗 tokens 的请求"""
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int) -> None:
+        """acquire 的异步版本，等待期间不占用线程"""
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class ConcurrencyLimiter:
+    """
+    进程内共享的并发上限，线程和协程（可以在不同的事件循环中）都从同一个额度中占用请求名额，
+    按到达顺序放行等待者
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(int(limit), 1)
+        self._active = 0
+        self._waiters = deque()  # (事件循环, Future) 或 (None, threading.Event)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """阻塞直到有空闲名额"""
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            event = threading.Event()
+            self._waiters.append((None, event))
+        # 释放者直接把名额转交给等待者，被唤醒时已经持有名额
+        event.wait()
+
+    async def acquire_async(self) -> None:
+        """acquire 的异步版本，等待期间不占用线程"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            # 名额已经转交但 Future 被取消时，由 _wake 归还
+            raise
+
+    def try_acquire(self) -> bool:
+        """不等待地占用名额，没有空闲名额或已有等待者时返回 False"""
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return True
+            return False
+
+    def release(self) -> None:
+        """归还名额，有等待者且未超过上限时直接转交给最早的等待者"""
+        with self._lock:
+            if not self._waiters or self._active > self.limit:
+                self._active -= 1
+                return
+            waiter = self._waiters.popleft()
+        self._grant(waiter)
+
+    def set_limit(self, limit: int) -> None:
+        """调整上限，提高时立即放行等待者"""
+        granted = []
+        with self._lock:
+            self.limit = max(int(limit), 1)
+            while self._waiters and self._active < self.limit:
+                self._active += 1
+                granted.append(self._waiters.popleft())
+        for waiter in granted:
+            self._grant(waiter)
+
+    def _grant(self, waiter: Tuple[Any, Any]) -> None:
+        loop, handle = waiter
+        if loop is None:
+            handle.set()
+        else:
+            loop.call_soon_threadsafe(self._wake, handle)
+
+    def _wake(self, future: "asyncio.Future") -> None:
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+class CircuitBreaker:
+    """
+    服务商熔断器：连续失败 threshold 次后熔断，reset_timeout 秒后放行一个试探请求，
+    试探成功则恢复，失败则继续熔断
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+def _is_retryable(error: Exception) -> bool:
+    """超时、连接错误、限速和服务端错误可以重试，参数错误和鉴权失败不重试"""
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """解析限速响应头中的时长，支持 "1.5"、"200ms"、"6m0s" 等格式，返回秒数"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def _retry_delay(error: Exception, attempt: int, base: float, cap: float) -> float:
+    """
+    计算第 attempt 次重试前的等待时间：优先使用服务端在响应头中给出的等待时间，
+    否则按指数退避加随机抖动
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        delay = _parse_duration(headers["retry-after-ms"])
+        if delay is not None:
+            return delay / 1000
+    for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        if headers.get(name):
+            delay = _parse_duration(headers[name])
+            if delay is not None:
+                return delay
+    return min(base * (2 ** attempt), cap) * random.uniform(0.5, 1.0)
+
+
+def get_provider(model_name: str) -> str:
+    """根据模型名称判断服务商，注册表中登记的模型优先"""
+    provider = get_registry().provider_for(model_name)
+    if provider is not None:
+        return provider
+    if 'gpt' in model_name.lower():
+        return "gpt"
+    elif 'deepseek' in model_name.lower():
+        return "deepseek"
+    raise ValueError(f"不支持的模型名称: {model_name}")
+
+
+def create_http_client(max_connections: int = 20) -> "httpx.Client":
+    """创建支持长连接复用的HTTP连接池"""
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=60
+        )
+    )
+
+
+def _usage_dict(usage: Any) -> Optional[Dict[str, int]]:
+    """将响应中的 usage 对象转换为普通字典"""
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "total_tokens": getattr(usage, "total_tokens", 0) or 0
+    }
+
+
+# 两类任务的系统消息、进度提示和错误提示
+TASK_PROMPTS = {
+    "analysis": {
+        "system": "你是一个专业的股票分析师，请根据提供的信息进行股票分析。",
+        "progress": "正在分析第 {}/{} 只股票的信息...",
+        "error": "分析第 {} 只股票的信息时出现错误: {}",
+    },
+    "history": {
+        "system": "你是一个专业的股票分析师，请根据提供的信息对这支股票的历史信息进行总结。",
+        "progress": "正在总结第 {}/{} 只股票的历史数据...",
+        "error": "总结第 {} 只股票的历史数据时出现错误: {}",
+    },
+}
+
+
+# LLM调用失败时结果文本的前缀
+LLM_ERROR_PREFIX = "分析过程中出现错误"
+
+
+def is_error_result(text: Optional[str]) -> bool:
+    """结果是否为LLM调用失败的错误信息，空结果同样视为失败"""
+    return not text or text.startswith(LLM_ERROR_PREFIX)
+
+
+# 打包模式的输出要求，{keys} 为本次请求中的全部股票代码
+PACK_INSTRUCTION = """以下是 {count} 只股票各自独立的分析任务，请逐一完成。
+请严格按JSON格式输出，键为股票代码 {keys}，值为该股票的完整分析结果文本，不要输出其他内容：
+{{"股票代码": "分析结果", ...}}"""
+
+
+def _parse_json_reply(text: str) -> Dict[str, Any]:
+    """解析打包请求的JSON回复，兼容被 ``` 代码块包裹的输出"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.startswith("json"):
+            text = text[4:]
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end == -1:
+        raise ValueError("打包回复中没有JSON对象")
+    replies = json.loads(text[start:end + 1])
+    if not isinstance(replies, dict):
+        raise ValueError("打包回复不是JSON对象")
+    return replies
+
+
+# 同一服务商的所有AgentCall共享限速预算和并发上限
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+_CONCURRENCY_LIMITERS: Dict[str, ConcurrencyLimiter] = {}
+
+
+_CIRCUIT_BREAKERS: Dict[str, CircuitBreaker] = {}
+_CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    """获取服务商共享的熔断器"""
+    with _CIRCUIT_BREAKERS_LOCK:
+        breaker = _CIRCUIT_BREAKERS.get(provider)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                int(_resilience_setting("breaker_threshold")),
+                _resilience_setting("breaker_reset")
+            )
+            _CIRCUIT_BREAKERS[provider] = breaker
+        return breaker
+
+
+def get_rate_limiter(provider: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> RateLimiter:
+    """获取服务商共享的限速器，显式传入的 rpm/tpm 会更新已有限速器的预算"""
+    with _RATE_LIMITERS_LOCK:
+        limiter = _RATE_LIMITERS.get(provider)
+        if limiter is None:
+            limiter = RateLimiter(
+                rpm or _provider_setting(provider, "rpm"),
+                tpm or _provider_setting(provider, "tpm"),
+            )
+            _RATE_LIMITERS[provider] = limiter
+        else:
+            if rpm:
+                limiter.rpm = rpm
+            if tpm:
+                limiter.tpm = tpm
+        return limiter
+
+
+def get_concurrency_limiter(provider: str) -> ConcurrencyLimiter:
+    """
+    获取服务商共享的并发上限，同时发出的请求数不超过服务商配置的 max_concurrency
+    （环境变量 {PROVIDER}_MAX_CONCURRENCY 或注册表），不受单次调用的线程池大小、
+    批处理或HTTP服务中并行调用数量的影响
+    """
+    with _RATE_LIMITERS_LOCK:
+        limiter = _CONCURRENCY_LIMITERS.get(provider)
+        if limiter is None:
+            limiter = ConcurrencyLimiter(_provider_setting(provider, "max_concurrency"))
+            _CONCURRENCY_LIMITERS[provider] = limiter
+        return limiter
+
 
-# 加载环境变量
-load_dotenv()
 class AgentCall:
     """LLM调用类，支持多种大语言模型"""
     
-    def __init__(self, model_name: str):
+    def __init__(
+        self,
+        model_name: str,
+        max_concurrency: Optional[int] = None,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        cache_mode: Optional[str] = None,
+        cache: Optional[LLMResponseCache] = None,
+        client: Optional["openai.OpenAI"] = None,
+        http_client: Optional["httpx.Client"] = None,
+        pack_token_budget: Optional[int] = None,
+        fallback_model: Optional[str] = None
+    ):
+        """
+        Args:
+            model_name: 模型名称
+            max_concurrency: 本实例的最大并发请求数，1 表示逐条串行调用，默认读取服务商配置；
+                只限制本实例，同一服务商所有实例合计的上限仍由服务商配置决定
+            rpm: 每分钟请求数预算，默认读取服务商配置
+            tpm: 每分钟token数预算，默认读取服务商配置
+            cache_mode: 回复缓存模式 off/readwrite/replay，默认读取环境变量 LLM_CACHE_MODE
+            cache: 回复缓存，默认使用共享的本地缓存
+            client: 复用已有的客户端，不传则新建
+            http_client: 新建客户端时使用的HTTP连接池，便于多个客户端共享长连接
+            pack_token_budget: 打包模式下单次请求的token预算（输入加输出），
+                多只股票的提示词会合并为一个请求；默认读取环境变量 LLM_PACK_TOKEN_BUDGET，为空时不打包
+            fallback_model: 服务商熔断或重试耗尽时切换到的备用模型，默认读取环境变量
+                GPT_FALLBACK_MODEL / DEEPSEEK_FALLBACK_MODEL，传入空字符串表示不切换
+        """
+        load_env()
         self.model_name = model_name
-        self.client = self._create_client()
+        self.temperature = 0.3
+        self.max_tokens = 1000
+        self.provider = self._get_provider()
+        self.cache_mode = cache_mode or get_cache_mode()
+        if self.cache_mode not in CACHE_MODES:
+            raise ValueError(f"不支持的缓存模式: {self.cache_mode}")
+        self.cache = None if self.cache_mode == "off" else (cache or get_llm_cache())
+        # 回放模式完全不访问网络，因此无需API密钥
+        if client is None and self.cache_mode != "replay":
+            client = self._create_client(http_client)
+        self.client = client
+        self.http_client = http_client
+        self.max_concurrency = max_concurrency or _provider_setting(self.provider, "max_concurrency")
+        self.rate_limiter = get_rate_limiter(self.provider, rpm, tpm)
+        self.concurrency_limiter = get_concurrency_limiter(self.provider)
+        self.timeout = _resilience_setting("timeout")
+        self.deadline = _resilience_setting("deadline")
+        self.max_retries = int(_resilience_setting("max_retries"))
+        self.backoff_base = _resilience_setting("backoff_base")
+        self.backoff_max = _resilience_setting("backoff_max")
+        self.hedge_percentile = _resilience_setting("hedge_percentile")
+        self.breaker = get_circuit_breaker(self.provider)
+        if fallback_model is None:
+            fallback_model = os.getenv(f"{self.provider.upper()}_FALLBACK_MODEL", "")
+        self.fallback_model = fallback_model or None
+        self._fallback: Optional["AgentCall"] = None
+        self._latencies = deque(maxlen=200)
+        self._latency_lock = threading.Lock()
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        # 异步客户端的连接池绑定创建它的事件循环，按事件循环分别创建
+        self._async_client: Optional[Tuple[Any, "openai.AsyncOpenAI"]] = None
+        if pack_token_budget is None and os.getenv('LLM_PACK_TOKEN_BUDGET'):
+            pack_token_budget = int(os.getenv('LLM_PACK_TOKEN_BUDGET'))
+        self.pack_token_budget = pack_token_budget
     
-    def _create_client(self):
-        if 'gpt' in self.model_name.lower():
+    def _get_provider(self) -> str:
+        return get_provider(self.model_name)
+
+    def _create_client(self, http_client: Optional["httpx.Client"] = None, use_async: bool = False):
+        import openai
+
+        client_class = openai.AsyncOpenAI if use_async else openai.OpenAI
+        if self.provider == "gpt":
             api_key = os.getenv('OPENAI_API_KEY')
             base_url = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
             if not api_key or api_key == 'your_openai_api_key_here':
                 raise ValueError("请在.env文件中设置正确的OPENAI_API_KEY")
-            return openai.OpenAI(api_key=api_key, base_url=base_url)
-        elif 'deepseek' in self.model_name.lower():
+            return client_class(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        elif self.provider == "deepseek":
             api_key = os.getenv('deepseek_API_KEY')
             base_url = "https://api.deepseek.com/v1"
             if not api_key:
                 raise ValueError("请在.env文件中设置正确的deepseek_API_KEY")
-            return openai.OpenAI(api_key=api_key, base_url=base_url)
+            return client_class(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
         else:
-            raise ValueError(f"不支持的模型名称: {self.model_name}")
+            # 注册表中的 OpenAI 兼容服务，本地部署的服务可以不设置密钥
+            config = get_registry().provider_config(self.provider)
+            if not config.get("base_url"):
+                raise ValueError(f"请在.env文件中设置 {self.provider.upper()}_BASE_URL")
+            return client_class(
+                api_key=config.get("api_key") or "EMPTY",
+                base_url=config["base_url"],
+                http_client=http_client,
+                max_retries=0
+            )
 
-    def infomation_prompts_analysis(self, prompt_list: List[str]) -> List[str]:
+    def _get_async_client(self) -> "openai.AsyncOpenAI":
+        """获取当前事件循环的 AsyncOpenAI 客户端，首次使用时创建"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client[0] is not loop:
+            self._async_client = (loop, self._create_client(use_async=True))
+        return self._async_client[1]
+
+    def close(self) -> None:
+        """关闭对冲请求使用的线程池（包括备用模型的），HTTP连接池由创建方负责关闭"""
+        with self._latency_lock:
+            pool, self._hedge_pool = self._hedge_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+        if self._fallback is not None:
+            self._fallback.close()
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的异步客户端和对冲请求线程池（包括备用模型的）"""
+        if self._async_client is not None:
+            loop, client = self._async_client
+            self._async_client = None
+            if loop is asyncio.get_running_loop():
+                await client.close()
+        if self._fallback is not None:
+            await self._fallback.aclose()
+        self.close()
+
+    def _cache_key(self, system_prompt: str, prompt: str, packed: bool = False) -> Optional[str]:
         """
-        分析提示词列表，直接返回AI的完整分析结果文本
+        回复缓存的键；packed 为 True 时为打包请求拆分出的单只结果的键，
+        其中包含打包输出要求，与直接请求同一提示词的回复互不命中
         """
-        results = []
-        for i, prompt in enumerate(prompt_list):
+        if self.cache is None:
+            return None
+        if packed:
+            system_prompt = f"{system_prompt}\n\n{PACK_INSTRUCTION}"
+        return LLMResponseCache.make_key(
+            self.model_name, system_prompt, prompt, self.temperature, self.max_tokens
+        )
+
+    def _complete(
+        self,
+        system_prompt: str,
+        prompt: str,
+        on_token: Optional[Callable[[str], None]] = None,
+        max_tokens: Optional[int] = None,
+        json_mode: bool = False
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        优先读取回复缓存，未命中时在限速预算内发出单次对话请求
+
+        传入 on_token 时以流式方式请求，每收到一段文本就回调一次；命中缓存时整段回调一次。
+        传入 max_tokens 或 json_mode 的请求（如打包请求）不读写缓存。
+
+        Returns:
+            (回复文本, 请求信息)，请求信息包含 cached、retries 和 usage
+        """
+        key = None
+        if max_tokens is None and not json_mode:
+            key = self._cache_key(system_prompt, prompt)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                if on_token is not None:
+                    on_token(cached)
+                return cached, {"cached": True, "retries": 0, "usage": None}
+            if self.cache_mode == "replay":
+                raise CacheMissError(f"回放模式下缓存未命中: {key}")
+        if self.client is None:
+            raise CacheMissError("回放模式下不能发出新的请求")
+        if not self.breaker.allow():
+            if self._get_fallback() is None:
+                raise RuntimeError(f"服务商 {self.provider} 已熔断，暂停请求")
+            return self._failover(system_prompt, prompt, on_token, max_tokens, json_mode, "已熔断")
+        # 备用模型收到调用方原始的 max_tokens，未指定时按自己的缓存键和默认值处理
+        request_max_tokens = max_tokens or self.max_tokens
+        request = dict(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=self.temperature,
+            max_tokens=request_max_tokens
+        )
+        if json_mode:
+            request["response_format"] = {"type": "json_object"}
+        if on_token is not None:
+            request.update(stream=True, stream_options={"include_usage": True})
+        try:
+            analysis_text, usage, retries = self._send(
+                request, on_token, _estimate_tokens(system_prompt + prompt) + request_max_tokens
+            )
+        except Exception as e:
+            # 只有超时、连接和服务端错误计入熔断，参数错误说明服务商本身可用
+            cause = e.__cause__ if isinstance(e, StreamInterruptedError) else e
+            if _is_retryable(cause) or isinstance(cause, TimeoutError):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if isinstance(e, StreamInterruptedError) or self._get_fallback() is None:
+                raise
+            return self._failover(system_prompt, prompt, on_token, max_tokens, json_mode, str(e))
+        self.breaker.record_success()
+        if key is not None and analysis_text is not None:
+            self.cache.put(key, analysis_text)
+        meta = {
+            "cached": False,
+            "retries": retries,
+            "usage": _usage_dict(usage)
+        }
+        return analysis_text, meta
+
+    def _get_fallback(self) -> Optional["AgentCall"]:
+        """按需创建备用模型的AgentCall，备用模型自身不再切换"""
+        if self.fallback_model is None:
+            return None
+        if self._fallback is None:
             try:
-                print(f"正在分析第 {i+1}/{len(prompt_list)} 只股票的信息...")
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[
-                        {"role": "system", "content": "你是一个专业的股票分析师，请根据提供的信息进行股票分析。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3,
-                    max_tokens=1000
+                # 并发上限按备用模型所属服务商的配置，不用主模型的值覆盖
+                self._fallback = AgentCall(
+                    self.fallback_model,
+                    cache_mode=self.cache_mode,
+                    cache=self.cache,
+                    http_client=self.http_client,
+                    fallback_model=""
                 )
-                analysis_text = response.choices[0].message.content
-                results.append(analysis_text)
+            except ValueError as e:
+                print(f"备用模型 {self.fallback_model} 不可用: {e}")
+                self.fallback_model = None
+        return self._fallback
+
+    def _failover(
+        self,
+        system_prompt: str,
+        prompt: str,
+        on_token: Optional[Callable[[str], None]],
+        max_tokens: Optional[int],
+        json_mode: bool,
+        reason: str
+    ) -> Tuple[str, Dict[str, Any]]:
+        """主服务商不可用时改用备用模型完成请求"""
+        print(f"{self.model_name} 请求失败（{reason}），切换到备用模型 {self.fallback_model}")
+        text, meta = self._get_fallback()._complete(system_prompt, prompt, on_token, max_tokens, json_mode)
+        meta["failover"] = self.fallback_model
+        return text, meta
+
+    def _send(
+        self,
+        request: Dict[str, Any],
+        on_token: Optional[Callable[[str], None]],
+        tokens: int
+    ) -> Tuple[str, Any, int]:
+        """
+        在总时限内发出请求，可重试的错误按指数退避重试，服务端给出等待时间时按其等待；
+        流式请求输出过文本后失败时抛出 StreamInterruptedError
+
+        Returns:
+            (回复文本, usage, 重试次数)
+        """
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        emitted = []
+        if on_token is not None:
+            # 流式请求已经输出过文本时不再重试，避免调用方收到重复片段
+            forward = on_token
+            on_token = lambda delta: (emitted.append(True), forward(delta))
+        while True:
+            self.rate_limiter.acquire(tokens)
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise TimeoutError(f"请求超过总时限 {self.deadline:.0f}s")
+                timed_request = dict(request, timeout=min(self.timeout, remaining))
+                # 只在请求进行期间占用并发名额，退避等待时归还
+                self.concurrency_limiter.acquire()
+                if on_token is None and self.hedge_percentile:
+                    # 对冲时每个请求在完成时各自归还名额
+                    text, usage = self._hedged_attempt(timed_request, tokens)
+                else:
+                    try:
+                        text, usage = self._attempt(timed_request, on_token)
+                    finally:
+                        self.concurrency_limiter.release()
+                return text, usage, attempt
             except Exception as e:
-                print(f"分析第 {i+1} 只股票的信息时出现错误: {e}")
-                results.append(f"分析过程中出现错误: {str(e)}")
-        return results
-    
-    def history_prompts_analysis(self, prompt_list: List[str]) -> List[str]:
+                if emitted:
+                    raise StreamInterruptedError(f"流式输出中断: {e}") from e
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = _retry_delay(e, attempt, self.backoff_base, self.backoff_max)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    def _attempt(
+        self,
+        request: Dict[str, Any],
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> Tuple[str, Any]:
+        """发出一次请求，返回 (回复文本, usage)，并记录延迟供对冲阈值使用"""
+        start = time.perf_counter()
+        response = self.client.chat.completions.with_raw_response.create(**request).parse()
+        usage = None
+        if on_token is None:
+            analysis_text = response.choices[0].message.content
+            usage = response.usage
+        else:
+            parts = []
+            for chunk in response:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    on_token(delta)
+            analysis_text = "".join(parts)
+        with self._latency_lock:
+            self._latencies.append(time.perf_counter() - start)
+        if not analysis_text:
+            raise EmptyResponseError("模型返回了空回复")
+        return analysis_text, usage
+
+    def _hedge_threshold(self) -> Optional[float]:
+        """近期请求延迟的 hedge_percentile 百分位，样本不足时返回 None"""
+        with self._latency_lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = list(self._latencies)
+        return percentile(latencies, self.hedge_percentile)
+
+    def _hedged_attempt(self, request: Dict[str, Any], tokens: int) -> Tuple[str, Any]:
         """
-        分析提示词列表，直接返回AI的完整分析结果文本
+        对冲请求：主请求耗时超过阈值仍未返回时再发一个相同请求，取先成功的结果，
+        两个请求都失败时抛出后返回者的异常
+
+        调用前已为主请求占用并发名额；对冲请求只在有空闲名额时发出，
+        每个请求在完成时归还自己的名额，落后的请求继续占用名额直到结束
         """
-        results = []
-        for i, prompt in enumerate(prompt_list):
+        limiter = self.concurrency_limiter
+        threshold = self._hedge_threshold()
+        if threshold is None:
             try:
-                print(f"正在总结第 {i+1}/{len(prompt_list)} 只股票的历史数据...")
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[
-                        {"role": "system", "content": "你是一个专业的股票分析师，请根据提供的信息对这支股票的历史信息进行总结。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3,
-                    max_tokens=1000
-                )
+                return self._attempt(request)
+            finally:
+                limiter.release()
+        with self._latency_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=max(self.max_concurrency, 1) * 2)
+            pool = self._hedge_pool
+        try:
+            primary = pool.submit(self._attempt, request)
+        except Exception:
+            limiter.release()
+            raise
+        primary.add_done_callback(lambda _: limiter.release())
+        try:
+            return primary.result(timeout=threshold)
+        except FutureTimeoutError:
+            pass
+        if not limiter.try_acquire():
+            return primary.result()
+        try:
+            self.rate_limiter.acquire(tokens)
+            hedge = pool.submit(self._attempt, request)
+        except Exception:
+            limiter.release()
+            raise
+        hedge.add_done_callback(lambda _: limiter.release())
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        first = done.pop()
+        if first.exception() is None:
+            return first.result()
+        other = hedge if first is primary else primary
+        return other.result()
+
+    async def _acomplete(
+        self,
+        system_prompt: str,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        json_mode: bool = False
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        _complete 的异步版本，使用 AsyncOpenAI 发出请求，缓存、熔断和备用模型切换的规则相同；
+        异步路径不支持流式输出和对冲请求；缓存读写访问SQLite，放到线程中执行，不阻塞事件循环
+        """
+        key = None
+        if max_tokens is None and not json_mode:
+            key = self._cache_key(system_prompt, prompt)
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached, {"cached": True, "retries": 0, "usage": None}
+            if self.cache_mode == "replay":
+                raise CacheMissError(f"回放模式下缓存未命中: {key}")
+        if self.cache_mode == "replay":
+            raise CacheMissError("回放模式下不能发出新的请求")
+        if not self.breaker.allow():
+            if self._get_fallback() is None:
+                raise RuntimeError(f"服务商 {self.provider} 已熔断，暂停请求")
+            return await self._afailover(system_prompt, prompt, max_tokens, json_mode, "已熔断")
+        request_max_tokens = max_tokens or self.max_tokens
+        request = dict(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=self.temperature,
+            max_tokens=request_max_tokens
+        )
+        if json_mode:
+            request["response_format"] = {"type": "json_object"}
+        try:
+            analysis_text, usage, retries = await self._asend(
+                request, _estimate_tokens(system_prompt + prompt) + request_max_tokens
+            )
+        except Exception as e:
+            if _is_retryable(e) or isinstance(e, TimeoutError):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if self._get_fallback() is None:
+                raise
+            return await self._afailover(system_prompt, prompt, max_tokens, json_mode, str(e))
+        self.breaker.record_success()
+        if key is not None and analysis_text is not None:
+            await asyncio.to_thread(self.cache.put, key, analysis_text)
+        return analysis_text, {"cached": False, "retries": retries, "usage": _usage_dict(usage)}
+
+    async def _afailover(
+        self,
+        system_prompt: str,
+        prompt: str,
+        max_tokens: Optional[int],
+        json_mode: bool,
+        reason: str
+    ) -> Tuple[str, Dict[str, Any]]:
+        """_failover 的异步版本"""
+        print(f"{self.model_name} 请求失败（{reason}），切换到备用模型 {self.fallback_model}")
+        text, meta = await self._get_fallback()._acomplete(system_prompt, prompt, max_tokens, json_mode)
+        meta["failover"] = self.fallback_model
+        return text, meta
+
+    async def _asend(self, request: Dict[str, Any], tokens: int) -> Tuple[str, Any, int]:
+        """_send 的异步版本，限速和退避等待都不占用线程"""
+        client = self._get_async_client()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire_async(tokens)
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise TimeoutError(f"请求超过总时限 {self.deadline:.0f}s")
+                await self.concurrency_limiter.acquire_async()
+                try:
+                    start = time.perf_counter()
+                    response = await client.chat.completions.create(
+                        **request, timeout=min(self.timeout, remaining)
+                    )
+                finally:
+                    self.concurrency_limiter.release()
+                with self._latency_lock:
+                    self._latencies.append(time.perf_counter() - start)
                 analysis_text = response.choices[0].message.content
-                results.append(analysis_text)
+                if not analysis_text:
+                    raise EmptyResponseError("模型返回了空回复")
+                return analysis_text, response.usage, attempt
             except Exception as e:
-                print(f"总结第 {i+1} 只股票的历史数据时出现错误: {e}")
-                results.append(f"分析过程中出现错误: {str(e)}")
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = _retry_delay(e, attempt, self.backoff_base, self.backoff_max)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def run_task(
+        self,
+        kind: str,
+        prompt: str,
+        index: int = 0,
+        total: int = 1,
+        on_token: Optional[Callable[[str], None]] = None,
+        tracer: Optional[Tracer] = None,
+        tag: Optional[str] = None
+    ) -> str:
+        """
+        执行单条分析（kind='analysis'）或历史总结（kind='history'）任务，
+        出错时返回错误信息文本，不抛出异常；传入 tracer 时记录延迟、重试和token用量
+        """
+        task = TASK_PROMPTS[kind]
+        start = time.perf_counter()
+        meta: Dict[str, Any] = {}
+        error = None
+        try:
+            print(task["progress"].format(index + 1, total))
+            analysis_text, meta = self._complete(task["system"], prompt, on_token)
+            return analysis_text
+        except CacheMissError as e:
+            # 回放模式要求严格确定性，缓存未命中直接中止整个批次
+            error = str(e)
+            raise
+        except Exception as e:
+            error = str(e)
+            print(task["error"].format(index + 1, e))
+            return f"{LLM_ERROR_PREFIX}: {str(e)}"
+        finally:
+            latency = time.perf_counter() - start
+            # 切换到备用模型时，延迟和用量记在实际回答的模型上
+            answered_by = meta.get("failover") or self.model_name
+            if not meta.get("cached"):
+                get_model_router().observe(answered_by, tag, latency, meta.get("usage"), error is not None)
+            if tracer is not None:
+                tracer.record_llm_call(
+                    answered_by,
+                    kind,
+                    latency,
+                    retries=meta.get("retries", 0),
+                    usage=meta.get("usage"),
+                    cached=meta.get("cached", False),
+                    error=error,
+                    tag=tag,
+                    index=index
+                )
+
+    async def arun_task(
+        self,
+        kind: str,
+        prompt: str,
+        index: int = 0,
+        total: int = 1,
+        tracer: Optional[Tracer] = None,
+        tag: Optional[str] = None
+    ) -> str:
+        """run_task 的异步版本，出错时同样返回错误信息文本，回放模式缓存未命中时抛出"""
+        task = TASK_PROMPTS[kind]
+        start = time.perf_counter()
+        meta: Dict[str, Any] = {}
+        error = None
+        try:
+            print(task["progress"].format(index + 1, total))
+            analysis_text, meta = await self._acomplete(task["system"], prompt)
+            return analysis_text
+        except CacheMissError as e:
+            error = str(e)
+            raise
+        except Exception as e:
+            error = str(e)
+            print(task["error"].format(index + 1, e))
+            return f"{LLM_ERROR_PREFIX}: {str(e)}"
+        finally:
+            latency = time.perf_counter() - start
+            # 切换到备用模型时，延迟和用量记在实际回答的模型上
+            answered_by = meta.get("failover") or self.model_name
+            if not meta.get("cached"):
+                get_model_router().observe(answered_by, tag, latency, meta.get("usage"), error is not None)
+            if tracer is not None:
+                tracer.record_llm_call(
+                    answered_by,
+                    kind,
+                    latency,
+                    retries=meta.get("retries", 0),
+                    usage=meta.get("usage"),
+                    cached=meta.get("cached", False),
+                    error=error,
+                    tag=tag,
+                    index=index
+                )
+
+    def iter_prompts_analysis(
+        self,
+        prompt_list: List[Optional[str]],
+        kind: str,
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        并发处理提示词列表，按完成顺序逐条产出 (序号, 结果文本)，值为 None 的提示词直接跳过
+
+        Args:
+            prompt_list: 提示词列表
+            kind: 任务类型，'analysis' 或 'history'
+            tracer: 可选的性能埋点
+            tags: 可选的每条提示词标签（如分析风格），用于分组统计token用量
+        """
+        pending = [(i, prompt) for i, prompt in enumerate(prompt_list) if prompt is not None]
+
+        def run_one(i: int, prompt: str) -> str:
+            tag = tags[i] if tags and i < len(tags) else None
+            return self.run_task(kind, prompt, i, len(prompt_list), tracer=tracer, tag=tag)
+
+        workers = min(self.max_concurrency, len(pending))
+        if workers <= 1:
+            for i, prompt in pending:
+                yield i, run_one(i, prompt)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_one, i, prompt): i for i, prompt in pending}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _run_prompts(
+        self,
+        prompt_list: List[Optional[str]],
+        kind: str,
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """
+        并发处理提示词列表，结果按输入顺序返回，单条失败不影响其他提示词；
+        值为 None 的提示词不调用LLM，对应结果为 None。
+        传入 on_result 时每条结果完成后立即回调 (序号, 结果文本)，例如用于保存检查点
+        """
+        results = [None] * len(prompt_list)
+        for i, text in self.iter_prompts_analysis(prompt_list, kind, tracer, tags):
+            results[i] = text
+            if on_result is not None:
+                on_result(i, text)
+        return results
+
+    async def _arun_prompts(
+        self,
+        prompt_list: List[Optional[str]],
+        kind: str,
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """_run_prompts 的异步版本，同时进行的请求数不超过 max_concurrency"""
+        results: List[Optional[str]] = [None] * len(prompt_list)
+        semaphore = asyncio.Semaphore(max(self.max_concurrency, 1))
+
+        async def run_one(i: int, prompt: str) -> None:
+            tag = tags[i] if tags and i < len(tags) else None
+            async with semaphore:
+                text = await self.arun_task(kind, prompt, i, len(prompt_list), tracer=tracer, tag=tag)
+            results[i] = text
+            if on_result is not None:
+                # 回调通常写入检查点数据库，放到线程中执行
+                await asyncio.to_thread(on_result, i, text)
+
+        await asyncio.gather(*(run_one(i, prompt) for i, prompt in enumerate(prompt_list) if prompt is not None))
         return results
 
-def create_agent_call(model_name: str) -> AgentCall:
-    return AgentCall(model_name)
+    def _plan_packs(self, pending: List[Tuple[int, str]]) -> List[List[Tuple[int, str]]]:
+        """按token预算把待处理的提示词贪心分组，每组的输入加预留输出不超过预算"""
+        system_tokens = _estimate_tokens(PACK_INSTRUCTION)
+        packs: List[List[Tuple[int, str]]] = []
+        current: List[Tuple[int, str]] = []
+        used = system_tokens
+        for i, prompt in pending:
+            cost = _estimate_tokens(prompt) + self.max_tokens
+            if current and used + cost > self.pack_token_budget:
+                packs.append(current)
+                current, used = [], system_tokens
+            current.append((i, prompt))
+            used += cost
+        if current:
+            packs.append(current)
+        return packs
+
+    def _run_pack(
+        self,
+        kind: str,
+        pack: List[Tuple[int, str]],
+        labels: List[str],
+        tracer: Optional[Tracer] = None
+    ) -> Dict[int, str]:
+        """
+        发出一个打包请求，返回成功解析出的 {序号: 结果文本}，缺失或解析失败的股票不在结果中
+        """
+        keys = {}
+        for i, _ in pack:
+            label = labels[i]
+            if label in keys.values():
+                label = f"{label}#{i + 1}"
+            keys[i] = label
+        sections = "\n\n".join(f"### {keys[i]}\n{prompt}" for i, prompt in pack)
+        packed_prompt = PACK_INSTRUCTION.format(count=len(pack), keys=json.dumps(list(keys.values()), ensure_ascii=False))
+        packed_prompt += "\n\n" + sections
+        start = time.perf_counter()
+        meta: Dict[str, Any] = {}
+        error = None
+        parsed: Dict[int, str] = {}
+        try:
+            print(f"正在打包处理 {len(pack)} 只股票: {', '.join(keys.values())}")
+            text, meta = self._complete(
+                TASK_PROMPTS[kind]["system"],
+                packed_prompt,
+                max_tokens=self.max_tokens * len(pack),
+                json_mode=True
+            )
+            replies = _parse_json_reply(text)
+            for i, _ in pack:
+                value = replies.get(keys[i])
+                if value is None or value == "":
+                    continue
+                parsed[i] = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        except CacheMissError:
+            raise
+        except Exception as e:
+            error = str(e)
+            print(f"打包请求失败，将逐只重试: {e}")
+        finally:
+            # 打包请求的延迟和token用量与单条请求不可比，不计入路由统计
+            latency = time.perf_counter() - start
+            if tracer is not None:
+                tracer.record_llm_call(
+                    self.model_name,
+                    kind,
+                    latency,
+                    retries=meta.get("retries", 0),
+                    usage=meta.get("usage"),
+                    error=error,
+                    tag="packed",
+                    indices=[i for i, _ in pack]
+                )
+        # 拆分后的单只结果是按打包要求和预算生成的，以打包专用的键写入缓存，只在之后的打包请求中复用
+        system_prompt = TASK_PROMPTS[kind]["system"]
+        for i, prompt in pack:
+            key = self._cache_key(system_prompt, prompt, packed=True)
+            if key is not None and i in parsed:
+                self.cache.put(key, parsed[i])
+        return parsed
+
+    def packed_prompts_analysis(
+        self,
+        prompt_list: List[Optional[str]],
+        kind: str,
+        labels: List[str],
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """
+        打包模式：把多只股票的提示词合并为一个请求，要求模型按股票代码输出JSON后再拆分
+
+        已缓存的提示词（单条请求或此前打包请求的结果）直接使用缓存；打包回复中缺失的股票会单独重新请求。
+
+        Args:
+            prompt_list: 提示词列表，值为 None 的提示词不调用LLM
+            kind: 任务类型，'analysis' 或 'history'
+            labels: 与提示词一一对应的股票代码，作为JSON输出的键
+            tracer: 可选的性能埋点
+            tags: 可选的每条提示词标签，用于单独重试时分组统计token用量
+            on_result: 可选的回调，每只股票的结果拆分出来后立即调用 (序号, 结果文本)，缓存命中的结果同样回调
+        """
+        results: List[Optional[str]] = [None] * len(prompt_list)
+        system_prompt = TASK_PROMPTS[kind]["system"]
+        pending = []
+        for i, prompt in enumerate(prompt_list):
+            if prompt is None:
+                continue
+            key = self._cache_key(system_prompt, prompt)
+            cached = self.cache.get(key) if key is not None else None
+            if cached is None and key is not None:
+                cached = self.cache.get(self._cache_key(system_prompt, prompt, packed=True))
+            if cached is not None:
+                results[i] = cached
+                if on_result is not None:
+                    on_result(i, cached)
+            elif self.cache_mode == "replay":
+                raise CacheMissError(f"回放模式下缓存未命中: {key}")
+            else:
+                pending.append((i, prompt))
+
+        packs = self._plan_packs(pending)
+        workers = max(min(self.max_concurrency, len(packs)), 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for parsed in pool.map(lambda pack: self._run_pack(kind, pack, labels, tracer), packs):
+                for i, text in parsed.items():
+                    results[i] = text
+                    if on_result is not None:
+                        on_result(i, text)
+
+        retry = [prompt if results[i] is None else None for i, prompt in enumerate(prompt_list)]
+        for i, text in self.iter_prompts_analysis(retry, kind, tracer, tags):
+            results[i] = text
+            if on_result is not None:
+                on_result(i, text)
+        return results
+
+    def _dispatch(
+        self,
+        prompt_list: List[Optional[str]],
+        kind: str,
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        labels: Optional[List[str]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """配置了打包预算且提供了股票代码时使用打包模式，否则逐条请求"""
+        if self.pack_token_budget and labels:
+            return self.packed_prompts_analysis(prompt_list, kind, labels, tracer, tags, on_result)
+        return self._run_prompts(prompt_list, kind, tracer, tags, on_result)
+
+    def infomation_prompts_analysis(
+        self,
+        prompt_list: List[Optional[str]],
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        labels: Optional[List[str]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """
+        分析提示词列表，直接返回AI的完整分析结果文本
+        """
+        return self._dispatch(prompt_list, "analysis", tracer, tags, labels, on_result)
+    
+    def history_prompts_analysis(
+        self,
+        prompt_list: List[Optional[str]],
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        labels: Optional[List[str]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """
+        分析提示词列表，直接返回AI的完整分析结果文本
+        """
+        return self._dispatch(prompt_list, "history", tracer, tags, labels, on_result)
+
+    async def _adispatch(
+        self,
+        prompt_list: List[Optional[str]],
+        kind: str,
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        labels: Optional[List[str]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """_dispatch 的异步版本；打包模式的请求数本就很少，复用同步实现并在线程中运行"""
+        if self.pack_token_budget and labels:
+            return await asyncio.to_thread(
+                self.packed_prompts_analysis, prompt_list, kind, labels, tracer, tags, on_result
+            )
+        return await self._arun_prompts(prompt_list, kind, tracer, tags, on_result)
+
+    async def ainfomation_prompts_analysis(
+        self,
+        prompt_list: List[Optional[str]],
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        labels: Optional[List[str]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """infomation_prompts_analysis 的异步版本"""
+        return await self._adispatch(prompt_list, "analysis", tracer, tags, labels, on_result)
+
+    async def ahistory_prompts_analysis(
+        self,
+        prompt_list: List[Optional[str]],
+        tracer: Optional[Tracer] = None,
+        tags: Optional[List[Optional[str]]] = None,
+        labels: Optional[List[str]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[str]]:
+        """history_prompts_analysis 的异步版本"""
+        return await self._adispatch(prompt_list, "history", tracer, tags, labels, on_result)
+
+def create_agent_call(model_name: str, **kwargs) -> AgentCall:
+    return AgentCall(model_name, **kwargs)
 
 if __name__ == "__main__":
     # 测试代码
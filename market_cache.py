@@ -0,0 +1,146 @@
+# market_cache.py - 行情数据本地缓存
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from env_config import load_env
+
+
+class MarketDataCache:
+    """
+    基于SQLite的行情数据缓存，按 (股票代码, 日期, 数据类型) 存储
+
+    在该日期收盘之后获取的数据不会再变化，永久有效；收盘前获取的数据（实时快照或盘中K线）
+    在 info_ttl 秒后过期，需要重新获取。收盘时间按交易所时区计算（环境变量 MARKET_CLOSE_TIME /
+    MARKET_TIMEZONE），因此在收盘前缓存的历史日期条目也会按有效期刷新。
+    """
+
+    def __init__(
+        self,
+        cache_file: Optional[str] = None,
+        info_ttl: Optional[float] = None,
+        close_time: Optional[str] = None,
+        timezone: Optional[str] = None
+    ):
+        """
+        Args:
+            cache_file: 缓存数据库路径，默认读取环境变量 MARKET_CACHE_FILE
+            info_ttl: 收盘前获取的数据的有效期（秒），默认读取环境变量 MARKET_CACHE_TTL
+            close_time: 收盘时间（HH:MM），默认读取环境变量 MARKET_CLOSE_TIME
+            timezone: 交易所时区，默认读取环境变量 MARKET_TIMEZONE
+        """
+        load_env()
+        self.cache_file = cache_file or os.getenv('MARKET_CACHE_FILE', 'data/market_cache.db')
+        if info_ttl is None:
+            info_ttl = float(os.getenv('MARKET_CACHE_TTL', '900'))
+        self.info_ttl = info_ttl
+        hour, minute = (close_time or os.getenv('MARKET_CLOSE_TIME') or '16:00').split(':')
+        self.close_hour, self.close_minute = int(hour), int(minute)
+        self.timezone = timezone or os.getenv('MARKET_TIMEZONE') or 'America/New_York'
+        self._tzinfo = None
+        try:
+            from zoneinfo import ZoneInfo
+            self._tzinfo = ZoneInfo(self.timezone)
+        except Exception as e:
+            print(f"无法加载时区 {self.timezone}，改用本地时区计算收盘时间: {e}")
+        self._close_cache: Dict[str, float] = {}
+        directory = os.path.dirname(self.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS market_data (
+                    symbol TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (symbol, date, fields)
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.cache_file, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _session_close(self, date: str) -> float:
+        """返回该日期收盘时刻的时间戳"""
+        close = self._close_cache.get(date)
+        if close is None:
+            moment = datetime.strptime(date, '%Y-%m-%d').replace(
+                hour=self.close_hour, minute=self.close_minute, tzinfo=self._tzinfo
+            )
+            close = self._close_cache[date] = moment.timestamp()
+        return close
+
+    def _is_fresh(self, date: str, fetched_at: float) -> bool:
+        # 收盘后获取的数据不会再变化；收盘前获取的（包括之后才查询的历史日期）按有效期判断
+        if fetched_at >= self._session_close(date):
+            return True
+        return time.time() - fetched_at < self.info_ttl
+
+    def get_many(self, symbols: List[str], date: str, fields: str) -> Dict[str, Dict[str, Any]]:
+        """批量读取缓存，只返回未过期的条目"""
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        placeholders = ",".join("?" * len(symbols))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT symbol, payload, fetched_at FROM market_data "
+                f"WHERE date = ? AND fields = ? AND symbol IN ({placeholders})",
+                [date, fields, *symbols]
+            ).fetchall()
+        return {
+            symbol: json.loads(payload)
+            for symbol, payload, fetched_at in rows
+            if self._is_fresh(date, fetched_at)
+        }
+
+    def put_many(self, entries: List[Tuple[str, Dict[str, Any]]], date: str, fields: str) -> None:
+        """批量写入缓存，包含 error 的结果不写入"""
+        now = time.time()
+        rows = [
+            (symbol, date, fields, json.dumps(data, ensure_ascii=False, default=str), now)
+            for symbol, data in entries
+            if isinstance(data, dict) and "error" not in data
+        ]
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO market_data (symbol, date, fields, payload, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+
+_default_cache: Optional[MarketDataCache] = None
+
+
+def get_market_cache() -> MarketDataCache:
+    """获取进程内共享的默认行情缓存"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = MarketDataCache()
+    return _default_cache
+
+
+def is_offline() -> bool:
+    """是否处于离线模式（只从缓存读取行情），由环境变量 MARKET_DATA_OFFLINE 控制"""
+    load_env()
+    return os.getenv('MARKET_DATA_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def fetch_workers() -> int:
+    """逐只获取行情时同时进行的最大请求数，由环境变量 MARKET_FETCH_WORKERS 控制（默认8）"""
+    load_env()
+    return max(int(os.getenv('MARKET_FETCH_WORKERS') or 8), 1)
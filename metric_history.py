@@ -0,0 +1,181 @@
+# metric_history.py - 结构化的网络效应指标时间序列
+"""
+从LLM的分析结果中提取模板要求输出的指标（用户增长率、ARPU变化、网络效应强度、关键证据），
+按股票和日期保存为紧凑的时间序列；编译提示词时只渲染最近 N 个数据点，并限制在token预算内，
+避免不断累积的自由文本历史让提示词越来越长。
+"""
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+from env_config import load_env
+from history_store import METRIC_COLUMNS
+
+STRENGTH_LEVELS = {"弱": 1, "中": 2, "强": 3}
+STRENGTH_NAMES = {level: name for name, level in STRENGTH_LEVELS.items()}
+
+# 文本字段保存的最大长度（字符）
+MAX_TEXT_LENGTH = 60
+MAX_EVIDENCE_LENGTH = 120
+
+DEFAULT_HISTORY_POINTS = 8
+DEFAULT_HISTORY_TOKEN_BUDGET = 600
+
+_PERCENT = re.compile(r"([+\-−]?\d+(?:\.\d+)?)\s*%")
+_LABELS = {
+    "user_growth_text": re.compile(r"用户增长率\s*[：:]\s*(.+)"),
+    "arpu_change_text": re.compile(r"ARPU\s*变化\s*[：:]\s*(.+)", re.IGNORECASE),
+    "strength": re.compile(r"网络效应强度\s*[：:]\s*(.+)"),
+    "evidence": re.compile(r"关键证据\s*[：:]\s*(.+)"),
+}
+
+
+def history_window() -> tuple:
+    """读取提示词中历史数据的点数和token预算（环境变量 HISTORY_POINTS / HISTORY_TOKEN_BUDGET）"""
+    load_env()
+    points = int(os.getenv('HISTORY_POINTS') or DEFAULT_HISTORY_POINTS)
+    budget = int(os.getenv('HISTORY_TOKEN_BUDGET') or DEFAULT_HISTORY_TOKEN_BUDGET)
+    return points, budget
+
+
+def _clean(value: Any, limit: int) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, list):
+        value = "；".join(str(item) for item in value if item)
+    text = re.sub(r"\s+", " ", str(value)).strip().strip("[]【】*").strip()
+    if not text:
+        return None
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _percent(text: Optional[str]) -> Optional[float]:
+    match = _PERCENT.search(text or "")
+    if match is None:
+        return None
+    return float(match.group(1).replace("−", "-"))
+
+
+def _strength(text: Optional[str]) -> Optional[int]:
+    """取描述中最先出现的 弱/中/强"""
+    for char in text or "":
+        if char in STRENGTH_LEVELS:
+            return STRENGTH_LEVELS[char]
+    return None
+
+
+def _parse_json(text: str) -> Optional[Dict[str, Any]]:
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def combine_metrics(*candidates: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """按顺序合并多份提取结果，靠前的优先，缺失的字段用后面的补齐"""
+    merged: Dict[str, Any] = {}
+    for metrics in candidates:
+        for field, value in (metrics or {}).items():
+            if merged.get(field) is None:
+                merged[field] = value
+    return merged or None
+
+
+def extract_metrics(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    从分析结果中提取指标，兼容 network_effect 模板的 "字段：值" 格式和
+    network_effect_analysis 模板的JSON格式
+
+    Returns:
+        包含 METRIC_COLUMNS 的字典，一个指标都没有提取到时返回 None
+    """
+    if not text:
+        return None
+    raw: Dict[str, Any] = {}
+    data = _parse_json(text)
+    if data is not None and any(key in data for key in ("user_growth", "arpu_change", "network_effect_strength")):
+        growth = data.get("user_growth")
+        arpu = data.get("arpu_change")
+        raw["user_growth_text"] = growth.get("value") if isinstance(growth, dict) else growth
+        raw["arpu_change_text"] = arpu.get("value") if isinstance(arpu, dict) else arpu
+        raw["strength"] = data.get("network_effect_strength")
+        raw["evidence"] = data.get("key_evidence")
+    else:
+        # 同一字段出现多次时（如分析框架和输出格式各一次）取最后一次，即模型填写的结果
+        for field, pattern in _LABELS.items():
+            matches = pattern.findall(text)
+            if matches:
+                raw[field] = matches[-1]
+    metrics = {
+        "user_growth_text": _clean(raw.get("user_growth_text"), MAX_TEXT_LENGTH),
+        "arpu_change_text": _clean(raw.get("arpu_change_text"), MAX_TEXT_LENGTH),
+        "strength": _strength(_clean(raw.get("strength"), MAX_TEXT_LENGTH)),
+        "evidence": _clean(raw.get("evidence"), MAX_EVIDENCE_LENGTH),
+    }
+    metrics["user_growth"] = _percent(metrics["user_growth_text"])
+    metrics["arpu_change"] = _percent(metrics["arpu_change_text"])
+    if all(value is None for value in metrics.values()):
+        return None
+    return {field: metrics[field] for field in METRIC_COLUMNS}
+
+
+def _format_value(number: Optional[float], text: Optional[str]) -> str:
+    if number is not None:
+        return f"{number:+g}%"
+    return text or "-"
+
+
+def render_metric_series(points: List[Dict[str, Any]], token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET) -> str:
+    """
+    把按日期升序排列的数据点渲染为紧凑的表格文本
+
+    超出token预算（按字符数估算，与 llm_call 一致）时先从较早的数据点开始省略关键证据，
+    仍超出时丢弃最早的数据点，最终至少保留最近一个数据点。
+    """
+    if not points:
+        return ""
+    header = "日期 | 用户增长率 | ARPU变化 | 网络效应强度 | 关键证据"
+
+    def row(point: Dict[str, Any], with_evidence: bool) -> str:
+        evidence = point.get("evidence") if with_evidence else None
+        return " | ".join([
+            point["date"],
+            _format_value(point.get("user_growth"), point.get("user_growth_text")),
+            _format_value(point.get("arpu_change"), point.get("arpu_change_text")),
+            STRENGTH_NAMES.get(point.get("strength"), "-"),
+            evidence or "-",
+        ])
+
+    points = list(points)
+    while True:
+        # 保留关键证据的数据点从全部逐步减少到零，只保留较近数据点的证据
+        for keep in range(len(points), -1, -1):
+            rows = [row(point, i >= len(points) - keep) for i, point in enumerate(points)]
+            text = "\n".join([header, *rows])
+            if len(text) <= token_budget:
+                return text
+        if len(points) == 1:
+            return text[:token_budget]
+        points = points[1:]
+
+
+def render_history(
+    points: Optional[List[Dict[str, Any]]],
+    text: Optional[str],
+    token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET
+) -> Optional[str]:
+    """有指标数据点时渲染为表格，否则使用截断后的自由文本历史"""
+    if points:
+        return render_metric_series(points, token_budget)
+    return truncate_history(text, token_budget)
+
+
+def truncate_history(text: Optional[str], token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET) -> Optional[str]:
+    """没有结构化数据的股票沿用自由文本历史，超出预算时截断"""
+    if text is None or len(text) <= token_budget:
+        return text
+    return text[:max(token_budget - 1, 0)] + "…"
@@ -0,0 +1,235 @@
+# model_registry.py - 模型服务商注册表与按任务路由
+"""
+服务商和模型可以通过环境变量或 JSON 配置文件注册，任何 OpenAI 兼容的接口（包括本地部署的模型）
+都无需修改代码即可使用。路由策略按任务类型（分析风格或 network_effect_history）在候选模型中
+选择，综合考虑每token价格和实际观测到的延迟。
+
+环境变量示例:
+    LLM_PROVIDERS=local
+    LOCAL_BASE_URL=http://localhost:8000/v1
+    LOCAL_API_KEY=sk-local
+    LOCAL_MODELS=qwen2.5-7b-instruct
+    LLM_MODEL_COSTS=qwen2.5-7b-instruct=0:0,gpt-4o=2.5:10
+    LLM_ROUTES=network_effect_history=qwen2.5-7b-instruct,gpt-4o-mini;network_effect=gpt-4o
+
+配置文件（LLM_REGISTRY_FILE）示例:
+    {
+        "providers": {
+            "local": {"base_url": "http://localhost:8000/v1", "api_key": "sk-local",
+                      "models": {"qwen2.5-7b-instruct": {"input_cost": 0, "output_cost": 0}},
+                      "max_concurrency": 8}
+        },
+        "routes": {"network_effect_history": ["qwen2.5-7b-instruct", "gpt-4o-mini"]}
+    }
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+from env_config import load_env
+
+# 内置模型的参考价格（美元 / 百万token），可通过 LLM_MODEL_COSTS 或配置文件覆盖
+DEFAULT_MODEL_COSTS = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "deepseek-chat": (0.27, 1.10),
+}
+
+# 尚无观测数据时估算单次请求成本使用的token数
+DEFAULT_PROMPT_TOKENS = 1000
+DEFAULT_COMPLETION_TOKENS = 500
+
+# 延迟和错误率的指数滑动平均系数
+EWMA_ALPHA = 0.2
+
+
+class ModelRegistry:
+    """
+    服务商与模型注册表
+
+    providers 的每一项包含 base_url、api_key、models（模型名称到价格的映射）以及可选的
+    max_concurrency / rpm / tpm；routes 为任务类型到候选模型列表的映射。
+    """
+
+    def __init__(
+        self,
+        providers: Optional[Dict[str, Dict[str, Any]]] = None,
+        routes: Optional[Dict[str, List[str]]] = None,
+        costs: Optional[Dict[str, tuple]] = None
+    ):
+        self.providers: Dict[str, Dict[str, Any]] = providers or {}
+        self.routes: Dict[str, List[str]] = routes or {}
+        self.costs: Dict[str, tuple] = dict(DEFAULT_MODEL_COSTS)
+        self.costs.update(costs or {})
+        self._model_providers: Dict[str, str] = {}
+        for name, provider in self.providers.items():
+            for model, price in (provider.get("models") or {}).items():
+                self._model_providers[model] = name
+                if price:
+                    self.costs[model] = (price.get("input_cost", 0.0), price.get("output_cost", 0.0))
+
+    @classmethod
+    def from_env(cls) -> "ModelRegistry":
+        """从配置文件 LLM_REGISTRY_FILE 和环境变量构建注册表，环境变量中的配置优先"""
+        load_env()
+        providers: Dict[str, Dict[str, Any]] = {}
+        routes: Dict[str, List[str]] = {}
+        costs: Dict[str, tuple] = {}
+        config_file = os.getenv('LLM_REGISTRY_FILE')
+        if config_file and os.path.exists(config_file):
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            providers.update(config.get("providers") or {})
+            routes.update(config.get("routes") or {})
+
+        for name in filter(None, (item.strip() for item in os.getenv('LLM_PROVIDERS', '').split(','))):
+            prefix = name.upper()
+            provider = providers.setdefault(name, {})
+            provider["base_url"] = os.getenv(f"{prefix}_BASE_URL", provider.get("base_url"))
+            provider["api_key"] = os.getenv(f"{prefix}_API_KEY", provider.get("api_key"))
+            models = provider.setdefault("models", {})
+            for model in filter(None, (item.strip() for item in os.getenv(f"{prefix}_MODELS", '').split(','))):
+                models.setdefault(model, {})
+
+        for item in filter(None, (item.strip() for item in os.getenv('LLM_MODEL_COSTS', '').split(','))):
+            model, _, price = item.partition('=')
+            input_cost, _, output_cost = price.partition(':')
+            costs[model.strip()] = (float(input_cost or 0), float(output_cost or input_cost or 0))
+
+        for item in filter(None, (item.strip() for item in os.getenv('LLM_ROUTES', '').split(';'))):
+            task, _, models = item.partition('=')
+            routes[task.strip()] = [model.strip() for model in models.split(',') if model.strip()]
+
+        registry = cls(providers, routes)
+        registry.costs.update(costs)
+        return registry
+
+    def provider_for(self, model_name: str) -> Optional[str]:
+        """返回注册了该模型的服务商名称，未注册时返回 None"""
+        return self._model_providers.get(model_name)
+
+    def provider_config(self, provider: str) -> Dict[str, Any]:
+        return self.providers.get(provider) or {}
+
+    def cost(self, model_name: str) -> Optional[tuple]:
+        """返回模型的 (输入价格, 输出价格)，单位为美元 / 百万token，未知时返回 None"""
+        return self.costs.get(model_name)
+
+
+class ModelRouter:
+    """
+    按任务类型在候选模型中选择：估算单次请求成本（按该任务观测到的平均token数）
+    和观测延迟各自相对最优候选归一化后加权求和，得分最低者胜出；错误率高的模型额外降权。
+    """
+
+    def __init__(self, registry: ModelRegistry, latency_weight: Optional[float] = None):
+        self.registry = registry
+        if latency_weight is None:
+            latency_weight = float(os.getenv('LLM_ROUTE_LATENCY_WEIGHT', '1.0'))
+        self.latency_weight = latency_weight
+        self._latency: Dict[str, float] = {}
+        self._error_rate: Dict[str, float] = {}
+        self._tokens: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(
+        self,
+        model_name: str,
+        task: Optional[str],
+        latency: float,
+        usage: Optional[Dict[str, int]] = None,
+        error: bool = False
+    ) -> None:
+        """记录一次实际请求的延迟、token用量和是否出错"""
+        with self._lock:
+            rate = self._error_rate.get(model_name, 0.0)
+            self._error_rate[model_name] = rate + EWMA_ALPHA * (float(error) - rate)
+            if error:
+                return
+            previous = self._latency.get(model_name)
+            self._latency[model_name] = latency if previous is None else previous + EWMA_ALPHA * (latency - previous)
+            if usage and task:
+                tokens = self._tokens.setdefault(task, [0.0, 0.0, 0])
+                tokens[0] += usage.get("prompt_tokens") or 0
+                tokens[1] += usage.get("completion_tokens") or 0
+                tokens[2] += 1
+
+    def _expected_cost(self, model_name: str, task: str) -> Optional[float]:
+        price = self.registry.cost(model_name)
+        if price is None:
+            return None
+        prompt_tokens, completion_tokens, count = self._tokens.get(task, [0.0, 0.0, 0])
+        if count:
+            prompt_tokens, completion_tokens = prompt_tokens / count, completion_tokens / count
+        else:
+            prompt_tokens, completion_tokens = DEFAULT_PROMPT_TOKENS, DEFAULT_COMPLETION_TOKENS
+        return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+    def scores(self, task: str, candidates: List[str]) -> Dict[str, float]:
+        """
+        计算各候选模型的得分，越低越好
+
+        缺少价格的模型按候选中的平均价格计；尚未观测到延迟的模型按最快的候选计，
+        使新注册的模型能够先被试用，再按实际延迟参与比较。
+        """
+        with self._lock:
+            costs = {model: self._expected_cost(model, task) for model in candidates}
+            latencies = {model: self._latency.get(model) for model in candidates}
+            errors = {model: self._error_rate.get(model, 0.0) for model in candidates}
+
+        def normalized(values: Dict[str, Optional[float]], optimistic: bool) -> Dict[str, float]:
+            known = [value for value in values.values() if value is not None]
+            if not known:
+                return {model: 1.0 for model in values}
+            default = min(known) if optimistic else sum(known) / len(known)
+            # 加上一个很小的下限，免费的本地模型（价格为0）也能按比例比较
+            floor = max(known) * 0.01 or 1e-9
+            best = min(known) + floor
+            return {
+                model: ((default if value is None else value) + floor) / best
+                for model, value in values.items()
+            }
+
+        cost_scores = normalized(costs, optimistic=False)
+        latency_scores = normalized(latencies, optimistic=True)
+        return {
+            model: (cost_scores[model] + self.latency_weight * latency_scores[model]) / max(1.0 - errors[model], 0.05)
+            for model in candidates
+        }
+
+    def choose(self, task: str, default_model: str) -> str:
+        """为任务类型选择模型，没有配置路由时返回 default_model"""
+        candidates = self.registry.routes.get(task) or self.registry.routes.get("*")
+        if not candidates:
+            return default_model
+        if len(candidates) == 1:
+            return candidates[0]
+        scores = self.scores(task, candidates)
+        with self._lock:
+            observed = set(self._latency)
+        # 得分相同时优先试用尚未观测过的模型
+        return min(candidates, key=lambda model: (scores[model], model in observed))
+
+
+_default_registry: Optional[ModelRegistry] = None
+_default_router: Optional[ModelRouter] = None
+_default_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """获取进程内共享的模型注册表，首次使用时从配置文件和环境变量加载"""
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = ModelRegistry.from_env()
+        return _default_registry
+
+
+def get_model_router() -> ModelRouter:
+    """获取进程内共享的模型路由"""
+    global _default_router
+    registry = get_registry()
+    with _default_lock:
+        if _default_router is None:
+            _default_router = ModelRouter(registry)
+        return _default_router
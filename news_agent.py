@@ -1,14 +1,48 @@
 # news_agent.py - LangGraph格式的股票分析函数
-import yfinance as yf
+import asyncio
+import hashlib
+import inspect
 import json
-import os
-from datetime import datetime
-from llm_call import create_agent_call
-from prompt import format_prompt
-from typing import List, Optional, Dict, Any
-from langgraph.graph import StateGraph, END
+import operator
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from llm_call import AgentCall, create_agent_call, create_http_client, get_provider, is_error_result
+from instrumentation import TraceHook, Tracer
+from history_store import HistoryStore, get_history_store
+from metric_history import combine_metrics, extract_metrics, history_window, render_history
+from news_dedup import best_match, dedup_settings, minhash, news_text, pack_signature, unpack_signature
+from checkpoint_store import get_checkpoint_store
+from results_store import get_results_store
+from market_cache import MarketDataCache, fetch_workers, get_market_cache, is_offline
+from model_registry import get_model_router
+from prompt import PromptTemplate, get_available_templates, get_template
+from typing import TYPE_CHECKING, Annotated, Callable, Iterator, List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel
 
+# yfinance（连带 pandas）、langgraph 和 httpx 的导入耗时较长，只在真正用到时才导入，
+# 这样导入本模块、查看帮助或只读取历史信息时无需承担这部分启动开销
+if TYPE_CHECKING:
+    import httpx
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.graph import StateGraph
+
+# 测试和基准测试可以直接替换为模拟实现
+yf = None
+
+
+def _yfinance():
+    """首次获取行情时才导入 yfinance"""
+    global yf
+    if yf is None:
+        import yfinance
+
+        yf = yfinance
+    return yf
+
 # 定义状态类型
 class AgentState(BaseModel):
     """LangGraph状态类，包含所有分析所需的数据"""
@@ -18,119 +52,443 @@ class AgentState(BaseModel):
     today_info_list: Optional[List[Optional[Dict]]] = None
     prompt_params_list: Optional[List[Optional[Dict]]] = None
     date: Optional[str] = None
+    offline: Optional[bool] = None
+    incremental: bool = False
+    run_id: Optional[str] = None
+    save_history: bool = True
+    news_dedup: Optional[str] = None
     today_info: Optional[List[Dict]] = None
     history_info: Optional[List[Optional[str]]] = None
-    analysis_prompts: Optional[List[str]] = None
-    history_prompts: Optional[List[str]] = None
-    analysis_results: Optional[List[str]] = None
-    history_results: Optional[List[str]] = None
-
-def fetch_today_info(stock_list: List[str], date: Optional[str] = None) -> List[Dict[str, Any]]:
-    today_info = []
-    for symbol in stock_list:
-        try:
-            ticker = yf.Ticker(symbol)
-            if date is None or date == datetime.now().strftime('%Y-%m-%d'):
-                info = ticker.info
-            else:
-                # 获取指定日期的历史数据
-                hist = ticker.history(start=date, end=date)
-                if not hist.empty:
-                    row = hist.iloc[0]
-                    info = {
-                        "symbol": symbol,
-                        "date": date,
-                        "close": row["Close"],
-                        "open": row["Open"],
-                        "high": row["High"],
-                        "low": row["Low"],
-                        "volume": row["Volume"]
-                    }
-                else:
-                    info = {"symbol": symbol, "date": date, "error": "无该日数据"}
-            today_info.append(info)
-        except Exception as e:
-            today_info.append({"symbol": symbol, "date": date, "error": str(e)})
-    return today_info
+    analysis_prompts: Optional[List[Optional[str]]] = None
+    history_prompts: Optional[List[Optional[str]]] = None
+    analysis_errors: Optional[List[Optional[Dict[str, Any]]]] = None
+    history_errors: Optional[List[Optional[Dict[str, Any]]]] = None
+    input_fingerprints: Optional[List[Optional[str]]] = None
+    reused: Optional[List[bool]] = None
+    prompt_hashes: Optional[List[Optional[str]]] = None
+    news_signatures: Optional[List[Optional[List[int]]]] = None
+    news_duplicates: Optional[List[Optional[Dict[str, Any]]]] = None
+    analysis_usage: Optional[List[Optional[Dict[str, Any]]]] = None
+    perf_summary: Optional[Dict[str, Any]] = None
+    analysis_results: Optional[List[Optional[str]]] = None
+    history_results: Optional[List[Optional[str]]] = None
 
-def fetch_history(stock_list: List[str], history_file: str = 'data/stock_history.json') -> List[Optional[Dict]]:
-    """获取历史信息"""
-    if not os.path.exists(history_file):
-        history_data = {}
-    else:
+class PipelineState(BaseModel):
+    """流水线模式的状态，每只股票处理完成后只把结果归并进 results"""
+    model_name: str
+    stock_list: List[str]
+    analysis_styles: List[str]
+    today_info_list: Optional[List[Optional[Dict]]] = None
+    prompt_params_list: Optional[List[Optional[Dict]]] = None
+    date: Optional[str] = None
+    offline: Optional[bool] = None
+    incremental: bool = False
+    save_history: bool = True
+    news_dedup: Optional[str] = None
+    results: Annotated[List[Dict[str, Any]], operator.add] = []
+
+def _next_day(date: str) -> str:
+    """返回下一自然日，yfinance 的 end 参数不包含当天"""
+    return (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+def _ohlcv_from_row(symbol: str, date: str, row) -> Dict[str, Any]:
+    """将一行K线数据转换为标准化的今日信息"""
+    return {
+        "symbol": symbol,
+        "date": date,
+        "close": float(row["Close"]),
+        "open": float(row["Open"]),
+        "high": float(row["High"]),
+        "low": float(row["Low"]),
+        "volume": int(row["Volume"])
+    }
+
+def _fetch_symbol_info(symbol: str, date: str, fields: str) -> Dict[str, Any]:
+    """逐只获取单个股票的信息，失败时返回包含 error 的字典"""
+    try:
+        ticker = _yfinance().Ticker(symbol)
+        if fields == 'info':
+            return ticker.info
+        # 获取指定日期的历史数据
+        hist = ticker.history(start=date, end=_next_day(date))
+        if not hist.empty:
+            return _ohlcv_from_row(symbol, date, hist.iloc[0])
+        return {"symbol": symbol, "date": date, "error": "无该日数据"}
+    except Exception as e:
+        return {"symbol": symbol, "date": date, "error": str(e)}
+
+def _download_ohlcv(symbols: List[str], start: str, end: str) -> Dict[str, Any]:
+    """一次批量下载多只股票 [start, end) 区间的K线，返回每只股票去掉空行后的数据表，失败时返回空字典"""
+    try:
+        data = _yfinance().download(
+            symbols,
+            start=start,
+            end=end,
+            group_by='ticker',
+            auto_adjust=True,
+            threads=True,
+            progress=False
+        )
+    except Exception as e:
+        print(f"批量获取行情失败: {e}")
+        return {}
+    if data is None or data.empty:
+        return {}
+
+    frames = {}
+    tickers = set(data.columns.get_level_values(0)) if data.columns.nlevels > 1 else set()
+    for symbol in symbols:
+        if symbol in tickers:
+            frame = data[symbol]
+        elif data.columns.nlevels == 1 and len(symbols) == 1:
+            frame = data
+        else:
+            continue
+        frame = frame.dropna(how='all')
+        if not frame.empty:
+            frames[symbol] = frame
+    return frames
+
+def _fetch_ohlcv_batch(stock_list: List[str], date: str) -> Dict[str, Dict[str, Any]]:
+    """一次批量下载所有股票指定日期的K线，只返回成功取到数据的股票"""
+    fetched = {}
+    for symbol, frame in _download_ohlcv(list(dict.fromkeys(stock_list)), date, _next_day(date)).items():
         try:
-            with open(history_file, 'r', encoding='utf-8') as f:
-                history_data = json.load(f)
-        except Exception as e:
-            print(f"读取历史文件失败: {e}")
-            history_data = {}
+            fetched[symbol] = _ohlcv_from_row(symbol, date, frame.iloc[0])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return fetched
+
+def fetch_ohlcv_range(
+    stock_list: List[str],
+    start_date: str,
+    end_date: str,
+    cache: Optional[MarketDataCache] = None,
+    offline: Optional[bool] = None
+) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    一次批量下载 [start_date, end_date] 区间内所有股票的K线，并按日期写入行情缓存
+
+    离线模式下逐日从缓存读取。
+
+    Returns:
+        {股票代码: {交易日: K线}}，交易日按日期升序；没有取到数据的股票对应空字典
+    """
+    symbols = list(dict.fromkeys(stock_list))
+    cache = cache or get_market_cache()
+    if offline is None:
+        offline = is_offline()
+    bars: Dict[str, Dict[str, Dict[str, Any]]] = {symbol: {} for symbol in symbols}
+    if offline:
+        day = start_date
+        while day <= end_date:
+            for symbol, data in cache.get_many(symbols, day, 'ohlcv').items():
+                bars[symbol][day] = data
+            day = _next_day(day)
+        return bars
+
+    by_date: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+    for symbol, frame in _download_ohlcv(symbols, start_date, _next_day(end_date)).items():
+        for index, row in frame.iterrows():
+            day = index.strftime('%Y-%m-%d')
+            try:
+                bar = _ohlcv_from_row(symbol, day, row)
+            except (KeyError, TypeError, ValueError):
+                continue
+            bars[symbol][day] = bar
+            by_date.setdefault(day, []).append((symbol, bar))
+    for day, entries in by_date.items():
+        cache.put_many(entries, day, 'ohlcv')
+    return {symbol: dict(sorted(days.items())) for symbol, days in bars.items()}
+
+def fetch_today_info(
+    stock_list: List[str],
+    date: Optional[str] = None,
+    fields: Optional[str] = None,
+    cache: Optional[MarketDataCache] = None,
+    offline: Optional[bool] = None
+) -> List[Dict[str, Any]]:
+    """
+    获取股票当日信息
+
+    Args:
+        stock_list: 股票代码列表
+        date: 可选的日期，默认为今天
+        fields: 数据类型，'info' 为实时详情快照，'ohlcv' 为当日K线；
+            默认今天取 'info'，历史日期取 'ohlcv'
+        cache: 行情缓存，默认使用共享的本地缓存
+        offline: 离线模式，只从缓存读取，默认读取环境变量 MARKET_DATA_OFFLINE
+
+    Returns:
+        与 stock_list 一一对应的信息列表，获取失败的股票返回包含 error 的字典
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    if fields is None:
+        fields = 'info' if date is None or date == today else 'ohlcv'
+    date = date or today
+    cache = cache or get_market_cache()
+    if offline is None:
+        offline = is_offline()
+
+    fetched = cache.get_many(stock_list, date, fields)
+    missing = [symbol for symbol in dict.fromkeys(stock_list) if symbol not in fetched]
+    if missing and offline:
+        for symbol in missing:
+            fetched[symbol] = {"symbol": symbol, "date": date, "error": "离线模式下缓存中无该日数据"}
+    elif missing:
+        # K线数据先整批下载，只对批量结果中缺失的股票逐只获取；
+        # 实时快照没有批量接口，逐只请求在有上限的线程池中并行进行
+        downloaded = _fetch_ohlcv_batch(missing, date) if fields == 'ohlcv' else {}
+        pending = [symbol for symbol in missing if symbol not in downloaded]
+        workers = min(fetch_workers(), len(pending))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                downloaded.update(zip(pending, pool.map(lambda s: _fetch_symbol_info(s, date, fields), pending)))
+        else:
+            for symbol in pending:
+                downloaded[symbol] = _fetch_symbol_info(symbol, date, fields)
+        cache.put_many(list(downloaded.items()), date, fields)
+        fetched.update(downloaded)
+    return [fetched[symbol] for symbol in stock_list]
+
+def fetch_history(
+    stock_list: List[str],
+    *,
+    store: Optional[HistoryStore] = None,
+    date: Optional[str] = None
+) -> List[Optional[str]]:
+    """
+    获取历史信息，date 不为空时只读取该日期（含）之前的版本
+
+    有结构化指标的股票返回最近 HISTORY_POINTS 个数据点的表格，没有的沿用自由文本历史，
+    两者都限制在 HISTORY_TOKEN_BUDGET 之内；HISTORY_POINTS=0 时只使用自由文本历史
+    """
+    store = store or get_history_store()
+    points, budget = history_window()
+    try:
+        history_data = store.get_many(stock_list, as_of=date)
+        series = store.get_metric_series(stock_list, as_of=date, limit=points)
+    except Exception as e:
+        print(f"读取历史信息失败: {e}")
+        history_data, series = {}, {}
     
-    history_list = [history_data.get(symbol) for symbol in stock_list]
+    history_list = [render_history(series.get(symbol), history_data.get(symbol), budget) for symbol in stock_list]
     return history_list
 
-def compile_analysis_prompts(
+def _compile_prompts(
+    template_names: List[str],
+    params_list: List[Dict[str, Any]],
+    templates: Optional[Dict[str, PromptTemplate]] = None
+) -> Tuple[List[Optional[str]], List[Optional[Dict[str, Any]]]]:
+    """
+    先批量校验所有记录的占位符，再只为校验通过的记录渲染提示词
+
+    Returns:
+        (提示词列表, 错误列表)，校验失败的记录提示词为 None，并在错误列表对应位置给出结构化错误
+    """
+    errors: List[Optional[Dict[str, Any]]] = []
+    resolved: List[Optional[PromptTemplate]] = []
+    for name, params in zip(template_names, params_list):
+        try:
+            template = templates[name] if templates and name in templates else get_template(name)
+        except ValueError as e:
+            resolved.append(None)
+            errors.append({"template": name, "missing": [], "message": f"提示词编译失败: {e}"})
+            continue
+        resolved.append(template)
+        missing = template.missing_fields(params)
+        if missing:
+            errors.append({
+                "template": name,
+                "missing": missing,
+                "message": f"提示词编译失败: 模板 {name} 缺少参数 {', '.join(missing)}"
+            })
+        else:
+            errors.append(None)
+
+    prompts: List[Optional[str]] = [None] * len(params_list)
+    for i, (template, params) in enumerate(zip(resolved, params_list)):
+        if errors[i] is not None:
+            print(errors[i]["message"])
+            continue
+        try:
+            prompts[i] = template.render(**params)
+        except Exception as e:
+            errors[i] = {"template": template.name, "missing": [], "message": f"提示词编译失败: {e}"}
+            print(errors[i]["message"])
+    return prompts, errors
+
+def validate_analysis_prompts(
     today_info: List[Dict], 
-    history_info: List[Optional[Dict]], 
+    history_info: List[Optional[str]], 
     analysis_styles: List[str], 
-    prompt_params_list: Optional[List[Optional[Dict]]] = None
-) -> List[str]:
-    """编译分析提示词"""
-    prompts = []
+    prompt_params_list: Optional[List[Optional[Dict]]] = None,
+    templates: Optional[Dict[str, PromptTemplate]] = None
+) -> Tuple[List[Optional[str]], List[Optional[Dict[str, Any]]]]:
+    """
+    校验并编译分析提示词，templates 为预先加载的模板，不传则从 prompt 模块读取
+
+    Returns:
+        (提示词列表, 错误列表)，参数缺失的股票不生成提示词，对应位置为 None
+    """
+    styles = []
+    params_list = []
     for i, info in enumerate(today_info):
-        style = analysis_styles[i] if i < len(analysis_styles) else 'network_effect'
+        styles.append(analysis_styles[i] if i < len(analysis_styles) else 'network_effect')
         params = info.copy()  # 使用copy避免修改原始数据
         params['history_info'] = history_info[i] or ""
         
         if prompt_params_list and i < len(prompt_params_list) and prompt_params_list[i]:
             params.update(prompt_params_list[i])
-        
-        try:
-            prompt = format_prompt(style, **params)
-            prompts.append(prompt)
-        except Exception as e:
-            print(f"编译提示词失败: {e}")
-            prompts.append("分析失败")
+        params_list.append(params)
     
-    return prompts
+    return _compile_prompts(styles, params_list, templates)
+
+def validate_history_prompts(
+    today_info: List[Dict], 
+    history_info: List[Optional[str]],
+    templates: Optional[Dict[str, PromptTemplate]] = None
+) -> Tuple[List[Optional[str]], List[Optional[Dict[str, Any]]]]:
+    """校验并编译历史总结提示词，返回值同 validate_analysis_prompts"""
+    params_list = [dict(info, history_info=history_info[i] or "") for i, info in enumerate(today_info)]
+    return _compile_prompts(['network_effect_history'] * len(today_info), params_list, templates)
+
+def compile_analysis_prompts(
+    today_info: List[Dict], 
+    history_info: List[Optional[str]], 
+    analysis_styles: List[str], 
+    prompt_params_list: Optional[List[Optional[Dict]]] = None,
+    templates: Optional[Dict[str, PromptTemplate]] = None
+) -> List[str]:
+    """
+    编译分析提示词，编译失败的股票返回 "分析失败"
+
+    保留原有的返回类型，需要结构化错误时使用 validate_analysis_prompts
+    """
+    prompts, _ = validate_analysis_prompts(today_info, history_info, analysis_styles, prompt_params_list, templates)
+    return [prompt if prompt is not None else "分析失败" for prompt in prompts]
 
 def compile_history_prompts(
     today_info: List[Dict], 
-    history_info: List[Optional[Dict]]
+    history_info: List[Optional[str]],
+    templates: Optional[Dict[str, PromptTemplate]] = None
 ) -> List[str]:
-    """编译历史总结提示词"""
-    prompts = []
+    """
+    编译历史总结提示词，编译失败的股票返回 "历史总结失败"
+
+    保留原有的返回类型，需要结构化错误时使用 validate_history_prompts
+    """
+    prompts, _ = validate_history_prompts(today_info, history_info, templates)
+    return [prompt if prompt is not None else "历史总结失败" for prompt in prompts]
+
+def _apply_prompt_errors(
+    results: List[Optional[str]],
+    errors: Optional[List[Optional[Dict[str, Any]]]]
+) -> List[Optional[str]]:
+    """用结构化错误中的提示信息填充未调用LLM的结果"""
+    for i, error in enumerate(errors or []):
+        if error is not None:
+            results[i] = error["message"]
+    return results
+
+def input_fingerprints(
+    model_name: str,
+    today_info: List[Dict],
+    history_info: List[Optional[str]],
+    analysis_styles: List[str],
+    prompt_params_list: Optional[List[Optional[Dict]]] = None,
+    date: Optional[str] = None
+) -> List[str]:
+    """
+    计算每只股票提示词输入（模型、分析风格、今日信息、提示词参数、历史信息、分析日期）的指纹
+
+    输入相同的股票编译出的分析和历史总结提示词也相同，增量模式据此跳过未变化的股票；
+    分析日期不同时指纹也不同，某一天的结果不会被另一天复用。
+    """
+    date = date or datetime.now().strftime('%Y-%m-%d')
+    fingerprints = []
     for i, info in enumerate(today_info):
+        style = analysis_styles[i] if i < len(analysis_styles) else 'network_effect'
+        extra = prompt_params_list[i] if prompt_params_list and i < len(prompt_params_list) else None
+        payload = json.dumps(
+            [model_name, date, style, info, extra or {}, history_info[i] or ""],
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        fingerprints.append(hashlib.sha256(payload.encode('utf-8')).hexdigest())
+    return fingerprints
+
+def _fingerprint_history(stock_list: List[str], date: Optional[str] = None) -> List[Optional[str]]:
+    """
+    指纹使用的历史信息：分析日期之前（不含当天）的历史
+
+    同一天重复运行时，上次运行写入的当天历史总结不计入指纹，指纹在运行开始时即可确定，
+    不依赖本次结果是否以及何时写入历史存储（如 save_history=False 的分片批处理由合并步骤统一写入）。
+    """
+    day = datetime.strptime(date or datetime.now().strftime('%Y-%m-%d'), '%Y-%m-%d')
+    return fetch_history(stock_list, date=(day - timedelta(days=1)).strftime('%Y-%m-%d'))
+
+def _apply_prefilled(
+    results: List[Optional[str]],
+    prefilled: Optional[List[Optional[str]]]
+) -> List[Optional[str]]:
+    """用增量模式复用的上次结果或检查点中已完成的结果填充跳过的股票"""
+    for i, result in enumerate(prefilled or []):
+        if result is not None:
+            results[i] = result
+    return results
+
+def _checkpoint_callback(state: AgentState, kind: str) -> Optional[Callable[[int, str], None]]:
+    """运行带有 run_id 时，返回每条结果完成后立即写入检查点的回调；LLM调用失败的结果不写入"""
+    if state.run_id is None:
+        return None
+    store = get_checkpoint_store()
+
+    def on_result(i: int, text: str) -> None:
+        if is_error_result(text):
+            return
         try:
-            prompt = format_prompt('network_effect_history', **info, history_info=history_info[i] or "")
-            prompts.append(prompt)
+            store.put(state.run_id, kind, i, state.stock_list[i], text)
         except Exception as e:
-            print(f"编译历史提示词失败: {e}")
-            prompts.append("历史总结失败")
-    return prompts
+            print(f"保存检查点失败: {e}")
+
+    return on_result
 
 def update_history(
     stock_list: List[str], 
     history_results: List[str], 
-    history_file: str = 'data/stock_history.json'
+    *,
+    store: Optional[HistoryStore] = None,
+    date: Optional[str] = None
 ) -> None:
-    """更新历史信息文件"""
+    """更新历史信息，整批在一个事务内提交，按日期保留版本"""
+    store = store or get_history_store()
     try:
-        if os.path.exists(history_file):
-            with open(history_file, 'r', encoding='utf-8') as f:
-                history_data = json.load(f)
-        else:
-            history_data = {}
-        
-        for i, symbol in enumerate(stock_list):
-            history_data[symbol] = history_results[i]
-        
-        # 确保目录存在
-        os.makedirs(os.path.dirname(history_file), exist_ok=True)
-        
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history_data, f, ensure_ascii=False, indent=2)
+        store.put_many(list(zip(stock_list, history_results)), date)
+    except Exception as e:
+        print(f"更新历史信息失败: {e}")
+
+def update_metrics(
+    stock_list: List[str],
+    analysis_results: List[Optional[str]],
+    history_results: List[Optional[str]],
+    *,
+    store: Optional[HistoryStore] = None,
+    date: Optional[str] = None
+) -> None:
+    """从分析结果（缺失的字段再从历史总结）中提取指标，作为当天的数据点写入时间序列"""
+    entries = []
+    for symbol, analysis, history in zip(stock_list, analysis_results, history_results):
+        metrics = combine_metrics(
+            None if is_error_result(analysis) else extract_metrics(analysis),
+            None if is_error_result(history) else extract_metrics(history)
+        )
+        if metrics is not None:
+            entries.append((symbol, metrics))
+    store = store or get_history_store()
+    try:
+        store.put_metrics(entries, date)
     except Exception as e:
-        print(f"更新历史文件失败: {e}")
+        print(f"更新指标时间序列失败: {e}")
 
 # LangGraph节点函数
 def prepare_data(state: AgentState) -> AgentState:
@@ -139,88 +497,1123 @@ def prepare_data(state: AgentState) -> AgentState:
     today_info_list = state.today_info_list
     date = state.date
     
-    # 获取今日信息
+    # 获取今日信息，未提供信息的股票合并为一次批量获取
     if today_info_list is None:
-        today_info = fetch_today_info(stock_list, date)
+        today_info = fetch_today_info(stock_list, date, offline=state.offline)
     else:
-        today_info = []
-        for i, symbol in enumerate(stock_list):
-            if today_info_list[i] is not None:
-                today_info.append(today_info_list[i])
-            else:
-                info = fetch_today_info([symbol], date)[0]
-                today_info.append(info)
+        missing = [i for i, info in enumerate(today_info_list) if info is None]
+        fetched = []
+        if missing:
+            fetched = fetch_today_info([stock_list[i] for i in missing], date, offline=state.offline)
+        today_info = list(today_info_list)
+        for i, info in zip(missing, fetched):
+            today_info[i] = info
     
     # 获取历史信息
-    history_info = fetch_history(stock_list)
+    history_info = fetch_history(stock_list, date=date)
     
     # 更新状态
     state.today_info = today_info
     state.history_info = history_info
     return state
 
-def compile_prompts(state: AgentState) -> AgentState:
+def _get_session(config: Optional["RunnableConfig"]) -> Optional["AnalyzerSession"]:
+    """从运行配置中取出调用方传入的分析会话"""
+    return ((config or {}).get("configurable") or {}).get("session")
+
+def _get_tracer(config: Optional["RunnableConfig"]) -> Optional[Tracer]:
+    """从运行配置中取出本次运行的性能埋点"""
+    return ((config or {}).get("configurable") or {}).get("tracer")
+
+def _traced(name: str, node: Callable) -> Callable:
+    """包装节点函数，运行配置中带有 tracer 时统计节点耗时"""
+    accepts_config = "config" in inspect.signature(node).parameters
+
+    def traced_node(state: AgentState, config: "RunnableConfig" = None):
+        tracer = _get_tracer(config)
+        args = (state, config) if accepts_config else (state,)
+        if tracer is None:
+            return node(*args)
+        with tracer.span(name):
+            return node(*args)
+
+    traced_node.__name__ = node.__name__
+    traced_node.__doc__ = node.__doc__
+    return traced_node
+
+def _atraced(name: str, node: Callable) -> Callable:
+    """_traced 的异步版本，用于异步节点函数"""
+
+    async def traced_node(state: AgentState, config: "RunnableConfig" = None):
+        tracer = _get_tracer(config)
+        if tracer is None:
+            return await node(state, config)
+        with tracer.span(name):
+            return await node(state, config)
+
+    traced_node.__name__ = node.__name__
+    traced_node.__doc__ = node.__doc__
+    return traced_node
+
+def _get_agent(
+    state: AgentState,
+    config: Optional["RunnableConfig"],
+    model_name: Optional[str] = None
+) -> AgentCall:
+    """优先复用会话中的AgentCall，没有会话时新建；model_name 默认为状态中的模型"""
+    model_name = model_name or state.model_name
+    session = _get_session(config)
+    if session is not None:
+        return session.get_agent(model_name)
+    return create_agent_call(model_name)
+
+def route_models(tasks: List[str], default_model: str) -> List[str]:
+    """按任务类型（分析风格或 network_effect_history）为每条任务选择模型，每种任务类型只选择一次"""
+    router = get_model_router()
+    chosen = {task: router.choose(task, default_model) for task in dict.fromkeys(tasks)}
+    return [chosen[task] for task in tasks]
+
+def compile_prompts(state: AgentState, config: "RunnableConfig" = None) -> AgentState:
     """编译提示词节点"""
     analysis_styles = state.analysis_styles
     prompt_params_list = state.prompt_params_list
+    session = _get_session(config)
+    templates = session.templates if session is not None else None
     
     # 编译分析提示词
-    analysis_prompts = compile_analysis_prompts(
+    analysis_prompts, analysis_errors = validate_analysis_prompts(
         state.today_info, 
         state.history_info, 
         analysis_styles,
-        prompt_params_list
+        prompt_params_list,
+        templates
     )
     
     # 编译历史总结提示词
-    history_prompts = compile_history_prompts(state.today_info, state.history_info)
+    history_prompts, history_errors = validate_history_prompts(state.today_info, state.history_info, templates)
+    # 在复用结果或恢复检查点清空提示词之前记录分析提示词的哈希，随分析结果一起保存
+    prompt_hashes = [
+        hashlib.sha256(prompt.encode('utf-8')).hexdigest() if prompt is not None else None
+        for prompt in analysis_prompts
+    ]
     
-    # 更新状态
-    state.analysis_prompts = analysis_prompts
-    state.history_prompts = history_prompts
-    return state
-
-def analyze_stocks(state: AgentState) -> AgentState:
-    """分析股票节点"""
-    model_name = state.model_name
-    agent = create_agent_call(model_name)
+    # 增量模式：输入指纹与上次运行一致的股票复用上次结果，不再调用LLM
+    if state.incremental:
+        fingerprints = input_fingerprints(
+            state.model_name,
+            state.today_info,
+            _fingerprint_history(state.stock_list, state.date),
+            analysis_styles,
+            prompt_params_list,
+            state.date
+        )
+        try:
+            stored = get_history_store().get_fingerprints(state.stock_list)
+        except Exception as e:
+            print(f"读取输入指纹失败: {e}")
+            stored = {}
+        reused = []
+        analysis_results: List[Optional[str]] = [None] * len(fingerprints)
+        history_results: List[Optional[str]] = [None] * len(fingerprints)
+        for i, (symbol, fingerprint) in enumerate(zip(state.stock_list, fingerprints)):
+            record = stored.get(symbol)
+            hit = record is not None and record["fingerprint"] == fingerprint
+            reused.append(hit)
+            if hit:
+                analysis_prompts[i] = None
+                history_prompts[i] = None
+                analysis_results[i] = record["analysis_result"]
+                history_results[i] = record["history_result"]
+        if any(reused):
+            print(f"增量模式: {sum(reused)} 只股票输入未变化，复用上次结果")
+        state.input_fingerprints = fingerprints
+        state.reused = reused
+        state.analysis_results = analysis_results
+        state.history_results = history_results
     
-    # 进行今日分析
-    analysis_results = agent.infomation_prompts_analysis(state.analysis_prompts)
+    # 新闻与同一股票近期输入近似重复时标记，reuse 模式下直接复用上次的分析结果
+    _check_news_duplicates(state, config, analysis_prompts)
     
-    # 进行历史总结
-    history_results = agent.history_prompts_analysis(state.history_prompts)
+    # 带有 run_id 时登记运行；恢复运行只处理检查点中尚未完成的股票
+    if state.run_id is not None:
+        _resume_from_checkpoint(state, analysis_prompts, history_prompts)
     
     # 更新状态
-    state.analysis_results = analysis_results
-    state.history_results = history_results
+    state.analysis_prompts = analysis_prompts
+    state.history_prompts = history_prompts
+    state.analysis_errors = analysis_errors
+    state.history_errors = history_errors
+    state.prompt_hashes = prompt_hashes
     return state
 
+def _check_news_duplicates(
+    state: AgentState,
+    config: Optional["RunnableConfig"],
+    analysis_prompts: List[Optional[str]]
+) -> None:
+    """
+    对需要调用LLM的股票计算新闻的 MinHash 签名，与该股票此前 NEWS_DEDUP_WINDOW_DAYS 天内保存的签名比较
+
+    相似度不低于阈值即标记为近似重复；reuse 模式下分析风格和模型都相同时复用上次的分析结果并清空分析提示词，
+    历史总结仍照常生成。检测的股票数、命中数和复用数作为 news_dedup 事件计入运行汇总。
+    """
+    settings = dedup_settings(state.news_dedup)
+    if settings["mode"] == "off":
+        return
+    total = len(state.stock_list)
+    reused = state.reused or [False] * total
+    signatures: List[Optional[List[int]]] = [None] * total
+    for i in range(total):
+        if reused[i] or analysis_prompts[i] is None:
+            continue
+        params = state.prompt_params_list[i] if state.prompt_params_list and i < len(state.prompt_params_list) else None
+        signatures[i] = minhash(news_text(state.today_info[i], params))
+    state.news_signatures = signatures
+    state.news_duplicates = [None] * total
+    pending = [i for i, signature in enumerate(signatures) if signature is not None]
+    hits = reuse_count = 0
+    if pending:
+        # 只与之前日期的输入比较，同一天重复运行不算重复新闻
+        date = datetime.strptime(state.date or datetime.now().strftime('%Y-%m-%d'), '%Y-%m-%d')
+        start = (date - timedelta(days=settings["window_days"])).strftime('%Y-%m-%d')
+        end = (date - timedelta(days=1)).strftime('%Y-%m-%d')
+        try:
+            stored = get_history_store().get_news_signatures([state.stock_list[i] for i in pending], start, end)
+        except Exception as e:
+            print(f"读取新闻签名失败: {e}")
+            stored = {}
+        for i in pending:
+            candidates = [
+                dict(record, signature=unpack_signature(record["signature"]))
+                for record in stored.get(state.stock_list[i], [])
+            ]
+            match = best_match(signatures[i], candidates, settings["threshold"])
+            if match is None:
+                continue
+            record, score = match
+            hits += 1
+            style = state.analysis_styles[i] if i < len(state.analysis_styles) else 'network_effect'
+            reuse = (
+                settings["mode"] == "reuse"
+                and record["style"] == style
+                and record["model_name"] == state.model_name
+                and not is_error_result(record["analysis_result"])
+            )
+            if reuse:
+                if state.analysis_results is None:
+                    state.analysis_results = [None] * total
+                analysis_prompts[i] = None
+                state.analysis_results[i] = record["analysis_result"]
+                reuse_count += 1
+            state.news_duplicates[i] = {"date": record["date"], "similarity": score, "reused": reuse}
+        if hits:
+            print(f"新闻去重: {hits} 只股票的新闻与近期输入近似重复，复用 {reuse_count} 条分析结果")
+    tracer = _get_tracer(config)
+    if tracer is not None:
+        tracer.emit({
+            "type": "news_dedup",
+            "mode": settings["mode"],
+            "threshold": settings["threshold"],
+            "window_days": settings["window_days"],
+            "checked": len(pending),
+            "duplicates": hits,
+            "reused": reuse_count,
+        })
+
+def _resume_from_checkpoint(
+    state: AgentState,
+    analysis_prompts: List[Optional[str]],
+    history_prompts: List[Optional[str]]
+) -> None:
+    """读取检查点中已完成的结果填入状态，并清空对应的提示词以跳过LLM调用"""
+    store = get_checkpoint_store()
+    try:
+        if not store.start(state.run_id):
+            return
+        done = {
+            "analysis": store.get_results(state.run_id, "analysis", state.stock_list),
+            "history": store.get_results(state.run_id, "history", state.stock_list),
+        }
+    except Exception as e:
+        print(f"读取检查点失败: {e}")
+        return
+    total = len(state.stock_list)
+    state.analysis_results = state.analysis_results or [None] * total
+    state.history_results = state.history_results or [None] * total
+    for kind, prompts, results in (
+        ("analysis", analysis_prompts, state.analysis_results),
+        ("history", history_prompts, state.history_results),
+    ):
+        for i, result in enumerate(done[kind]):
+            if result is not None and prompts[i] is not None:
+                prompts[i] = None
+                results[i] = result
+    restored = sum(result is not None for results in done.values() for result in results)
+    print(f"恢复运行 {state.run_id}: 检查点中已有 {restored} 条结果，只处理未完成的股票")
+
+def _usage_collector(config: Optional["RunnableConfig"]) -> Tracer:
+    """为一个节点创建单独收集LLM请求事件的埋点，事件同时转发给本次运行的埋点"""
+    tracer = _get_tracer(config)
+    return Tracer([tracer.emit] if tracer is not None else None)
+
+def _usage_by_index(collector: Tracer, kind: str, total: int) -> List[Optional[Dict[str, Any]]]:
+    """
+    按提示词序号汇总收集到的LLM请求：{"model_name", "prompt_tokens", "completion_tokens",
+    "total_tokens", "cached"}，未调用LLM的序号为 None；打包请求的token用量按包内股票数平均分摊
+    """
+    usage: List[Optional[Dict[str, Any]]] = [None] * total
+    for event in collector.events:
+        if event["type"] != "llm_call" or event["kind"] != kind:
+            continue
+        indices = event["indices"] or ([event["index"]] if event["index"] is not None else [])
+        for i in indices:
+            if i >= total:
+                continue
+            entry = usage[i]
+            if entry is None:
+                entry = usage[i] = {
+                    "model_name": event["model_name"],
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                    "cached": True,
+                }
+            if event["error"] is None:
+                entry["model_name"] = event["model_name"]
+            entry["cached"] = entry["cached"] and event["cached"]
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                entry[key] += ((event["usage"] or {}).get(key) or 0) // len(indices)
+    return usage
+
+def _run_routed(
+    state: AgentState,
+    config: Optional["RunnableConfig"],
+    kind: str,
+    prompts: List[Optional[str]],
+    tags: List[str]
+) -> Tuple[List[Optional[str]], List[Optional[Dict[str, Any]]]]:
+    """
+    按路由结果把提示词分给不同模型，多个模型的请求同时进行，结果按输入顺序合并
+
+    Returns:
+        (结果列表, 每条提示词实际使用的模型和token用量，见 _usage_by_index)
+    """
+    models = route_models(tags, state.model_name)
+    groups: Dict[str, List[Optional[str]]] = {}
+    for i, model in enumerate(models):
+        group = groups.setdefault(model, [None] * len(prompts))
+        group[i] = prompts[i]
+    on_result = _checkpoint_callback(state, kind)
+    collector = _usage_collector(config)
+
+    def run_group(model: str, group: List[Optional[str]]) -> List[Optional[str]]:
+        agent = _get_agent(state, config, model)
+        run = agent.infomation_prompts_analysis if kind == "analysis" else agent.history_prompts_analysis
+        return run(group, collector, tags, state.stock_list, on_result)
+
+    if len(groups) == 1:
+        results = run_group(*next(iter(groups.items())))
+        return results, _usage_by_index(collector, kind, len(prompts))
+    results: List[Optional[str]] = [None] * len(prompts)
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        for group_results in pool.map(lambda item: run_group(*item), groups.items()):
+            for i, result in enumerate(group_results):
+                if result is not None:
+                    results[i] = result
+    return results, _usage_by_index(collector, kind, len(prompts))
+
+async def _arun_routed(
+    state: AgentState,
+    config: Optional["RunnableConfig"],
+    kind: str,
+    prompts: List[Optional[str]],
+    tags: List[str]
+) -> Tuple[List[Optional[str]], List[Optional[Dict[str, Any]]]]:
+    """_run_routed 的异步版本，多个模型的请求在同一个事件循环中并发进行"""
+    models = route_models(tags, state.model_name)
+    groups: Dict[str, List[Optional[str]]] = {}
+    for i, model in enumerate(models):
+        group = groups.setdefault(model, [None] * len(prompts))
+        group[i] = prompts[i]
+    on_result = _checkpoint_callback(state, kind)
+    collector = _usage_collector(config)
+
+    async def run_group(model: str, group: List[Optional[str]]) -> List[Optional[str]]:
+        agent = _get_agent(state, config, model)
+        run = agent.ainfomation_prompts_analysis if kind == "analysis" else agent.ahistory_prompts_analysis
+        return await run(group, collector, tags, state.stock_list, on_result)
+
+    results: List[Optional[str]] = [None] * len(prompts)
+    for group_results in await asyncio.gather(*(run_group(*item) for item in groups.items())):
+        for i, result in enumerate(group_results):
+            if result is not None:
+                results[i] = result
+    return results, _usage_by_index(collector, kind, len(prompts))
+
+def analyze_stocks(state: AgentState, config: "RunnableConfig" = None) -> Dict[str, Any]:
+    """今日分析节点，与历史总结节点并行执行"""
+    styles = [
+        state.analysis_styles[i] if i < len(state.analysis_styles) else 'network_effect'
+        for i in range(len(state.analysis_prompts))
+    ]
+    analysis_results, analysis_usage = _run_routed(state, config, "analysis", state.analysis_prompts, styles)
+    analysis_results = _apply_prompt_errors(analysis_results, state.analysis_errors)
+    analysis_results = _apply_prefilled(analysis_results, state.analysis_results)
+    # 并行分支只返回自己负责的字段，避免与另一分支的写入冲突
+    return {"analysis_results": analysis_results, "analysis_usage": analysis_usage}
+
+def summarize_history(state: AgentState, config: "RunnableConfig" = None) -> Dict[str, Any]:
+    """历史总结节点，与今日分析节点并行执行"""
+    tags = ['network_effect_history'] * len(state.history_prompts)
+    history_results, _ = _run_routed(state, config, "history", state.history_prompts, tags)
+    history_results = _apply_prompt_errors(history_results, state.history_errors)
+    history_results = _apply_prefilled(history_results, state.history_results)
+    return {"history_results": history_results}
+
+async def aanalyze_stocks(state: AgentState, config: "RunnableConfig" = None) -> Dict[str, Any]:
+    """今日分析节点的异步版本"""
+    styles = [
+        state.analysis_styles[i] if i < len(state.analysis_styles) else 'network_effect'
+        for i in range(len(state.analysis_prompts))
+    ]
+    analysis_results, analysis_usage = await _arun_routed(state, config, "analysis", state.analysis_prompts, styles)
+    analysis_results = _apply_prompt_errors(analysis_results, state.analysis_errors)
+    analysis_results = _apply_prefilled(analysis_results, state.analysis_results)
+    return {"analysis_results": analysis_results, "analysis_usage": analysis_usage}
+
+async def asummarize_history(state: AgentState, config: "RunnableConfig" = None) -> Dict[str, Any]:
+    """历史总结节点的异步版本"""
+    tags = ['network_effect_history'] * len(state.history_prompts)
+    history_results, _ = await _arun_routed(state, config, "history", state.history_prompts, tags)
+    history_results = _apply_prompt_errors(history_results, state.history_errors)
+    history_results = _apply_prefilled(history_results, state.history_results)
+    return {"history_results": history_results}
+
 def save_results(state: AgentState) -> AgentState:
     """保存结果节点"""
-    update_history(state.stock_list, state.history_results)
+    # 提示词编译失败或LLM调用失败的股票没有新的历史总结，保留原有历史信息；增量模式复用结果的股票不重复写入
+    total = len(state.stock_list)
+    errors = state.history_errors or [None] * total
+    reused = state.reused or [False] * total
+    saved = [
+        (symbol, result)
+        for symbol, result, error, skip in zip(state.stock_list, state.history_results, errors, reused)
+        if error is None and not skip and not is_error_result(result)
+    ]
+    # save_history 为 False 时（如分片批处理）由调用方统一合并历史信息、新闻签名和输入指纹，
+    # 指纹只应在对应的历史信息写入后保存，否则下次运行会复用结果却读不到这次的历史总结
+    if state.save_history:
+        update_history([symbol for symbol, _ in saved], [result for _, result in saved], date=state.date)
+        fresh = [i for i in range(total) if not reused[i]]
+        update_metrics(
+            [state.stock_list[i] for i in fresh],
+            [state.analysis_results[i] for i in fresh],
+            [state.history_results[i] for i in fresh],
+            date=state.date
+        )
+        save_analysis_results(_analysis_records(state, fresh))
+        _save_news_signatures(state, fresh)
+        if state.incremental:
+            _save_fingerprints(state)
+    if state.run_id is not None:
+        try:
+            get_checkpoint_store().finish(state.run_id)
+        except Exception as e:
+            print(f"标记运行完成失败: {e}")
     return state
 
+def _analysis_records(state: AgentState, indices: List[int]) -> List[Dict[str, Any]]:
+    """
+    把指定序号的分析结果整理为分析结果存储的记录
+
+    提示词编译失败或LLM调用失败的结果不保存，新闻近似重复时复用的结果是此前已保存的分析，也不再保存；
+    从检查点恢复的结果没有token用量，模型记为请求的模型。
+    """
+    date = state.date or datetime.now().strftime('%Y-%m-%d')
+    usage_list = state.analysis_usage or []
+    duplicates = state.news_duplicates or []
+    records = []
+    for i in indices:
+        if i < len(duplicates) and duplicates[i] and duplicates[i]["reused"]:
+            continue
+        result = state.analysis_results[i]
+        prompt_hash = state.prompt_hashes[i] if state.prompt_hashes else None
+        if prompt_hash is None or result is None or is_error_result(result):
+            continue
+        usage = usage_list[i] if i < len(usage_list) else None
+        records.append({
+            "symbol": state.stock_list[i],
+            "date": date,
+            "style": state.analysis_styles[i] if i < len(state.analysis_styles) else 'network_effect',
+            "model_name": usage["model_name"] if usage else state.model_name,
+            "prompt_hash": prompt_hash,
+            "usage": usage,
+            "cached": bool(usage and usage["cached"]),
+            "result": result,
+        })
+    return records
+
+def save_analysis_results(records: List[Dict[str, Any]]) -> None:
+    """把分析结果追加到分析结果存储，失败时只打印错误，不影响分析流程"""
+    if not records:
+        return
+    try:
+        get_results_store().append_many(records)
+    except Exception as e:
+        print(f"保存分析结果失败: {e}")
+
+def _save_news_signatures(state: AgentState, indices: List[int]) -> None:
+    """保存指定股票的新闻签名和分析结果，供之后的运行检测近似重复；LLM调用失败的股票不保存"""
+    if not state.news_signatures:
+        return
+    date = state.date or datetime.now().strftime('%Y-%m-%d')
+    entries = [
+        (
+            state.stock_list[i],
+            date,
+            state.analysis_styles[i] if i < len(state.analysis_styles) else 'network_effect',
+            state.model_name,
+            pack_signature(state.news_signatures[i]),
+            state.analysis_results[i]
+        )
+        for i in indices
+        if state.news_signatures[i] is not None and not is_error_result(state.analysis_results[i])
+    ]
+    try:
+        get_history_store().put_news_signatures(entries)
+    except Exception as e:
+        print(f"保存新闻签名失败: {e}")
+
+def _save_fingerprints(state: AgentState) -> None:
+    """
+    记录本次成功处理的股票的输入指纹
+
+    指纹在编译提示词时按分析日期之前的历史计算，写入本次结果后重复运行仍能命中；
+    LLM调用失败的股票不记录，下次重新分析。
+    """
+    entries = [
+        (symbol, fingerprint, analysis, history)
+        for symbol, fingerprint, analysis, history, skip in zip(
+            state.stock_list, state.input_fingerprints, state.analysis_results, state.history_results, state.reused
+        )
+        if not skip and not is_error_result(analysis) and not is_error_result(history)
+    ]
+    try:
+        get_history_store().put_fingerprints(entries)
+    except Exception as e:
+        print(f"保存输入指纹失败: {e}")
+
 # 创建LangGraph工作流
-def create_analysis_workflow() -> StateGraph:
-    """创建分析工作流"""
+def create_analysis_workflow(use_async: bool = False) -> "StateGraph":
+    """
+    创建分析工作流
+
+    use_async 为 True 时两个LLM节点使用 AsyncOpenAI 的异步实现，工作流需通过 ainvoke 运行；
+    获取行情、编译提示词和保存结果仍是同步节点，由 LangGraph 放到线程池中执行
+    """
+    from langgraph.graph import StateGraph, END
+
     workflow = StateGraph(AgentState)
     
     # 添加节点
-    workflow.add_node("prepare_data", prepare_data)
-    workflow.add_node("compile_prompts", compile_prompts)
-    workflow.add_node("analyze_stocks", analyze_stocks)
-    workflow.add_node("save_results", save_results)
+    workflow.add_node("prepare_data", _traced("prepare_data", prepare_data))
+    workflow.add_node("compile_prompts", _traced("compile_prompts", compile_prompts))
+    if use_async:
+        workflow.add_node("analyze_stocks", _atraced("analyze_stocks", aanalyze_stocks))
+        workflow.add_node("summarize_history", _atraced("summarize_history", asummarize_history))
+    else:
+        workflow.add_node("analyze_stocks", _traced("analyze_stocks", analyze_stocks))
+        workflow.add_node("summarize_history", _traced("summarize_history", summarize_history))
+    workflow.add_node("save_results", _traced("save_results", save_results))
     
-    # 设置流程
+    # 设置流程：今日分析与历史总结并行，两者都完成后再保存结果
     workflow.set_entry_point("prepare_data")
     workflow.add_edge("prepare_data", "compile_prompts")
     workflow.add_edge("compile_prompts", "analyze_stocks")
-    workflow.add_edge("analyze_stocks", "save_results")
+    workflow.add_edge("compile_prompts", "summarize_history")
+    workflow.add_edge(["analyze_stocks", "summarize_history"], "save_results")
     workflow.add_edge("save_results", END)
     
     return workflow.compile()
 
+def _dispatch_symbols(state: PipelineState) -> list:
+    """把每只股票拆成独立的单股票任务，返回分发给 process_symbol 节点的 Send 列表"""
+    from langgraph.types import Send
+
+    sends = []
+    for i, symbol in enumerate(state.stock_list):
+        info = state.today_info_list[i] if state.today_info_list and i < len(state.today_info_list) else None
+        params = state.prompt_params_list[i] if state.prompt_params_list and i < len(state.prompt_params_list) else None
+        task_state = AgentState(
+            model_name=state.model_name,
+            stock_list=[symbol],
+            analysis_styles=[state.analysis_styles[i] if i < len(state.analysis_styles) else 'network_effect'],
+            today_info_list=[info],
+            prompt_params_list=[params],
+            date=state.date,
+            offline=state.offline,
+            incremental=state.incremental,
+            save_history=state.save_history,
+            news_dedup=state.news_dedup
+        )
+        sends.append(Send("process_symbol", {"index": i, "state": task_state}))
+    return sends
+
+def process_symbol(task: Dict[str, Any], config: "RunnableConfig" = None) -> Dict[str, Any]:
+    """单只股票依次完成获取、编译、分析和保存，只返回该股票的结果，中间数据随即释放"""
+    state: AgentState = task["state"]
+    tracer = _get_tracer(config)
+    with tracer.span("process_symbol", index=task["index"]) if tracer is not None else nullcontext():
+        state = _traced("prepare_data", prepare_data)(state, config)
+        state = _traced("compile_prompts", compile_prompts)(state, config)
+        analysis = _traced("analyze_stocks", analyze_stocks)(state, config)
+        state.analysis_results, state.analysis_usage = analysis["analysis_results"], analysis["analysis_usage"]
+        state.history_results = _traced("summarize_history", summarize_history)(state, config)["history_results"]
+        _traced("save_results", save_results)(state, config)
+    return {"results": [{
+        "index": task["index"],
+        "analysis_result": state.analysis_results[0],
+        "history_result": state.history_results[0],
+        "analysis_error": state.analysis_errors[0],
+        "history_error": state.history_errors[0],
+        "reused": bool(state.reused and state.reused[0]),
+        "prompt_hash": state.prompt_hashes[0],
+        "analysis_usage": state.analysis_usage[0],
+        "news_duplicate": state.news_duplicates[0] if state.news_duplicates else None,
+        "news_signature": state.news_signatures[0] if state.news_signatures else None,
+        "input_fingerprint": state.input_fingerprints[0] if state.input_fingerprints else None,
+    }]}
+
+def _backfill_symbol(
+    config: "RunnableConfig",
+    model_name: str,
+    symbol: str,
+    style: str,
+    bars: Dict[str, Dict[str, Any]],
+    info_by_date: Dict[str, Dict[str, Any]],
+    history_text: Optional[str],
+    points: List[Dict[str, Any]],
+    news_dedup: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    按交易日顺序回填单只股票：每天的历史信息由前一天的历史总结和已提取的指标数据点链式生成，
+    不读写历史存储；LLM调用失败的那天不更新链上的历史信息
+
+    Returns:
+        (逐日结果, 待写入分析结果存储的记录)
+    """
+    limit, budget = history_window()
+    points = list(points)
+    days = []
+    records = []
+    for day, bar in bars.items():
+        state = AgentState(
+            model_name=model_name,
+            stock_list=[symbol],
+            analysis_styles=[style],
+            date=day,
+            save_history=False,
+            news_dedup=news_dedup,
+            today_info=[dict(bar, **(info_by_date.get(day) or {}))],
+            history_info=[render_history(points[-limit:] if limit > 0 else None, history_text, budget)]
+        )
+        state = _traced("compile_prompts", compile_prompts)(state, config)
+        analysis = _traced("analyze_stocks", analyze_stocks)(state, config)
+        state.analysis_results, state.analysis_usage = analysis["analysis_results"], analysis["analysis_usage"]
+        state.history_results = _traced("summarize_history", summarize_history)(state, config)["history_results"]
+        analysis_result, history_result = state.analysis_results[0], state.history_results[0]
+        history_error = state.history_errors[0]
+        if history_error is None and not is_error_result(history_result):
+            history_text = history_result
+        metrics = combine_metrics(
+            None if is_error_result(analysis_result) else extract_metrics(analysis_result),
+            None if history_error is not None or is_error_result(history_result) else extract_metrics(history_result)
+        )
+        if metrics is not None:
+            points.append(dict(metrics, date=day))
+        days.append({
+            "date": day,
+            "style": style,
+            "analysis_result": analysis_result,
+            "history_result": history_result,
+            "analysis_error": state.analysis_errors[0],
+            "history_error": history_error,
+            "metrics": metrics,
+            "usage": state.analysis_usage[0],
+        })
+        records += _analysis_records(state, [0])
+    return days, records
+
+def create_pipeline_workflow() -> "StateGraph":
+    """
+    创建流水线工作流：每只股票通过 Send 独立完成 获取 → 编译 → 分析 → 保存，
+    不再等待整批股票完成某一阶段，同时处理的股票数由运行配置中的 max_concurrency 限制
+    """
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(PipelineState)
+    workflow.add_node("process_symbol", process_symbol)
+    workflow.set_conditional_entry_point(_dispatch_symbols, ["process_symbol"])
+    workflow.add_edge("process_symbol", END)
+    return workflow.compile()
+
+class AnalyzerSession:
+    """
+    长生命周期的分析会话，适合在服务中处理大量小请求
+
+    会话只编译一次工作流、只加载一次提示词模板，并为每个服务商维护一个
+    支持长连接的HTTP连接池，同一模型的多次调用复用同一个AgentCall。
+    每次运行都会创建独立的性能埋点，事件推送给 hooks，汇总结果附加在最终状态的 perf_summary 上。
+    """
+
+    def __init__(self, hooks: Optional[List[TraceHook]] = None):
+        """
+        Args:
+            hooks: 性能埋点钩子列表，例如 JsonTraceExporter("data/trace.jsonl")
+        """
+        self.hooks = list(hooks or [])
+        self.templates = {name: get_template(name) for name in get_available_templates()}
+        self._workflow = None
+        self._async_workflow = None
+        self._pipeline = None
+        self._http_clients: Dict[str, "httpx.Client"] = {}
+        self._agents: Dict[str, AgentCall] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def workflow(self):
+        """分析工作流，首次运行时才编译（同时导入 langgraph）"""
+        with self._lock:
+            if self._workflow is None:
+                self._workflow = create_analysis_workflow()
+            return self._workflow
+
+    @property
+    def async_workflow(self):
+        """异步分析工作流，首次调用 arun 时才编译"""
+        with self._lock:
+            if self._async_workflow is None:
+                self._async_workflow = create_analysis_workflow(use_async=True)
+            return self._async_workflow
+
+    @property
+    def pipeline(self):
+        """流水线工作流，首次以流水线模式运行时才编译"""
+        with self._lock:
+            if self._pipeline is None:
+                self._pipeline = create_pipeline_workflow()
+            return self._pipeline
+
+    def get_agent(self, model_name: str) -> AgentCall:
+        """获取模型对应的AgentCall，同一服务商的模型共享HTTP连接池"""
+        with self._lock:
+            agent = self._agents.get(model_name)
+            if agent is None:
+                provider = get_provider(model_name)
+                if provider not in self._http_clients:
+                    self._http_clients[provider] = create_http_client()
+                agent = create_agent_call(model_name, http_client=self._http_clients[provider])
+                self._agents[model_name] = agent
+            return agent
+
+    def run(
+        self,
+        model_name: str,
+        stock_list: List[str],
+        analysis_styles: List[str],
+        today_info_list: Optional[List[Optional[Dict]]] = None,
+        prompt_params_list: Optional[List[Optional[Dict]]] = None,
+        date: Optional[str] = None,
+        tracer: Optional[Tracer] = None,
+        incremental: bool = False,
+        run_id: Optional[str] = None,
+        save_history: bool = True,
+        offline: Optional[bool] = None,
+        news_dedup: Optional[str] = None
+    ) -> AgentState:
+        """
+        运行一次完整的分析工作流，返回附带性能汇总的最终状态
+
+        incremental 为 True 时，输入与上次运行相同的股票直接复用上次结果，跳过LLM调用和历史写入。
+        传入 run_id 时每只股票的结果完成后立即写入检查点；运行中断后以同一个 run_id 重新运行，
+        只处理尚未完成的股票。save_history 为 False 时不写入历史信息、新闻签名和输入指纹（state.input_fingerprints），
+        由调用方写入历史信息后自行保存。
+        offline 为 True 时只从行情缓存读取行情数据，不访问Yahoo，默认读取环境变量 MARKET_DATA_OFFLINE。
+        news_dedup 为新闻近似重复检测模式（off / flag / reuse），默认读取环境变量 NEWS_DEDUP_MODE。
+        """
+        tracer = tracer or Tracer(self.hooks)
+        initial_state = AgentState(
+            model_name=model_name,
+            stock_list=stock_list,
+            analysis_styles=analysis_styles,
+            today_info_list=today_info_list,
+            prompt_params_list=prompt_params_list,
+            date=date,
+            incremental=incremental,
+            run_id=run_id,
+            save_history=save_history,
+            offline=offline,
+            news_dedup=news_dedup
+        )
+        final_state = self.workflow.invoke(
+            initial_state,
+            config={"configurable": {"session": self, "tracer": tracer}}
+        )
+        final_state = AgentState(**final_state)
+        final_state.perf_summary = tracer.summary()
+        return final_state
+
+    async def arun(
+        self,
+        model_name: str,
+        stock_list: List[str],
+        analysis_styles: List[str],
+        today_info_list: Optional[List[Optional[Dict]]] = None,
+        prompt_params_list: Optional[List[Optional[Dict]]] = None,
+        date: Optional[str] = None,
+        tracer: Optional[Tracer] = None,
+        incremental: bool = False,
+        run_id: Optional[str] = None,
+        save_history: bool = True,
+        offline: Optional[bool] = None,
+        news_dedup: Optional[str] = None
+    ) -> AgentState:
+        """
+        run 的异步版本，通过 ainvoke 运行异步工作流，适合嵌入 asyncio 服务，
+        LLM请求在事件循环中并发进行，不为每个请求占用线程；参数含义同 run
+        """
+        tracer = tracer or Tracer(self.hooks)
+        initial_state = AgentState(
+            model_name=model_name,
+            stock_list=stock_list,
+            analysis_styles=analysis_styles,
+            today_info_list=today_info_list,
+            prompt_params_list=prompt_params_list,
+            date=date,
+            incremental=incremental,
+            run_id=run_id,
+            save_history=save_history,
+            offline=offline,
+            news_dedup=news_dedup
+        )
+        final_state = await self.async_workflow.ainvoke(
+            initial_state,
+            config={"configurable": {"session": self, "tracer": tracer}}
+        )
+        final_state = AgentState(**final_state)
+        final_state.perf_summary = tracer.summary()
+        return final_state
+
+    def run_pipeline(
+        self,
+        model_name: str,
+        stock_list: List[str],
+        analysis_styles: List[str],
+        today_info_list: Optional[List[Optional[Dict]]] = None,
+        prompt_params_list: Optional[List[Optional[Dict]]] = None,
+        date: Optional[str] = None,
+        tracer: Optional[Tracer] = None,
+        incremental: bool = False,
+        max_in_flight: Optional[int] = None,
+        save_history: bool = True,
+        offline: Optional[bool] = None,
+        news_dedup: Optional[str] = None
+    ) -> AgentState:
+        """
+        以流水线模式运行：每只股票独立完成获取、编译、分析和保存，行情获取与LLM请求相互重叠
+
+        同时处理的股票数不超过 max_in_flight（默认为该模型的最大并发请求数），
+        内存占用与并发数而不是股票总数成正比。返回的状态只包含每只股票的结果和错误，
+        不保留今日信息、历史信息和提示词。每只股票完成即保存历史信息，中断后以 incremental=True
+        重新运行即可跳过已完成的股票（输入指纹只在增量模式下保存，被中断的运行也需要传入 incremental=True）。save_history、offline 和 news_dedup 的含义同 run。
+        """
+        tracer = tracer or Tracer(self.hooks)
+        if max_in_flight is None:
+            max_in_flight = self.get_agent(model_name).max_concurrency
+        initial_state = PipelineState(
+            model_name=model_name,
+            stock_list=stock_list,
+            analysis_styles=analysis_styles,
+            today_info_list=today_info_list,
+            prompt_params_list=prompt_params_list,
+            date=date,
+            incremental=incremental,
+            save_history=save_history,
+            offline=offline,
+            news_dedup=news_dedup
+        )
+        final_state = self.pipeline.invoke(
+            initial_state,
+            config={"configurable": {"session": self, "tracer": tracer}, "max_concurrency": max(max_in_flight, 1)}
+        )
+        total = len(stock_list)
+        state = AgentState(
+            model_name=model_name,
+            stock_list=stock_list,
+            analysis_styles=analysis_styles,
+            date=date,
+            incremental=incremental,
+            analysis_results=[None] * total,
+            history_results=[None] * total,
+            analysis_errors=[None] * total,
+            history_errors=[None] * total,
+            reused=[False] * total,
+            prompt_hashes=[None] * total,
+            analysis_usage=[None] * total,
+            news_duplicates=[None] * total,
+            news_signatures=[None] * total,
+            input_fingerprints=[None] * total if incremental else None
+        )
+        for result in final_state["results"]:
+            i = result["index"]
+            state.analysis_results[i] = result["analysis_result"]
+            state.history_results[i] = result["history_result"]
+            state.analysis_errors[i] = result["analysis_error"]
+            state.history_errors[i] = result["history_error"]
+            state.reused[i] = result["reused"]
+            state.prompt_hashes[i] = result["prompt_hash"]
+            state.analysis_usage[i] = result["analysis_usage"]
+            state.news_duplicates[i] = result["news_duplicate"]
+            state.news_signatures[i] = result["news_signature"]
+            if incremental:
+                state.input_fingerprints[i] = result["input_fingerprint"]
+        state.perf_summary = tracer.summary()
+        return state
+
+    def backfill(
+        self,
+        model_name: str,
+        stock_list: List[str],
+        start_date: str,
+        end_date: str,
+        analysis_styles: Optional[List[str]] = None,
+        daily_info: Optional[Dict[str, Dict[str, Dict]]] = None,
+        tracer: Optional[Tracer] = None,
+        max_in_flight: Optional[int] = None,
+        save_history: bool = True,
+        offline: Optional[bool] = None,
+        news_dedup: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        回填 [start_date, end_date] 区间内每个交易日的分析和历史总结
+
+        全部股票的K线只批量下载一次；每只股票按交易日顺序处理，前一天的历史总结和指标
+        直接作为后一天的历史信息，不重复读取历史存储；不同股票同时处理，数量不超过 max_in_flight
+        （默认为该模型的最大并发请求数）。每只股票全部交易日完成后，历史总结和指标在一个事务内写入历史存储，
+        分析结果一次写入分析结果存储。
+
+        Args:
+            daily_info: 可选的 {股票代码: {日期: 当日附加信息}}，例如每天的新闻摘要，与当天K线合并作为今日信息；
+                K线中没有新闻，缺少所需字段的日期与单日运行一样会因提示词参数缺失而跳过LLM调用
+            offline: 为 True 时只从行情缓存逐日读取K线，默认读取环境变量 MARKET_DATA_OFFLINE
+            news_dedup: 新闻近似重复检测模式，默认读取环境变量 NEWS_DEDUP_MODE
+
+        同一股票以多个分析风格出现时，每个风格各自回填一遍，结果依次排在该股票的列表中，
+        历史存储中同一日期保留最后完成的风格的历史总结。
+
+        Returns:
+            {"results": {股票代码: [每个交易日的 {"date", "style", "analysis_result", "history_result",
+            "analysis_error", "history_error", "metrics", "usage"}]}, "perf_summary": 性能汇总}
+        """
+        tracer = tracer or Tracer(self.hooks)
+        config = {"configurable": {"session": self, "tracer": tracer}}
+        analysis_styles = analysis_styles or []
+        daily_info = daily_info or {}
+        if max_in_flight is None:
+            max_in_flight = self.get_agent(model_name).max_concurrency
+        with tracer.span("prepare_data"):
+            bars = fetch_ohlcv_range(stock_list, start_date, end_date, offline=offline)
+            # 链的起点为回填区间开始之前的历史信息，整个区间只读取一次
+            store = get_history_store()
+            limit, _ = history_window()
+            before = (datetime.strptime(start_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+            try:
+                history_data = store.get_many(stock_list, as_of=before)
+                series = store.get_metric_series(stock_list, as_of=before, limit=limit)
+            except Exception as e:
+                print(f"读取历史信息失败: {e}")
+                history_data, series = {}, {}
+
+        def run_symbol(i: int, symbol: str, style: str) -> List[Dict[str, Any]]:
+            with tracer.span("backfill_symbol", index=i):
+                days, records = _backfill_symbol(
+                    config, model_name, symbol, style, bars.get(symbol) or {},
+                    daily_info.get(symbol) or {}, history_data.get(symbol), series.get(symbol) or [],
+                    news_dedup
+                )
+            if save_history:
+                now = time.time()
+                entries = [
+                    (symbol, day["date"], day["history_result"], now)
+                    for day in days
+                    if day["history_error"] is None and not is_error_result(day["history_result"])
+                ]
+                metric_entries = [(symbol, day["date"], day["metrics"], now) for day in days if day["metrics"]]
+                try:
+                    store.merge_all(entries, metric_entries)
+                except Exception as e:
+                    print(f"保存 {symbol} 的回填结果失败: {e}")
+                save_analysis_results(records)
+            print(f"回填 {symbol}（{style}）: 完成 {len(days)} 个交易日")
+            return days
+
+        # 先按原始位置配对分析风格再去重，重复的股票代码不会错配风格
+        pairs = list(dict.fromkeys(
+            (symbol, analysis_styles[i] if i < len(analysis_styles) else 'network_effect')
+            for i, symbol in enumerate(stock_list)
+        ))
+        results: Dict[str, List[Dict[str, Any]]] = {}
+        with ThreadPoolExecutor(max_workers=max(min(max_in_flight, len(pairs)), 1)) as pool:
+            for (symbol, _), days in zip(pairs, pool.map(run_symbol, range(len(pairs)), *zip(*pairs))):
+                results.setdefault(symbol, []).extend(days)
+        return {"results": results, "perf_summary": tracer.summary()}
+
+    def stream(
+        self,
+        model_name: str,
+        stock_list: List[str],
+        analysis_styles: List[str],
+        today_info_list: Optional[List[Optional[Dict]]] = None,
+        prompt_params_list: Optional[List[Optional[Dict]]] = None,
+        date: Optional[str] = None,
+        stream_tokens: bool = False,
+        tracer: Optional[Tracer] = None,
+        incremental: bool = False,
+        run_id: Optional[str] = None,
+        offline: Optional[bool] = None,
+        news_dedup: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        流式分析，每只股票的分析或历史总结一完成就立即产出，不等待整批结束
+
+        产出的事件:
+            {"type": "token", "kind", "index", "symbol", "delta"}: 模型输出的文本片段，仅 stream_tokens=True 时产出
+            {"type": "analysis", "index", "symbol", "result"}: 单只股票的分析结果
+            {"type": "history", "index", "symbol", "result"}: 单只股票的历史总结
+            {"type": "done", "state"}: 全部完成并保存历史信息后的最终状态
+
+        incremental、run_id、offline 和 news_dedup 的含义同 run，复用的结果与提示词编译失败的股票一样最先产出
+        """
+        tracer = tracer or Tracer(self.hooks)
+        config = {"configurable": {"session": self, "tracer": tracer}}
+        state = AgentState(
+            model_name=model_name,
+            stock_list=stock_list,
+            analysis_styles=analysis_styles,
+            today_info_list=today_info_list,
+            prompt_params_list=prompt_params_list,
+            date=date,
+            incremental=incremental,
+            run_id=run_id,
+            offline=offline,
+            news_dedup=news_dedup
+        )
+        with tracer.span("prepare_data"):
+            state = prepare_data(state)
+        with tracer.span("compile_prompts"):
+            state = compile_prompts(state, config)
+        total = len(stock_list)
+        styles = [analysis_styles[i] if i < len(analysis_styles) else 'network_effect' for i in range(total)]
+        models = {
+            "analysis": route_models(styles, model_name),
+            "history": route_models(['network_effect_history'] * total, model_name),
+        }
+        # 先提交全部分析任务，让每只股票的分析结果尽早返回
+        # 提示词编译失败的股票不调用LLM，直接以结构化错误的提示信息作为结果
+        tasks = [("analysis", i, prompt) for i, prompt in enumerate(state.analysis_prompts) if prompt is not None]
+        tasks += [("history", i, prompt) for i, prompt in enumerate(state.history_prompts) if prompt is not None]
+        results = {
+            "analysis": _apply_prefilled(
+                _apply_prompt_errors([None] * total, state.analysis_errors), state.analysis_results
+            ),
+            "history": _apply_prefilled(
+                _apply_prompt_errors([None] * total, state.history_errors), state.history_results
+            ),
+        }
+        checkpoints = {kind: _checkpoint_callback(state, kind) for kind in ("analysis", "history")}
+        collector = _usage_collector(config)
+        for kind in ("analysis", "history"):
+            for i, result in enumerate(results[kind]):
+                if result is not None:
+                    yield {"type": kind, "index": i, "symbol": stock_list[i], "result": result}
+        events = queue.Queue()
+
+        def run_one(kind: str, i: int, prompt: str) -> None:
+            try:
+                on_token = None
+                if stream_tokens:
+                    on_token = lambda delta: events.put(
+                        {"type": "token", "kind": kind, "index": i, "symbol": stock_list[i], "delta": delta}
+                    )
+                tag = 'network_effect_history' if kind == "history" else styles[i]
+                agent = self.get_agent(models[kind][i])
+                text = agent.run_task(kind, prompt, i, total, on_token, collector, tag)
+                if checkpoints[kind] is not None:
+                    checkpoints[kind](i, text)
+                events.put({"type": kind, "index": i, "symbol": stock_list[i], "result": text})
+            except Exception as e:
+                events.put({"type": "error", "error": e})
+
+        pool = ThreadPoolExecutor(max_workers=max(self.get_agent(model_name).max_concurrency, 1))
+        try:
+            for task in tasks:
+                pool.submit(run_one, *task)
+            remaining = len(tasks)
+            while remaining:
+                event = events.get()
+                if event["type"] == "error":
+                    raise event["error"]
+                if event["type"] != "token":
+                    results[event["type"]][event["index"]] = event["result"]
+                    remaining -= 1
+                yield event
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        state.analysis_results = results["analysis"]
+        state.history_results = results["history"]
+        state.analysis_usage = _usage_by_index(collector, "analysis", total)
+        with tracer.span("save_results"):
+            save_results(state)
+        state.perf_summary = tracer.summary()
+        yield {"type": "done", "state": state}
+
+    def close(self) -> None:
+        """关闭会话持有的HTTP连接池和各模型的对冲请求线程池"""
+        with self._lock:
+            for agent in self._agents.values():
+                agent.close()
+            for http_client in self._http_clients.values():
+                http_client.close()
+            self._http_clients.clear()
+            self._agents.clear()
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环中的异步客户端和会话持有的HTTP连接池"""
+        with self._lock:
+            agents = list(self._agents.values())
+        for agent in agents:
+            await agent.aclose()
+        self.close()
+
+    def __enter__(self) -> "AnalyzerSession":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_default_session: Optional[AnalyzerSession] = None
+_default_session_lock = threading.Lock()
+
+def get_default_session() -> AnalyzerSession:
+    """获取进程内共享的默认分析会话"""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = AnalyzerSession()
+        return _default_session
+
 # 便捷函数，用于外部直接调用
 def analyze_stocks_simple(
     model_name: str,
@@ -228,7 +1621,11 @@ def analyze_stocks_simple(
     analysis_styles: List[str],
     today_info_list: Optional[List[Optional[Dict]]] = None,
     prompt_params_list: Optional[List[Optional[Dict]]] = None,
-    date: Optional[str] = None
+    date: Optional[str] = None,
+    incremental: bool = False,
+    run_id: Optional[str] = None,
+    offline: Optional[bool] = None,
+    news_dedup: Optional[str] = None
 ) -> List[str]:
     """
     简化的分析函数，用于外部直接调用
@@ -240,25 +1637,19 @@ def analyze_stocks_simple(
         today_info_list: 可选的今日信息列表
         prompt_params_list: 可选的提示词参数列表
         date: 可选的日期，用于指定获取哪一天的数据
+        incremental: 是否启用增量模式，输入未变化的股票复用上次结果
+        run_id: 可选的运行ID，传入时逐只保存检查点，中断后以同一ID重新运行即可恢复
+        offline: 是否只从行情缓存读取行情数据，默认读取环境变量 MARKET_DATA_OFFLINE
+        news_dedup: 新闻近似重复检测模式（off / flag / reuse），默认读取环境变量 NEWS_DEDUP_MODE
     
     Returns:
         分析结果列表
     """
-    # 创建初始状态
-    initial_state = AgentState(
-        model_name=model_name,
-        stock_list=stock_list,
-        analysis_styles=analysis_styles,
-        today_info_list=today_info_list,
-        prompt_params_list=prompt_params_list,
-        date=date
+    final_state = get_default_session().run(
+        model_name, stock_list, analysis_styles, today_info_list, prompt_params_list, date,
+        incremental=incremental, run_id=run_id, offline=offline, news_dedup=news_dedup
     )
-    
-    # 创建并运行工作流
-    workflow = create_analysis_workflow()
-    final_state = workflow.invoke(initial_state)
-    
-    return final_state["analysis_results"]
+    return final_state.analysis_results
 
 # 高级函数，返回完整状态
 def analyze_stocks_advanced(
@@ -267,7 +1658,11 @@ def analyze_stocks_advanced(
     analysis_styles: List[str],
     today_info_list: Optional[List[Optional[Dict]]] = None,
     prompt_params_list: Optional[List[Optional[Dict]]] = None,
-    date: Optional[str] = None
+    date: Optional[str] = None,
+    incremental: bool = False,
+    run_id: Optional[str] = None,
+    offline: Optional[bool] = None,
+    news_dedup: Optional[str] = None
 ) -> AgentState:
     """
     高级分析函数，返回完整状态对象
@@ -279,25 +1674,120 @@ def analyze_stocks_advanced(
         today_info_list: 可选的今日信息列表
         prompt_params_list: 可选的提示词参数列表
         date: 可选的日期，用于指定获取哪一天的数据
+        incremental: 是否启用增量模式，输入未变化的股票复用上次结果
+        run_id: 可选的运行ID，传入时逐只保存检查点，中断后以同一ID重新运行即可恢复
+        offline: 是否只从行情缓存读取行情数据，默认读取环境变量 MARKET_DATA_OFFLINE
+        news_dedup: 新闻近似重复检测模式（off / flag / reuse），默认读取环境变量 NEWS_DEDUP_MODE
     
     Returns:
         包含所有分析数据的AgentState对象
     """
-    # 创建初始状态
-    initial_state = AgentState(
-        model_name=model_name,
-        stock_list=stock_list,
-        analysis_styles=analysis_styles,
-        today_info_list=today_info_list,
-        prompt_params_list=prompt_params_list,
-        date=date
+    return get_default_session().run(
+        model_name, stock_list, analysis_styles, today_info_list, prompt_params_list, date,
+        incremental=incremental, run_id=run_id, offline=offline, news_dedup=news_dedup
     )
+
+# 流水线函数，每只股票独立完成全部阶段
+def analyze_stocks_pipeline(
+    model_name: str,
+    stock_list: List[str],
+    analysis_styles: List[str],
+    today_info_list: Optional[List[Optional[Dict]]] = None,
+    prompt_params_list: Optional[List[Optional[Dict]]] = None,
+    date: Optional[str] = None,
+    incremental: bool = False,
+    max_in_flight: Optional[int] = None,
+    offline: Optional[bool] = None,
+    news_dedup: Optional[str] = None
+) -> AgentState:
+    """
+    流水线分析函数，适合大批量股票，行为见 AnalyzerSession.run_pipeline
     
-    # 创建并运行工作流
-    workflow = create_analysis_workflow()
-    final_state = workflow.invoke(initial_state)
+    Args:
+        model_name: 模型名称
+        stock_list: 股票代码列表
+        analysis_styles: 分析风格列表
+        today_info_list: 可选的今日信息列表
+        prompt_params_list: 可选的提示词参数列表
+        date: 可选的日期，用于指定获取哪一天的数据
+        incremental: 是否启用增量模式，输入未变化的股票复用上次结果
+        max_in_flight: 同时处理的最大股票数，默认为该模型的最大并发请求数
+        offline: 是否只从行情缓存读取行情数据，默认读取环境变量 MARKET_DATA_OFFLINE
+        news_dedup: 新闻近似重复检测模式（off / flag / reuse），默认读取环境变量 NEWS_DEDUP_MODE
+    
+    Returns:
+        包含每只股票结果和错误的AgentState对象
+    """
+    return get_default_session().run_pipeline(
+        model_name, stock_list, analysis_styles, today_info_list, prompt_params_list, date,
+        incremental=incremental, max_in_flight=max_in_flight, offline=offline, news_dedup=news_dedup
+    )
+
+def analyze_stocks_backfill(
+    model_name: str,
+    stock_list: List[str],
+    start_date: str,
+    end_date: str,
+    analysis_styles: Optional[List[str]] = None,
+    daily_info: Optional[Dict[str, Dict[str, Dict]]] = None,
+    max_in_flight: Optional[int] = None,
+    offline: Optional[bool] = None,
+    news_dedup: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    按日期区间回填分析和历史信息，行为见 AnalyzerSession.backfill
+    
+    Args:
+        model_name: 模型名称
+        stock_list: 股票代码列表
+        start_date: 开始日期（YYYY-MM-DD，含）
+        end_date: 结束日期（YYYY-MM-DD，含）
+        analysis_styles: 可选的分析风格列表，默认 network_effect
+        daily_info: 可选的 {股票代码: {日期: 当日附加信息（如新闻摘要）}}
+        max_in_flight: 同时处理的最大股票数，默认为该模型的最大并发请求数
+        offline: 是否只从行情缓存读取K线，默认读取环境变量 MARKET_DATA_OFFLINE
+        news_dedup: 新闻近似重复检测模式（off / flag / reuse），默认读取环境变量 NEWS_DEDUP_MODE
+    
+    Returns:
+        每只股票逐日的结果和性能汇总
+    """
+    return get_default_session().backfill(
+        model_name, stock_list, start_date, end_date, analysis_styles, daily_info, max_in_flight=max_in_flight, offline=offline, news_dedup=news_dedup
+    )
+
+# 流式函数，逐只产出分析结果
+def analyze_stocks_stream(
+    model_name: str,
+    stock_list: List[str],
+    analysis_styles: List[str],
+    today_info_list: Optional[List[Optional[Dict]]] = None,
+    prompt_params_list: Optional[List[Optional[Dict]]] = None,
+    date: Optional[str] = None,
+    stream_tokens: bool = False,
+    offline: Optional[bool] = None,
+    news_dedup: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    流式分析函数，每只股票完成后立即产出结果事件，事件格式见 AnalyzerSession.stream
+    
+    Args:
+        model_name: 模型名称
+        stock_list: 股票代码列表
+        analysis_styles: 分析风格列表
+        today_info_list: 可选的今日信息列表
+        prompt_params_list: 可选的提示词参数列表
+        date: 可选的日期，用于指定获取哪一天的数据
+        stream_tokens: 是否同时产出模型输出的文本片段
+        offline: 是否只从行情缓存读取行情数据，默认读取环境变量 MARKET_DATA_OFFLINE
+        news_dedup: 新闻近似重复检测模式（off / flag / reuse），默认读取环境变量 NEWS_DEDUP_MODE
     
-    return final_state
+    Returns:
+        分析事件迭代器
+    """
+    return get_default_session().stream(
+        model_name, stock_list, analysis_styles, today_info_list, prompt_params_list, date, stream_tokens,
+        offline=offline, news_dedup=news_dedup
+    )
 
 if __name__ == "__main__":
     # 示例调用
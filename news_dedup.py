@@ -0,0 +1,146 @@
+# news_dedup.py - 新闻近似重复检测
+"""
+同一篇通稿经常以几乎相同的文字出现在多只股票或连续几天的 news_summary / raw_news_text 中，
+每份副本都会触发一次完整的LLM分析。本模块对新闻文本做字符 shingle 的 MinHash 签名，
+在本地估算与同一股票近期输入的 Jaccard 相似度，不依赖任何网络服务。
+
+模式（环境变量 NEWS_DEDUP_MODE）:
+    off    不检测（默认）
+    flag   只标记近似重复并计入运行汇总
+    reuse  近似重复且分析风格和模型相同时直接复用上次的分析结果，不再调用LLM
+"""
+import hashlib
+import os
+import random
+import re
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from env_config import load_env
+
+DEDUP_MODES = ("off", "flag", "reuse")
+
+# 参与比较的新闻字段
+NEWS_FIELDS = ("news_summary", "raw_news_text")
+
+DEFAULT_THRESHOLD = 0.7
+DEFAULT_WINDOW_DAYS = 7
+# 字符 shingle 长度，中文按字计；较短的 shingle 对改写个别词语的通稿更宽容
+SHINGLE_SIZE = 4
+NUM_PERMUTATIONS = 64
+# 文本短于该长度（归一化后）时不检测，避免短标题之间误判
+MIN_TEXT_LENGTH = 20
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(20240601)
+# 固定种子生成的哈希参数，不同进程和不同运行得到的签名可以直接比较；
+# shingle 哈希和参数都取32位，a * h + b 不超过64位，可以用 numpy 的 uint64 精确计算
+_PERMUTATIONS = [
+    (_random.randrange(1, 1 << 32), _random.randrange(0, 1 << 32))
+    for _ in range(NUM_PERMUTATIONS)
+]
+_NOISE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def dedup_settings(mode: Optional[str] = None) -> Dict[str, Any]:
+    """
+    读取检测配置（环境变量 NEWS_DEDUP_MODE / NEWS_DEDUP_THRESHOLD / NEWS_DEDUP_WINDOW_DAYS）
+
+    Args:
+        mode: 可选，覆盖环境变量中的模式
+    """
+    load_env()
+    mode = (mode or os.getenv('NEWS_DEDUP_MODE') or 'off').strip().lower()
+    if mode not in DEDUP_MODES:
+        print(f"未知的新闻去重模式 {mode}，改为 off")
+        mode = 'off'
+    return {
+        "mode": mode,
+        "threshold": float(os.getenv('NEWS_DEDUP_THRESHOLD') or DEFAULT_THRESHOLD),
+        "window_days": int(os.getenv('NEWS_DEDUP_WINDOW_DAYS') or DEFAULT_WINDOW_DAYS),
+    }
+
+
+def news_text(*sources: Optional[Dict[str, Any]]) -> str:
+    """从今日信息和提示词参数中取出新闻字段，按字段顺序拼接"""
+    parts = []
+    for source in sources:
+        for field in NEWS_FIELDS:
+            value = (source or {}).get(field)
+            if isinstance(value, str) and value.strip():
+                parts.append(value)
+    return "\n".join(parts)
+
+
+def minhash(text: str) -> Optional[List[int]]:
+    """
+    计算文本的 MinHash 签名
+
+    文本先去掉空白和标点并转为小写，只比较文字本身；归一化后过短时返回 None。
+    每个 shingle 只计算一次哈希，全部排列用 numpy 一次算出。
+    """
+    import numpy as np
+
+    normalized = _NOISE.sub("", text).lower()
+    if len(normalized) < MIN_TEXT_LENGTH:
+        return None
+    shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+            for shingle in shingles
+        ),
+        dtype=np.uint64,
+        count=len(shingles)
+    )
+    a, b = _permutation_arrays()
+    values = (hashes[None, :] * a[:, None] + b[:, None]) % np.uint64(_MERSENNE_PRIME)
+    return values.min(axis=1).tolist()
+
+
+_PERMUTATION_ARRAYS = None
+
+
+def _permutation_arrays():
+    global _PERMUTATION_ARRAYS
+    if _PERMUTATION_ARRAYS is None:
+        import numpy as np
+
+        _PERMUTATION_ARRAYS = (
+            np.array([a for a, _ in _PERMUTATIONS], dtype=np.uint64),
+            np.array([b for _, b in _PERMUTATIONS], dtype=np.uint64),
+        )
+    return _PERMUTATION_ARRAYS
+
+
+def similarity(left: Sequence[int], right: Sequence[int]) -> float:
+    """由两个签名估算 Jaccard 相似度"""
+    if not left or len(left) != len(right):
+        return 0.0
+    return sum(x == y for x, y in zip(left, right)) / len(left)
+
+
+def pack_signature(signature: Sequence[int]) -> bytes:
+    return struct.pack(f"<{len(signature)}Q", *signature)
+
+
+def unpack_signature(data: bytes) -> List[int]:
+    return list(struct.unpack(f"<{len(data) // 8}Q", data))
+
+
+def best_match(
+    signature: Sequence[int],
+    candidates: List[Dict[str, Any]],
+    threshold: float
+) -> Optional[Tuple[Dict[str, Any], float]]:
+    """
+    在候选记录（含 signature 字段）中找出相似度最高且不低于阈值的一条
+
+    Returns:
+        (候选记录, 相似度)，没有达到阈值的候选时返回 None
+    """
+    best = None
+    for candidate in candidates:
+        score = similarity(signature, candidate["signature"])
+        if score >= threshold and (best is None or score > best[1]):
+            best = (candidate, score)
+    return best
@@ -2,6 +2,8 @@
 股票分析提示词模板文件
 包含各种分析类型的模板，支持通过名称提取和占位符替换
 """
+import string
+from typing import Any, Dict, List
 
 网络效应分析新闻模板 = """
 作为平台经济专家，请基于**2024年公司新闻**评估该公司的网络效应：
@@ -80,6 +82,77 @@ PROMPT_TEMPLATES = {
 
 }
 
+class PromptTemplate:
+    """
+    预先解析的提示词模板，解析一次后可重复渲染，并提供所需占位符集合
+    """
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        self._segments = []
+        fields = []
+        simple = True
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(text):
+            if field_name is not None:
+                fields.append(field_name)
+                if format_spec or conversion or not field_name.isidentifier():
+                    simple = False
+            self._segments.append((literal, field_name))
+        self.required_fields = frozenset(fields)
+        # 只有纯 {name} 占位符时才走快速拼接，其余情况交给 str.format
+        self._simple = simple
+
+    def missing_fields(self, params: Dict[str, Any]) -> List[str]:
+        """返回 params 中缺少的占位符，按名称排序"""
+        return sorted(field for field in self.required_fields if field not in params)
+
+    def render(self, **kwargs) -> str:
+        """填充占位符，缺少参数时与 str.format 一样抛出 KeyError"""
+        if not self._simple:
+            return self.text.format(**kwargs)
+        parts = []
+        for literal, field_name in self._segments:
+            parts.append(literal)
+            if field_name is not None:
+                parts.append(format(kwargs[field_name]))
+        return "".join(parts)
+
+
+# 已解析模板的缓存，PROMPT_TEMPLATES 中的模板被新增或替换时自动重新解析
+_TEMPLATE_REGISTRY: Dict[str, PromptTemplate] = {}
+
+def get_template(template_name: str) -> PromptTemplate:
+    """
+    通过模板名称获取预先解析的模板对象
+    
+    Args:
+        template_name: 模板名称
+        
+    Returns:
+        PromptTemplate 对象
+    """
+    text = get_prompt_template(template_name)
+    template = _TEMPLATE_REGISTRY.get(template_name)
+    if template is None or template.text is not text:
+        template = PromptTemplate(template_name, text)
+        _TEMPLATE_REGISTRY[template_name] = template
+    return template
+
+def validate_records(template_name: str, records: List[Dict[str, Any]]) -> List[List[str]]:
+    """
+    批量校验一组参数是否满足模板的占位符要求
+    
+    Args:
+        template_name: 模板名称
+        records: 参数字典列表
+        
+    Returns:
+        与 records 一一对应的缺失占位符列表，校验通过的记录对应空列表
+    """
+    template = get_template(template_name)
+    return [template.missing_fields(record) for record in records]
+
 def get_prompt_template(template_name: str) -> str:
     """
     通过模板名称获取提示词模板
@@ -106,8 +179,7 @@ def format_prompt(template_name: str, **kwargs) -> str:
     Returns:
         格式化后的提示词
     """
-    template = get_prompt_template(template_name)
-    return template.format(**kwargs)
+    return get_template(template_name).render(**kwargs)
 
 def get_available_templates() -> list:
     """
@@ -117,4 +189,3 @@ def get_available_templates() -> list:
         模板名称列表
     """
     return list(PROMPT_TEMPLATES.keys())
-
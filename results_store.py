@@ -0,0 +1,301 @@
+# results_store.py - 分析结果存储
+"""
+持久化每次分析的结果，连同股票代码、日期、分析风格、模型、提示词哈希和token用量一起保存，
+下游报表可以直接读取已保存的结果，无需重新发起付费的LLM分析。
+
+结果文本经 zlib 压缩后保存在SQLite中，按 (股票代码, 日期) 和日期建立索引，
+支持按股票和日期区间快速查询，以及批量导出为 JSON / JSON Lines / CSV。
+
+用法:
+    # 导出全部结果（默认写入 ANALYSIS_RESULTS_FILE）
+    python results_store.py export
+    # 导出指定股票和日期区间的结果
+    python results_store.py export --symbol AAPL MSFT --start 2024-06-01 --end 2024-06-30 --output data/june.jsonl
+    # 查看结果条数和token用量
+    python results_store.py stats
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from env_config import load_env
+
+# 导出和查询结果中的字段
+RESULT_FIELDS = [
+    "symbol", "date", "style", "model_name", "prompt_hash",
+    "prompt_tokens", "completion_tokens", "total_tokens", "cached", "created_at", "result"
+]
+
+
+def _compress(text: str) -> bytes:
+    return zlib.compress(text.encode('utf-8'), 6)
+
+
+def _decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode('utf-8')
+
+
+class ResultsStore:
+    """
+    基于SQLite的分析结果存储
+
+    同一股票、日期、分析风格、模型和提示词（按哈希判断）的结果只保留最新一次，
+    重复合并同一批结果（如分片批处理多次执行 merge）不会产生重复记录。
+    """
+
+    def __init__(self, db_file: Optional[str] = None):
+        """
+        Args:
+            db_file: 数据库路径，默认读取环境变量 ANALYSIS_RESULTS_DB
+        """
+        load_env()
+        self.db_file = db_file or os.getenv('ANALYSIS_RESULTS_DB', 'data/analysis_results.db')
+        directory = os.path.dirname(self.db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    symbol TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    style TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    prompt_hash TEXT NOT NULL,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    total_tokens INTEGER,
+                    cached INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    result BLOB NOT NULL,
+                    UNIQUE (symbol, date, style, model_name, prompt_hash)
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_symbol_date ON results (symbol, date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_date ON results (date)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def append_many(self, records: List[Dict[str, Any]]) -> int:
+        """
+        在一个事务内追加多条分析结果
+
+        Args:
+            records: 每条包含 symbol、date、style、model_name、prompt_hash、result，
+                可选 usage（含 prompt_tokens / completion_tokens / total_tokens 的字典）、cached 和 created_at
+
+        Returns:
+            写入的条数，已有更新版本的记录不计入
+        """
+        if not records:
+            return 0
+        now = time.time()
+        rows = []
+        for record in records:
+            usage = record.get("usage") or {}
+            rows.append((
+                record["symbol"],
+                record["date"],
+                record["style"],
+                record["model_name"],
+                record["prompt_hash"],
+                usage.get("prompt_tokens"),
+                usage.get("completion_tokens"),
+                usage.get("total_tokens"),
+                int(bool(record.get("cached"))),
+                record.get("created_at") or now,
+                _compress(record["result"])
+            ))
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                """INSERT INTO results (symbol, date, style, model_name, prompt_hash, prompt_tokens,
+                       completion_tokens, total_tokens, cached, created_at, result)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (symbol, date, style, model_name, prompt_hash) DO UPDATE SET
+                       prompt_tokens = excluded.prompt_tokens,
+                       completion_tokens = excluded.completion_tokens,
+                       total_tokens = excluded.total_tokens,
+                       cached = excluded.cached,
+                       created_at = excluded.created_at,
+                       result = excluded.result
+                   WHERE excluded.created_at > results.created_at""",
+                rows
+            )
+            return conn.total_changes - before
+
+    def iter_results(
+        self,
+        symbols: Optional[List[str]] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        style: Optional[str] = None,
+        model_name: Optional[str] = None,
+        latest_only: bool = False
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        按股票代码、日期升序逐条读取结果，条件均可省略；日期区间包含两端
+
+        latest_only 为 True 时同一股票、日期和分析风格只返回最新的一条（如不同模型或提示词的多次分析）
+        """
+        conditions, params = [], []
+        if symbols:
+            conditions.append(f"symbol IN ({','.join('?' * len(symbols))})")
+            params += list(symbols)
+        if start_date:
+            conditions.append("date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("date <= ?")
+            params.append(end_date)
+        if style:
+            conditions.append("style = ?")
+            params.append(style)
+        if model_name:
+            conditions.append("model_name = ?")
+            params.append(model_name)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        columns = ", ".join(RESULT_FIELDS)
+        if latest_only:
+            sql = f"""SELECT {columns} FROM (
+                          SELECT *, ROW_NUMBER() OVER (
+                              PARTITION BY symbol, date, style ORDER BY created_at DESC
+                          ) AS rn FROM results {where}
+                      ) WHERE rn = 1 ORDER BY symbol, date, style"""
+        else:
+            sql = f"SELECT {columns} FROM results {where} ORDER BY symbol, date, style, created_at"
+        with self._connect() as conn:
+            for row in conn.execute(sql, params):
+                record = dict(zip(RESULT_FIELDS, row))
+                record["cached"] = bool(record["cached"])
+                record["result"] = _decompress(record["result"])
+                yield record
+
+    def query(
+        self,
+        symbols: Optional[List[str]] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        style: Optional[str] = None,
+        model_name: Optional[str] = None,
+        latest_only: bool = False
+    ) -> List[Dict[str, Any]]:
+        """读取符合条件的全部结果，参数含义同 iter_results"""
+        return list(self.iter_results(symbols, start_date, end_date, style, model_name, latest_only))
+
+    def export(self, path: Optional[str] = None, **filters) -> int:
+        """
+        批量导出结果，按扩展名选择格式：.csv 为 CSV，.jsonl 为 JSON Lines，其余为 JSON 数组
+
+        Args:
+            path: 导出路径，默认读取环境变量 ANALYSIS_RESULTS_FILE
+            filters: 传给 iter_results 的查询条件
+
+        Returns:
+            导出的条数
+        """
+        load_env()
+        path = path or os.getenv('ANALYSIS_RESULTS_FILE', 'data/analysis_results.json')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        count = 0
+        # 逐条写出，导出大量结果时不必全部载入内存
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            if path.endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+                writer.writeheader()
+                for record in self.iter_results(**filters):
+                    writer.writerow(record)
+                    count += 1
+            elif path.endswith('.jsonl'):
+                for record in self.iter_results(**filters):
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    count += 1
+            else:
+                f.write("[")
+                for record in self.iter_results(**filters):
+                    f.write(("," if count else "") + "\n" + json.dumps(record, ensure_ascii=False))
+                    count += 1
+                f.write("\n]\n")
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        """返回结果条数、股票数、日期范围和累计token用量"""
+        with self._connect() as conn:
+            count, symbols, first, last, prompt_tokens, completion_tokens, total_tokens = conn.execute(
+                """SELECT COUNT(*), COUNT(DISTINCT symbol), MIN(date), MAX(date),
+                          SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens) FROM results"""
+            ).fetchone()
+        return {
+            "results": count,
+            "symbols": symbols,
+            "first_date": first,
+            "last_date": last,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "total_tokens": total_tokens or 0,
+        }
+
+
+_default_store: Optional[ResultsStore] = None
+
+
+def get_results_store() -> ResultsStore:
+    """获取进程内共享的默认分析结果存储"""
+    global _default_store
+    if _default_store is None:
+        _default_store = ResultsStore()
+    return _default_store
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    load_env()
+    parser = argparse.ArgumentParser(description="分析结果存储")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="批量导出分析结果")
+    export_parser.add_argument("--symbol", nargs="+", help="只导出指定的股票")
+    export_parser.add_argument("--start", help="开始日期（YYYY-MM-DD，含）")
+    export_parser.add_argument("--end", help="结束日期（YYYY-MM-DD，含）")
+    export_parser.add_argument("--style", help="只导出指定的分析风格")
+    export_parser.add_argument("--model", help="只导出指定模型的结果")
+    export_parser.add_argument("--latest", action="store_true", help="同一股票、日期和分析风格只导出最新一条")
+    export_parser.add_argument("--output", help="导出路径（.json / .jsonl / .csv），默认读取 ANALYSIS_RESULTS_FILE")
+
+    subparsers.add_parser("stats", help="查看结果条数和token用量")
+
+    args = parser.parse_args(argv)
+    store = get_results_store()
+    if args.command == "stats":
+        for key, value in store.stats().items():
+            print(f"{key}: {value}")
+        return
+    count = store.export(
+        args.output,
+        symbols=args.symbol,
+        start_date=args.start,
+        end_date=args.end,
+        style=args.style,
+        model_name=args.model,
+        latest_only=args.latest
+    )
+    print(f"已导出 {count} 条分析结果")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,217 @@
+# service.py - 本地HTTP分析服务
+"""
+基于 asyncio 的轻量HTTP服务，在一个事件循环中通过异步工作流处理分析请求，不为每个请求占用线程。
+相同 (股票代码, 日期, 分析风格, 模型, 提示词参数) 的并发请求合并为一次进行中的分析，所有等待者共享同一个结果。
+
+接口:
+    POST /analyze  {"symbol": "AAPL", "style": "network_effect", "date": "2024-06-03",
+                    "model": "gpt-4o-mini", "params": {"news_summary": "..."}}
+                   除 symbol 外均可省略，date 省略时分析当天信息
+    GET  /stats    请求数、实际分析次数、合并的请求数和进行中的分析数
+    GET  /health
+
+用法:
+    python service.py --host 127.0.0.1 --port 8080 --model gpt-4o-mini
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# 请求体大小上限（字节）
+MAX_BODY_SIZE = 1024 * 1024
+
+HTTP_STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class SingleFlight:
+    """
+    合并相同键的并发调用：同一个键同时只执行一次，其余调用等待并共享其结果或异常
+
+    调用完成后键即被移除，之后的调用会重新执行。单个等待者被取消（如客户端断开）不会取消共享的执行。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Returns:
+            (结果, 是否共享了其他请求发起的执行)
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future), True
+        self.calls += 1
+        future = asyncio.ensure_future(fn())
+        self._calls[key] = future
+
+        def forget(done: asyncio.Future) -> None:
+            if self._calls.get(key) is done:
+                del self._calls[key]
+
+        future.add_done_callback(forget)
+        return await asyncio.shield(future), False
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+class AnalysisService:
+    """处理分析请求，相同 (股票代码, 日期, 分析风格, 模型, 提示词参数) 的并发请求只分析一次"""
+
+    def __init__(self, session=None, default_model: str = "gpt-4o-mini"):
+        """
+        Args:
+            session: 分析会话，默认新建
+            default_model: 请求中未指定模型时使用的模型
+        """
+        if session is None:
+            from news_agent import AnalyzerSession
+
+            session = AnalyzerSession()
+        self.session = session
+        self.default_model = default_model
+        self.flight = SingleFlight()
+        self.requests = 0
+
+    async def analyze(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """分析单只股票，返回结果字典，coalesced 表示是否与其他进行中的请求合并"""
+        symbol = (request.get("symbol") or "").strip()
+        if not symbol:
+            raise ValueError("缺少 symbol")
+        style = request.get("style") or "network_effect"
+        model = request.get("model") or self.default_model
+        date = request.get("date")
+        params = request.get("params")
+        if params is not None and not isinstance(params, dict):
+            raise ValueError("params 必须是对象")
+        self.requests += 1
+        # 提示词参数（如新闻摘要）不同的请求分析结果不同，参数规范化后计入合并键
+        key = (
+            symbol,
+            date or datetime.now().strftime('%Y-%m-%d'),
+            style,
+            model,
+            json.dumps(params, ensure_ascii=False, sort_keys=True, default=str)
+        )
+        result, shared = await self.flight.do(key, lambda: self._run(symbol, date, style, model, params))
+        return dict(result, coalesced=shared)
+
+    async def _run(
+        self,
+        symbol: str,
+        date: Optional[str],
+        style: str,
+        model: str,
+        params: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        state = await self.session.arun(model, [symbol], [style], prompt_params_list=[params], date=date)
+        return {
+            "symbol": symbol,
+            "date": date,
+            "style": style,
+            "model": model,
+            "analysis_result": state.analysis_results[0],
+            "history_result": state.history_results[0],
+            "analysis_error": state.analysis_errors[0],
+            "history_error": state.history_errors[0],
+        }
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "analyses": self.flight.calls,
+            "coalesced": self.flight.shared,
+            "in_flight": self.flight.in_flight(),
+        }
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        """按请求方法和路径分发，返回 (状态码, 响应内容)"""
+        path = path.split("?", 1)[0]
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            return 200, self.stats()
+        if method == "POST" and path == "/analyze":
+            try:
+                request = json.loads(body or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("请求体必须是JSON对象")
+                return 200, await self.analyze(request)
+            except ValueError as e:
+                return 400, {"error": str(e)}
+        return 404, {"error": f"未知的接口: {method} {path}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """处理一个HTTP连接，每个连接只处理一个请求"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0].upper(), request_line[1]
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode('latin-1').partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_BODY_SIZE:
+                status, payload = 413, {"error": "请求体过大"}
+            else:
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as e:
+                    print(f"处理请求失败: {e}")
+                    status, payload = 500, {"error": str(e)}
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + data
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            print(f"连接异常: {e}")
+        finally:
+            writer.close()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8080, default_model: str = "gpt-4o-mini") -> None:
+    """启动服务并一直运行"""
+    service = AnalysisService(default_model=default_model)
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"分析服务已启动: http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.session.aclose()
+
+
+def main(argv: Optional[list] = None) -> None:
+    from env_config import load_env
+
+    load_env()
+    parser = argparse.ArgumentParser(description="本地HTTP分析服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8080, help="监听端口")
+    parser.add_argument("--model", default="gpt-4o-mini", help="请求中未指定模型时使用的模型")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.model))
+    except KeyboardInterrupt:
+        print("分析服务已停止")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
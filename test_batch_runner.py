@@ -0,0 +1,74 @@
+# test_batch_runner.py - 分片批处理与合并
+import json
+
+import pytest
+
+from batch_runner import load_universe, merge_shards, run_batch, shard_of
+from history_store import get_history_store
+from results_store import get_results_store
+
+SYMBOLS = [f"S{i}" for i in range(8)]
+
+
+@pytest.fixture
+def universe(tmp_path):
+    path = tmp_path / "universe.csv"
+    news = "发布季度财报，平台月活跃用户同比增长百分之十二，开发者生态持续扩大，管理层上调全年指引。"
+    lines = ["symbol,style,sector,news_summary"] + [
+        f"{symbol},network_effect,{'tech' if i % 2 else ''},{symbol}{news}" for i, symbol in enumerate(SYMBOLS)
+    ]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return load_universe(str(path))
+
+
+def test_load_universe_reads_styles_and_extra_params(tmp_path, universe):
+    assert universe[0]["style"] == "network_effect"
+    assert set(universe[0]["params"]) == {"news_summary"}
+    assert universe[1]["params"]["sector"] == "tech"
+    path = tmp_path / "universe.jsonl"
+    path.write_text(json.dumps({"symbol": "AAPL", "params": {"news_summary": "新闻"}}) + "\n\n", encoding="utf-8")
+    assert load_universe(str(path)) == [{"symbol": "AAPL", "style": "network_effect", "params": {"news_summary": "新闻"}}]
+
+
+def test_shard_assignment_is_deterministic():
+    assert [shard_of(symbol, 4) for symbol in SYMBOLS] == [shard_of(symbol, 4) for symbol in SYMBOLS]
+    assert all(0 <= shard_of(symbol, 4) < 4 for symbol in SYMBOLS)
+
+
+def _shard_records(output_dir):
+    records = []
+    for path in sorted(output_dir.glob("shard-*.jsonl")):
+        records += [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    return records
+
+
+def test_shards_cover_universe_and_merge_once(isolated_env, universe):
+    output_dir = isolated_env / "batch"
+    summaries = run_batch(universe, 3, "gpt-4o-mini", str(output_dir), chunk_size=3)
+    assert sum(summary["symbols"] for summary in summaries) == len(SYMBOLS)
+    assert sorted(record["symbol"] for record in _shard_records(output_dir)) == SYMBOLS
+    # 分片运行期间不写入历史存储，合并后写入一次，重复合并不会重复写入
+    assert get_history_store().get_many(SYMBOLS) == {}
+    assert merge_shards(str(output_dir)) == len(SYMBOLS)
+    assert merge_shards(str(output_dir)) == 0
+    assert len(get_history_store().get_many(SYMBOLS)) == len(SYMBOLS)
+    assert get_results_store().stats()["results"] == len(SYMBOLS)
+
+
+def test_merge_persists_fingerprints_and_news_signatures(isolated_env, universe, fake_llm, monkeypatch):
+    monkeypatch.setenv("NEWS_DEDUP_MODE", "flag")
+    output_dir = isolated_env / "batch"
+    run_batch(universe, 2, "gpt-4o-mini", str(output_dir), incremental=True)
+    records = _shard_records(output_dir)
+    assert all(record["input_fingerprint"] and record["news_signature"] for record in records)
+    merge_shards(str(output_dir))
+    store = get_history_store()
+    assert set(store.get_fingerprints(SYMBOLS)) == set(SYMBOLS)
+    assert set(store.get_news_signatures(SYMBOLS, "0000-00-00", "9999-12-31")) == set(SYMBOLS)
+    # 合并后再次以增量模式运行，全部股票复用结果，不调用LLM，复用的结果不会再次合并
+    before = fake_llm.requests
+    run_batch(universe, 2, "gpt-4o-mini", str(output_dir), incremental=True)
+    assert fake_llm.requests == before
+    assert all(record["reused"] for record in _shard_records(output_dir))
+    assert merge_shards(str(output_dir)) == 0
+    assert get_results_store().stats()["results"] == len(SYMBOLS)
@@ -0,0 +1,76 @@
+# test_benchmark.py - 本地模拟的LLM服务和行情源
+import json
+
+import openai
+import pytest
+
+from benchmark import FakeLLMServer, FakeYFinance, main, measure_import_time
+
+
+def _client(server):
+    return openai.OpenAI(api_key="sk-test", base_url=server.base_url, max_retries=0)
+
+
+def _messages(prompt):
+    return [{"role": "user", "content": prompt}]
+
+
+def test_fake_llm_answers_and_counts_requests(fake_llm):
+    before = fake_llm.requests
+    response = _client(fake_llm).chat.completions.create(model="gpt-4o-mini", messages=_messages("分析AAPL"))
+    assert response.choices[0].message.content.startswith("模拟分析结果")
+    assert response.usage.completion_tokens == 80
+    assert fake_llm.requests == before + 1
+
+
+def test_fake_llm_splits_packed_replies_by_label(fake_llm):
+    response = _client(fake_llm).chat.completions.create(
+        model="gpt-4o-mini",
+        messages=_messages("### AAPL\n提示词一\n\n### MSFT\n提示词二"),
+        response_format={"type": "json_object"}
+    )
+    assert list(json.loads(response.choices[0].message.content)) == ["AAPL", "MSFT"]
+
+
+def test_fake_llm_injects_server_errors():
+    server = FakeLLMServer(latency=0.0, jitter=0.0, error_rate=1.0).start()
+    try:
+        with pytest.raises(openai.InternalServerError):
+            _client(server).chat.completions.create(model="gpt-4o-mini", messages=_messages("分析AAPL"))
+    finally:
+        server.stop()
+
+
+def test_fake_yfinance_download_and_ticker():
+    yf = FakeYFinance(latency=0.0)
+    frame = yf.download(["AAPL", "MSFT"], start="2024-06-03", end="2024-06-06")
+    assert len(frame) == 3
+    assert frame["AAPL"]["Close"].tolist() == [100.5] * 3
+    assert yf.Ticker("AAPL").info["news_summary"].startswith("AAPL")
+    failing = FakeYFinance(latency=0.0, error_rate=1.0)
+    assert failing.download("AAPL", start="2024-06-03")["AAPL"]["Close"].isna().all()
+    with pytest.raises(RuntimeError):
+        failing.Ticker("AAPL").info
+
+
+def test_fake_llm_streams_sse_chunks(fake_llm):
+    stream = _client(fake_llm).chat.completions.create(
+        model="gpt-4o-mini", messages=_messages("分析AAPL"), stream=True, stream_options={"include_usage": True}
+    )
+    chunks = list(stream)
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices)
+    assert text.startswith("模拟分析结果") and len(text) == 80
+    assert chunks[-1].usage.completion_tokens == 80
+
+
+def test_import_stays_within_budget():
+    # 导入时不加载行情、工作流和LLM客户端等重量级依赖，预算比 README 中的 0.5s 宽松，避免机器较慢时误报
+    result = measure_import_time("news_agent", runs=1)
+    assert result["heavy_modules"] == []
+    assert result["median"] < 1.0
+
+
+def test_import_budget_failure_exits_nonzero():
+    with pytest.raises(SystemExit) as exc:
+        main(["--import-time", "--import-runs", "1", "--import-budget", "0"])
+    assert exc.value.code == 1
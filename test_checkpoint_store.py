@@ -0,0 +1,68 @@
+# test_checkpoint_store.py - 检查点与断点恢复
+import pytest
+
+from checkpoint_store import CheckpointStore, get_checkpoint_store, new_run_id
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CheckpointStore(str(tmp_path / "checkpoints.db"))
+
+
+def test_start_reports_resumed_runs(store):
+    run_id = new_run_id()
+    assert store.start(run_id) is False
+    assert store.start(run_id) is True
+
+
+def test_results_follow_stock_list_order(store):
+    run_id = new_run_id()
+    store.start(run_id)
+    store.put(run_id, "analysis", 0, "AAPL", "苹果")
+    store.put(run_id, "analysis", 1, "MSFT", "微软")
+    store.put(run_id, "history", 1, "MSFT", "微软历史")
+    assert store.get_results(run_id, "analysis", ["AAPL", "MSFT", "GOOG"]) == ["苹果", "微软", None]
+    assert store.get_results(run_id, "history", ["AAPL", "MSFT"]) == [None, "微软历史"]
+    # 股票列表变化后，序号对应的股票代码不一致的结果不会被复用
+    assert store.get_results(run_id, "analysis", ["MSFT", "AAPL"]) == [None, None]
+
+
+def test_finish_and_delete(store):
+    run_id = new_run_id()
+    store.start(run_id)
+    store.put(run_id, "analysis", 0, "AAPL", "苹果")
+    store.finish(run_id)
+    [(listed, _, finished_at, count)] = store.list_runs()
+    assert listed == run_id and finished_at is not None and count == 1
+    store.delete(run_id)
+    assert store.list_runs() == []
+
+
+def test_run_resumes_from_checkpoint(isolated_env, fake_llm):
+    from news_agent import AnalyzerSession
+
+    symbols = ["AAPL", "MSFT", "GOOG"]
+    today_info = [
+        {"symbol": symbol, "close": 100.0, "news_summary": f"{symbol} 发布季度财报，用户规模持续增长。"}
+        for symbol in symbols
+    ]
+    run_id = new_run_id()
+    # 模拟上一次运行在第一只股票完成后中断
+    checkpoints = get_checkpoint_store()
+    checkpoints.start(run_id)
+    checkpoints.put(run_id, "analysis", 0, "AAPL", "已完成的分析")
+    checkpoints.put(run_id, "history", 0, "AAPL", "已完成的历史总结")
+
+    before = fake_llm.requests
+    with AnalyzerSession() as session:
+        state = session.run(
+            "gpt-4o-mini", symbols, ["network_effect"] * 3,
+            today_info_list=today_info, date="2024-06-03", run_id=run_id
+        )
+    assert fake_llm.requests - before == 4
+    assert state.analysis_results[0] == "已完成的分析"
+    assert state.history_results[0] == "已完成的历史总结"
+    assert all(result.startswith("模拟分析结果") for result in state.analysis_results[1:])
+    assert checkpoints.get_results(run_id, "analysis", symbols)[1:] == state.analysis_results[1:]
+    [(_, _, finished_at, _)] = checkpoints.list_runs()
+    assert finished_at is not None
@@ -0,0 +1,82 @@
+# test_history_store.py - 按日期保留版本的历史存储
+import json
+
+import pytest
+
+from history_store import LEGACY_HISTORY_DATE, HistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / "history.db"))
+
+
+def test_put_keeps_one_version_per_date(store):
+    store.put_many([("AAPL", "第一天"), ("MSFT", "微软第一天")], "2024-06-03")
+    store.put_many([("AAPL", "第二天")], "2024-06-04")
+    store.put("AAPL", "第二天重跑", "2024-06-04")
+    assert [version["content"] for version in store.get_versions("AAPL")] == ["第一天", "第二天重跑"]
+    assert store.get("AAPL") == "第二天重跑"
+    assert store.get("AAPL", as_of="2024-06-03") == "第一天"
+    assert store.get("AAPL", as_of="2024-06-01") is None
+    assert store.get_many(["AAPL", "MSFT", "GOOG"], as_of="2024-06-03") == {"AAPL": "第一天", "MSFT": "微软第一天"}
+
+
+def test_migrate_json_imports_legacy_history_for_any_date(store, tmp_path):
+    legacy = tmp_path / "stock_history.json"
+    legacy.write_text(json.dumps({"AAPL": "旧历史", "MSFT": None, "GOOG": {"note": "结构化"}}, ensure_ascii=False))
+    store.put("GOOG", "已有版本", LEGACY_HISTORY_DATE)
+    # 跳过空值，不覆盖已有的同日版本，返回实际导入的条数
+    assert store.migrate_json(str(legacy)) == 1
+    assert store.migrate_json(str(legacy)) == 0
+    # 按早于导入当天的日期运行仍能读到旧版历史
+    assert store.get("AAPL", as_of="2020-01-01") == "旧历史"
+    assert store.get("GOOG") == "已有版本"
+    assert store.get("MSFT") is None
+    store.put("AAPL", "新历史", "2024-06-03")
+    assert store.get("AAPL") == "新历史"
+    assert store.get("AAPL", as_of="2024-06-02") == "旧历史"
+
+
+def test_merge_keeps_newest_version(store):
+    assert store.merge_many([("AAPL", "2024-06-03", "新", 200.0)]) == 1
+    # 较旧的结果不会覆盖较新的版本，重复合并不会重复写入
+    assert store.merge_many([("AAPL", "2024-06-03", "旧", 100.0)]) == 0
+    assert store.merge_many([("AAPL", "2024-06-03", "新", 200.0)]) == 0
+    assert store.merge_many([("AAPL", "2024-06-03", "更新", 300.0), ("AAPL", "2024-06-04", "次日", 50.0)]) == 2
+    assert [(v["date"], v["content"]) for v in store.get_versions("AAPL")] == [
+        ("2024-06-03", "更新"), ("2024-06-04", "次日")
+    ]
+
+
+def _metrics(growth):
+    return {"user_growth": growth, "strength": 2, "evidence": f"增长{growth}"}
+
+
+def test_merge_all_writes_history_and_metrics_together(store):
+    written = store.merge_all(
+        [("AAPL", "2024-06-03", "历史", 100.0)],
+        [("AAPL", "2024-06-03", _metrics(5.0), 100.0), ("AAPL", "2024-06-04", _metrics(6.0), 100.0)]
+    )
+    assert written == (1, 2)
+    assert store.get("AAPL") == "历史"
+    assert [point["user_growth"] for point in store.get_metric_series(["AAPL"])["AAPL"]] == [5.0, 6.0]
+    assert store.merge_all([], []) == (0, 0)
+
+
+def test_merge_all_rolls_back_on_error(store):
+    with pytest.raises(Exception):
+        store.merge_all(
+            [("AAPL", "2024-06-03", "历史", 100.0)],
+            [("AAPL", "2024-06-03", {"user_growth": object()}, 100.0)]
+        )
+    assert store.get("AAPL") is None
+
+
+def test_metric_series_returns_latest_points_in_date_order(store):
+    for day in range(1, 6):
+        store.put_metrics([("AAPL", _metrics(float(day)))], f"2024-06-0{day}")
+    series = store.get_metric_series(["AAPL", "MSFT"], as_of="2024-06-04", limit=2)
+    assert list(series) == ["AAPL"]
+    assert [point["date"] for point in series["AAPL"]] == ["2024-06-03", "2024-06-04"]
+    assert store.get_metric_series(["AAPL"], limit=0) == {}
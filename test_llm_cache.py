@@ -0,0 +1,53 @@
+# test_llm_cache.py - LLM回复缓存与回放
+import pytest
+
+from llm_cache import CacheMissError, LLMResponseCache, get_cache_mode
+from llm_call import AgentCall
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMResponseCache(str(tmp_path / "llm_cache.db"), max_bytes=30)
+
+
+def test_key_covers_every_request_field():
+    key = LLMResponseCache.make_key("gpt-4o-mini", "系统", "提示词", 0.3, 1000)
+    assert key == LLMResponseCache.make_key("gpt-4o-mini", "系统", "提示词", 0.3, 1000)
+    assert key != LLMResponseCache.make_key("gpt-4o", "系统", "提示词", 0.3, 1000)
+    assert key != LLMResponseCache.make_key("gpt-4o-mini", "系统2", "提示词", 0.3, 1000)
+    assert key != LLMResponseCache.make_key("gpt-4o-mini", "系统", "提示词", 0.3, 2000)
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    cache.put("a", "a" * 10)
+    cache.put("b", "b" * 10)
+    cache.put("c", "c" * 10)
+    # 读取 a 刷新访问时间，超出容量时淘汰最久未访问的 b
+    assert cache.get("a") == "a" * 10
+    cache.put("d", "d" * 10)
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["a" * 10, "c" * 10, "d" * 10]
+    assert cache.stats()["bytes"] == 30
+    assert cache.stats()["hits"] == 4 and cache.stats()["misses"] == 1
+
+
+def test_replay_serves_recorded_responses_without_network(isolated_env, fake_llm, cache):
+    cache.max_bytes = 10 ** 6
+    prompts = ["分析AAPL", "分析MSFT"]
+    recorded = AgentCall("gpt-4o-mini", cache_mode="readwrite", cache=cache).infomation_prompts_analysis(prompts)
+    before = fake_llm.requests
+    replay = AgentCall("gpt-4o-mini", cache_mode="replay", cache=cache)
+    assert replay.client is None
+    assert replay.infomation_prompts_analysis(prompts) == recorded
+    assert fake_llm.requests == before
+    # 回放模式下未录制的提示词直接中止，而不是返回错误文本
+    with pytest.raises(CacheMissError):
+        replay.infomation_prompts_analysis(["分析GOOG"])
+
+
+def test_cache_mode_from_env(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_MODE", "Replay")
+    assert get_cache_mode() == "replay"
+    monkeypatch.setenv("LLM_CACHE_MODE", "sometimes")
+    with pytest.raises(ValueError):
+        get_cache_mode()
@@ -0,0 +1,421 @@
+# test_llm_call.py - LLM调用
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from benchmark import FakeLLMServer
+from llm_cache import LLMResponseCache
+from llm_call import (
+    HEDGE_MIN_SAMPLES, PACK_INSTRUCTION, AgentCall, ConcurrencyLimiter, RateLimiter, StreamInterruptedError,
+    _estimate_tokens, get_concurrency_limiter
+)
+
+
+def test_rate_limiter_limits_requests_per_window():
+    limiter = RateLimiter(rpm=2, tpm=10 ** 6, window=60.0)
+    assert limiter._reserve(10) == 0.0
+    assert limiter._reserve(10) == 0.0
+    # 第三个请求需要等待窗口内最早的请求过期
+    assert limiter._reserve(10) > 59.0
+
+
+def test_rate_limiter_limits_tokens_per_window():
+    limiter = RateLimiter(rpm=100, tpm=100, window=60.0)
+    assert limiter._reserve(60) == 0.0
+    assert limiter._reserve(60) > 0.0
+    assert limiter._reserve(40) == 0.0
+
+
+def test_rate_limiter_admits_oversized_request_when_window_empty():
+    limiter = RateLimiter(rpm=10, tpm=100, window=60.0)
+    assert limiter._reserve(1000) == 0.0
+
+
+def test_rate_limiter_frees_budget_after_window():
+    limiter = RateLimiter(rpm=1, tpm=10 ** 6, window=0.05)
+    limiter.acquire(1)
+    start = time.monotonic()
+    limiter.acquire(1)
+    assert time.monotonic() - start >= 0.03
+
+
+def _tracker():
+    state = {"active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def enter():
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+
+    def leave():
+        with lock:
+            state["active"] -= 1
+
+    return state, enter, leave
+
+
+def test_concurrency_limiter_caps_threads_and_coroutines():
+    limiter = ConcurrencyLimiter(3)
+    state, enter, leave = _tracker()
+
+    def work():
+        limiter.acquire()
+        try:
+            enter()
+            time.sleep(0.01)
+            leave()
+        finally:
+            limiter.release()
+
+    async def awork():
+        await limiter.acquire_async()
+        try:
+            enter()
+            await asyncio.sleep(0.01)
+            leave()
+        finally:
+            limiter.release()
+
+    async def amain():
+        await asyncio.gather(*[awork() for _ in range(10)])
+
+    threads = [threading.Thread(target=work) for _ in range(10)]
+    threads += [threading.Thread(target=lambda: asyncio.run(amain())) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state["peak"] == 3
+    assert limiter._active == 0
+    assert not limiter._waiters
+
+
+def test_concurrency_limiter_cancelled_waiter_does_not_leak_slot():
+    limiter = ConcurrencyLimiter(1)
+
+    async def main():
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release()
+        await asyncio.wait_for(limiter.acquire_async(), timeout=1)
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter._active == 0
+
+
+def test_concurrency_limiter_raising_limit_wakes_waiters():
+    limiter = ConcurrencyLimiter(1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def wait():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    assert not acquired.wait(0.05)
+    limiter.set_limit(2)
+    assert acquired.wait(1)
+    thread.join()
+
+
+def test_concurrency_limiter_is_shared_per_provider(isolated_env, monkeypatch):
+    monkeypatch.setenv("GPT_MAX_CONCURRENCY", "5")
+    assert get_concurrency_limiter("gpt") is get_concurrency_limiter("gpt")
+    assert get_concurrency_limiter("gpt") is not get_concurrency_limiter("deepseek")
+    assert get_concurrency_limiter("gpt").limit == 5
+
+
+def test_instance_max_concurrency_does_not_change_shared_cap(isolated_env, monkeypatch):
+    monkeypatch.setenv("GPT_MAX_CONCURRENCY", "3")
+    state, enter, leave = _tracker()
+    attempt = AgentCall._attempt
+
+    def tracked(self, request, on_token=None):
+        enter()
+        try:
+            return attempt(self, request, on_token)
+        finally:
+            leave()
+
+    monkeypatch.setattr(AgentCall, "_attempt", tracked)
+    serial = AgentCall("gpt-4o-mini", max_concurrency=1)
+    wide = AgentCall("gpt-4o", max_concurrency=10)
+    assert serial.concurrency_limiter is wide.concurrency_limiter
+    assert wide.concurrency_limiter.limit == 3
+    assert all(serial.infomation_prompts_analysis([f"提示词 {i}" for i in range(4)]))
+    assert state["peak"] == 1
+    # 实例的线程池比共享上限大时，同时发出的请求数仍不超过共享上限
+    assert all(wide.infomation_prompts_analysis([f"提示词 {i}" for i in range(8)]))
+    assert state["peak"] == 3
+
+
+def test_agent_calls_share_provider_concurrency_cap(isolated_env, monkeypatch):
+    monkeypatch.setenv("GPT_MAX_CONCURRENCY", "2")
+    state, enter, leave = _tracker()
+    attempt = AgentCall._attempt
+
+    def tracked(self, request, on_token=None):
+        enter()
+        try:
+            return attempt(self, request, on_token)
+        finally:
+            leave()
+
+    monkeypatch.setattr(AgentCall, "_attempt", tracked)
+    # 每个调用各自最多开 2 个线程，两个调用同时进行时总并发仍不超过服务商上限
+    agents = [AgentCall("gpt-4o-mini"), AgentCall("gpt-4o")]
+    results = {}
+
+    def run(agent):
+        results[agent.model_name] = agent.infomation_prompts_analysis([f"提示词 {i}" for i in range(6)])
+
+    threads = [threading.Thread(target=run, args=(agent,)) for agent in agents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state["peak"] == 2
+    assert all(len(texts) == 6 and all(texts) for texts in results.values())
+
+
+def test_async_agent_call_respects_concurrency_cap(isolated_env, monkeypatch):
+    monkeypatch.setenv("GPT_MAX_CONCURRENCY", "2")
+    agent = AgentCall("gpt-4o-mini")
+    limiter = agent.concurrency_limiter
+    peaks = []
+    acquire = limiter.acquire_async
+
+    async def tracked():
+        await acquire()
+        peaks.append(limiter._active)
+
+    monkeypatch.setattr(limiter, "acquire_async", tracked)
+
+    async def main():
+        texts = await agent.ainfomation_prompts_analysis([f"提示词 {i}" for i in range(6)])
+        await agent.aclose()
+        return texts
+
+    texts = asyncio.run(main())
+    assert len(texts) == 6 and all(texts)
+    assert peaks and max(peaks) <= 2
+
+
+def _packing_agent(budget, **kwargs):
+    agent = AgentCall("gpt-4o-mini", pack_token_budget=budget, **kwargs)
+    agent.max_tokens = 100
+    return agent
+
+
+def test_plan_packs_respects_token_budget(isolated_env):
+    agent = _packing_agent(_estimate_tokens(PACK_INSTRUCTION) + 320)
+    pending = [(i, "提" * 50) for i in range(5)]
+    # 每只股票占用 50 + 100 个token，除去打包说明后的预算每组最多容纳两只
+    packs = agent._plan_packs(pending)
+    assert [[i for i, _ in pack] for pack in packs] == [[0, 1], [2, 3], [4]]
+    # 单只就超出预算的提示词单独成组，不会被丢弃
+    assert agent._plan_packs([(0, "提" * 1000)]) == [[(0, "提" * 1000)]]
+
+
+def test_packed_reply_is_split_per_symbol(isolated_env, fake_llm):
+    agent = _packing_agent(10 ** 6)
+    labels = ["AAPL", "MSFT", "GOOG"]
+    before = fake_llm.requests
+    seen = []
+    results = agent.infomation_prompts_analysis(
+        [f"分析{label}" for label in labels], labels=labels, on_result=lambda i, text: seen.append(i)
+    )
+    assert fake_llm.requests - before == 1
+    assert all(result.startswith("模拟分析结果") for result in results)
+    assert sorted(seen) == [0, 1, 2]
+
+
+def test_missing_symbols_are_retried_one_by_one(isolated_env, fake_llm, monkeypatch):
+    complete = AgentCall._complete
+    single = []
+
+    def drop_msft(self, system_prompt, prompt, on_token=None, max_tokens=None, json_mode=False):
+        text, meta = complete(self, system_prompt, prompt, on_token, max_tokens, json_mode)
+        if json_mode:
+            replies = json.loads(text)
+            replies.pop("MSFT")
+            text = json.dumps(replies, ensure_ascii=False)
+        else:
+            single.append(prompt)
+        return text, meta
+
+    monkeypatch.setattr(AgentCall, "_complete", drop_msft)
+    agent = _packing_agent(10 ** 6)
+    results = agent.infomation_prompts_analysis(["分析AAPL", "分析MSFT", None], labels=["AAPL", "MSFT", "GOOG"])
+    # 打包回复中缺失的 MSFT 以原始提示词单独请求，None 提示词不请求
+    assert single == ["分析MSFT"]
+    assert results[0].startswith("模拟分析结果") and results[1].startswith("模拟分析结果")
+    assert results[2] is None
+
+
+def test_packed_results_do_not_answer_single_prompts(isolated_env, fake_llm, tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.db"))
+    packed = _packing_agent(10 ** 6, cache_mode="readwrite", cache=cache)
+    prompts, labels = ["分析AAPL", "分析MSFT"], ["AAPL", "MSFT"]
+    first = packed.infomation_prompts_analysis(prompts, labels=labels)
+    before = fake_llm.requests
+    # 再次打包请求命中打包结果的缓存
+    assert packed.infomation_prompts_analysis(prompts, labels=labels) == first
+    assert fake_llm.requests == before
+    # 单条请求不会读到打包拆分出的结果
+    single = AgentCall("gpt-4o-mini", cache_mode="readwrite", cache=cache)
+    single.max_tokens = 100
+    single.infomation_prompts_analysis(prompts)
+    assert fake_llm.requests - before == 2
+
+
+def _server_error():
+    request = httpx.Request("POST", "http://127.0.0.1/v1/chat/completions")
+    return openai.InternalServerError("模拟服务端错误", response=httpx.Response(500, request=request), body=None)
+
+
+@pytest.fixture
+def resilience_env(isolated_env, monkeypatch):
+    for key, value in {"LLM_BACKOFF_BASE": "0.01", "LLM_BACKOFF_MAX": "0.02", "LLM_MAX_RETRIES": "2"}.items():
+        monkeypatch.setenv(key, value)
+    return isolated_env
+
+
+def test_retryable_errors_are_retried(resilience_env, monkeypatch):
+    calls = []
+    attempt = AgentCall._attempt
+
+    def flaky(self, request, on_token=None):
+        calls.append(request["model"])
+        if len(calls) <= 2:
+            raise _server_error()
+        return attempt(self, request, on_token)
+
+    monkeypatch.setattr(AgentCall, "_attempt", flaky)
+    text, meta = AgentCall("gpt-4o-mini")._complete("系统", "分析AAPL")
+    assert text.startswith("模拟分析结果") and meta["retries"] == 2
+    # 参数错误等不可重试的错误直接抛出
+    calls.clear()
+    monkeypatch.setattr(AgentCall, "_attempt", lambda self, request, on_token=None: calls.append(1) or 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        AgentCall("gpt-4o-mini")._complete("系统", "分析AAPL")
+    assert len(calls) == 1
+
+
+def test_breaker_opens_after_consecutive_failures(resilience_env, monkeypatch):
+    monkeypatch.setenv("LLM_MAX_RETRIES", "0")
+    monkeypatch.setenv("LLM_BREAKER_THRESHOLD", "2")
+    calls = []
+
+    def failing(self, request, on_token=None):
+        calls.append(1)
+        raise _server_error()
+
+    monkeypatch.setattr(AgentCall, "_attempt", failing)
+    agent = AgentCall("gpt-4o-mini")
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            agent._complete("系统", "分析AAPL")
+    # 熔断后同一服务商的其他实例也不再发出请求
+    with pytest.raises(RuntimeError, match="熔断"):
+        AgentCall("gpt-4o")._complete("系统", "分析AAPL")
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def failing_primary(resilience_env, fake_llm, monkeypatch):
+    """主服务商总是返回服务端错误，备用模型 local-model 指向正常的本地服务"""
+    server = FakeLLMServer(latency=0.0, jitter=0.0, error_rate=1.0).start()
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setenv("LLM_MAX_RETRIES", "0")
+    monkeypatch.setenv("LLM_PROVIDERS", "local")
+    monkeypatch.setenv("LOCAL_BASE_URL", fake_llm.base_url)
+    monkeypatch.setenv("LOCAL_MODELS", "local-model")
+    yield server
+    server.stop()
+
+
+def test_failover_to_fallback_model(failing_primary, fake_llm):
+    before = fake_llm.requests
+    text, meta = AgentCall("gpt-4o-mini", fallback_model="local-model")._complete("系统", "分析AAPL")
+    assert text.startswith("模拟分析结果") and meta["failover"] == "local-model"
+    assert failing_primary.requests == 1 and fake_llm.requests - before == 1
+
+
+def test_interrupted_stream_is_not_retried_or_failed_over(failing_primary, fake_llm, monkeypatch):
+    monkeypatch.setenv("LLM_MAX_RETRIES", "2")
+    calls = []
+
+    def partial(self, request, on_token=None):
+        calls.append(1)
+        on_token("部分文本")
+        raise _server_error()
+
+    monkeypatch.setattr(AgentCall, "_attempt", partial)
+    agent = AgentCall("gpt-4o-mini", fallback_model="local-model")
+    tokens = []
+    before = fake_llm.requests
+    with pytest.raises(StreamInterruptedError):
+        agent._complete("系统", "分析AAPL", on_token=tokens.append)
+    # 已经输出的片段不会被重试或备用模型重复输出，失败仍计入熔断
+    assert tokens == ["部分文本"] and len(calls) == 1
+    assert fake_llm.requests == before
+    assert agent.breaker.failures == 1
+
+
+def _hedging_agent(monkeypatch, max_concurrency):
+    monkeypatch.setenv("GPT_MAX_CONCURRENCY", str(max_concurrency))
+    monkeypatch.setenv("LLM_HEDGE_PERCENTILE", "50")
+    agent = AgentCall("gpt-4o-mini")
+    agent._latencies.extend([0.01] * HEDGE_MIN_SAMPLES)
+    limiter = agent.concurrency_limiter
+    calls, active = [], []
+
+    def slow_then_fast(self, request, on_token=None):
+        calls.append(1)
+        active.append(limiter._active)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return "慢", None
+        return "快", None
+
+    monkeypatch.setattr(AgentCall, "_attempt", slow_then_fast)
+    return agent, calls, active
+
+
+def _wait_for_release(limiter):
+    deadline = time.monotonic() + 2
+    while limiter._active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return limiter._active
+
+
+def test_hedge_takes_its_own_concurrency_slot(isolated_env, monkeypatch):
+    agent, calls, active = _hedging_agent(monkeypatch, 2)
+    text, _ = agent._complete("系统", "分析AAPL")
+    assert text == "快" and len(calls) == 2
+    assert active == [1, 2]
+    # 落后的主请求在结束前继续占用名额
+    assert agent.concurrency_limiter._active == 1
+    assert _wait_for_release(agent.concurrency_limiter) == 0
+    agent.close()
+
+
+def test_hedge_is_skipped_without_free_slot(isolated_env, monkeypatch):
+    agent, calls, _ = _hedging_agent(monkeypatch, 1)
+    text, _ = agent._complete("系统", "分析AAPL")
+    assert text == "慢" and len(calls) == 1
+    assert _wait_for_release(agent.concurrency_limiter) == 0
+    agent.close()
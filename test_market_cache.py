@@ -0,0 +1,54 @@
+# test_market_cache.py - 行情缓存的有效期
+import time
+
+import pytest
+
+import news_agent
+from market_cache import MarketDataCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MarketDataCache(str(tmp_path / "market.db"), info_ttl=60, close_time="16:00", timezone="America/New_York")
+
+
+def test_entry_fetched_after_close_never_expires(cache):
+    close = cache._session_close("2024-06-03")
+    assert cache._is_fresh("2024-06-03", close + 1)
+    assert cache._is_fresh("2024-06-03", close)
+
+
+def test_entry_fetched_before_close_expires_after_ttl(cache):
+    close = cache._session_close("2024-06-03")
+    # 历史日期在收盘前缓存的盘中数据同样按有效期判断
+    assert not cache._is_fresh("2024-06-03", close - 3600)
+    assert cache._is_fresh("2099-01-01", time.time() - 30)
+    assert not cache._is_fresh("2099-01-01", time.time() - 120)
+
+
+def test_session_close_uses_exchange_timezone(tmp_path):
+    new_york = MarketDataCache(str(tmp_path / "a.db"), close_time="16:00", timezone="America/New_York")
+    shanghai = MarketDataCache(str(tmp_path / "b.db"), close_time="15:00", timezone="Asia/Shanghai")
+    # 2024-06-03 纽约 16:00 为 UTC 20:00，上海 15:00 为 UTC 07:00
+    assert new_york._session_close("2024-06-03") - shanghai._session_close("2024-06-03") == 13 * 3600
+
+
+def test_get_many_skips_stale_and_error_entries(cache):
+    cache.put_many([("AAPL", {"close": 1.0}), ("MSFT", {"error": "失败"})], "2099-01-01", "info")
+    assert cache.get_many(["AAPL", "MSFT"], "2099-01-01", "info") == {"AAPL": {"close": 1.0}}
+    cache.info_ttl = 0
+    assert cache.get_many(["AAPL"], "2099-01-01", "info") == {}
+
+
+def test_fetch_today_info_serves_repeat_requests_from_cache(isolated_env):
+    first = news_agent.fetch_today_info(["AAPL", "MSFT"])
+    calls = news_agent.yf.calls
+    second = news_agent.fetch_today_info(["AAPL", "MSFT"])
+    assert news_agent.yf.calls == calls
+    assert second == first
+
+
+def test_fetch_today_info_offline_reads_only_cache(isolated_env):
+    result = news_agent.fetch_today_info(["AAPL"], date="2024-06-03", offline=True)
+    assert news_agent.yf.calls == 0
+    assert "error" in result[0]
@@ -0,0 +1,81 @@
+# test_metric_history.py - 指标提取和历史渲染
+import json
+
+from metric_history import (
+    combine_metrics, extract_metrics, render_history, render_metric_series, truncate_history
+)
+
+LABELED = """用户增长分析：负增长
+用户增长率：-8%（Q2销量同比下滑）
+ARPU变化：+3.5%
+网络效应强度：强
+关键证据：开发者数量创新高"""
+
+
+def test_extract_metrics_from_labeled_text():
+    metrics = extract_metrics(LABELED)
+    assert metrics["user_growth"] == -8.0
+    assert metrics["arpu_change"] == 3.5
+    assert metrics["strength"] == 3
+    assert metrics["evidence"] == "开发者数量创新高"
+
+
+def test_extract_metrics_takes_last_occurrence():
+    text = "用户增长率：xx%（格式说明）\n" + LABELED
+    assert extract_metrics(text)["user_growth"] == -8.0
+
+
+def test_extract_metrics_from_json():
+    text = "```json\n" + json.dumps({
+        "user_growth": {"value": "12%"},
+        "arpu_change": "-2%",
+        "network_effect_strength": "中",
+        "key_evidence": "日活增长",
+    }, ensure_ascii=False) + "\n```"
+    metrics = extract_metrics(text)
+    assert metrics["user_growth"] == 12.0
+    assert metrics["arpu_change"] == -2.0
+    assert metrics["strength"] == 2
+    assert metrics["evidence"] == "日活增长"
+
+
+def test_extract_metrics_without_metrics_returns_none():
+    assert extract_metrics("没有任何指标的文本") is None
+    assert extract_metrics(None) is None
+
+
+def test_combine_metrics_prefers_earlier_values():
+    merged = combine_metrics({"user_growth": 1.0, "strength": None}, {"user_growth": 2.0, "strength": 3}, None)
+    assert merged == {"user_growth": 1.0, "strength": 3}
+    assert combine_metrics(None, None) is None
+
+
+def _points(count):
+    return [
+        {"date": f"2024-06-{day:02d}", "user_growth": float(day), "arpu_change": None,
+         "arpu_change_text": "持平", "strength": 2, "evidence": f"第{day}天的关键证据" * 3}
+        for day in range(1, count + 1)
+    ]
+
+
+def test_render_metric_series_fits_budget():
+    points = _points(3)
+    full = render_metric_series(points, token_budget=10 ** 6)
+    assert full.count("\n") == 3
+    assert "+1%" in full and "持平" in full and "中" in full
+    # 预算不足时先省略较早数据点的关键证据，再丢弃最早的数据点
+    budget = len(full) - 10
+    text = render_metric_series(points, token_budget=budget)
+    assert len(text) <= budget
+    assert "第3天" in text and "第1天" not in text
+    tight = render_metric_series(_points(8), token_budget=120)
+    assert len(tight) <= 120
+    assert "2024-06-08" in tight and "2024-06-01" not in tight
+
+
+def test_render_history_falls_back_to_truncated_text():
+    assert render_history(None, "短历史", 100) == "短历史"
+    assert render_history([], "很长的历史" * 50, 20) == truncate_history("很长的历史" * 50, 20)
+    assert len(render_history(None, "很长的历史" * 50, 20)) == 20
+    assert render_history(_points(1), "忽略的自由文本", 600).startswith("日期 |")
+    assert render_history(None, None, 100) is None
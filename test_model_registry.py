@@ -0,0 +1,72 @@
+# test_model_registry.py - 服务商注册表与按任务路由
+import json
+
+from llm_call import get_provider
+from model_registry import ModelRegistry, ModelRouter, get_registry
+
+
+def _local_provider(monkeypatch, base_url="http://localhost:8000/v1"):
+    monkeypatch.setenv("LLM_PROVIDERS", "local")
+    monkeypatch.setenv("LOCAL_BASE_URL", base_url)
+    monkeypatch.setenv("LOCAL_MODELS", "local-model")
+
+
+def test_registry_loads_providers_routes_and_costs(isolated_env, monkeypatch):
+    config = isolated_env / "registry.json"
+    config.write_text(json.dumps({
+        "providers": {"local": {"base_url": "http://config/v1", "models": {"local-model": {"input_cost": 0.1}}}},
+        "routes": {"network_effect": ["gpt-4o"]}
+    }), encoding="utf-8")
+    monkeypatch.setenv("LLM_REGISTRY_FILE", str(config))
+    _local_provider(monkeypatch)
+    monkeypatch.setenv("LLM_MODEL_COSTS", "gpt-4o=3:12")
+    monkeypatch.setenv("LLM_ROUTES", "network_effect_history=local-model, gpt-4o-mini")
+    registry = ModelRegistry.from_env()
+    # 环境变量覆盖配置文件中的同名配置，两处的路由合并
+    assert registry.provider_config("local")["base_url"] == "http://localhost:8000/v1"
+    assert registry.routes == {
+        "network_effect": ["gpt-4o"], "network_effect_history": ["local-model", "gpt-4o-mini"]
+    }
+    assert registry.cost("gpt-4o") == (3.0, 12.0)
+    assert registry.cost("local-model") == (0.1, 0.0)
+    assert get_registry().provider_for("local-model") == "local"
+    assert get_provider("local-model") == "local" and get_provider("gpt-4o") == "gpt"
+
+
+def test_router_prefers_cheaper_model_until_latency_observed():
+    registry = ModelRegistry(routes={"network_effect": ["gpt-4o", "gpt-4o-mini"]})
+    router = ModelRouter(registry, latency_weight=1.0)
+    assert router.choose("network_effect_history", "gpt-4o") == "gpt-4o"
+    assert router.choose("network_effect", "gpt-4o") == "gpt-4o-mini"
+    # 便宜的模型明显更慢时，按加权得分改选更快的模型
+    router.observe("gpt-4o", "network_effect", 0.5)
+    router.observe("gpt-4o-mini", "network_effect", 500.0)
+    assert router.choose("network_effect", "gpt-4o") == "gpt-4o"
+
+
+def test_router_penalizes_failing_models():
+    registry = ModelRegistry(routes={"*": ["gpt-4o-mini", "deepseek-chat"]})
+    router = ModelRouter(registry, latency_weight=0.0)
+    assert router.choose("network_effect", "gpt-4o") == "gpt-4o-mini"
+    for _ in range(10):
+        router.observe("gpt-4o-mini", "network_effect", 1.0, error=True)
+    assert router.choose("network_effect", "gpt-4o") == "deepseek-chat"
+
+
+def test_router_tries_unobserved_model_on_tie():
+    registry = ModelRegistry(routes={"network_effect": ["a", "b"]}, costs={"a": (1.0, 1.0), "b": (1.0, 1.0)})
+    router = ModelRouter(registry)
+    router.observe("a", "network_effect", 1.0)
+    assert router.choose("network_effect", "a") == "b"
+
+
+def test_workflow_routes_tasks_to_registered_models(isolated_env, fake_llm, monkeypatch):
+    from news_agent import AnalyzerSession
+
+    _local_provider(monkeypatch, fake_llm.base_url)
+    monkeypatch.setenv("LLM_ROUTES", "network_effect=local-model")
+    with AnalyzerSession() as session:
+        state = session.run("gpt-4o-mini", ["AAPL", "MSFT"], ["network_effect"] * 2)
+    # 配置了路由的分析风格由注册的本地模型完成，而不是调用时传入的默认模型
+    assert [usage["model_name"] for usage in state.analysis_usage] == ["local-model"] * 2
+    assert all(result.startswith("模拟分析结果") for result in state.analysis_results)
@@ -0,0 +1,67 @@
+# test_news_dedup.py - MinHash 近似重复检测
+from news_dedup import (
+    NUM_PERMUTATIONS, best_match, dedup_settings, minhash, news_text, pack_signature, similarity, unpack_signature
+)
+
+STORY = (
+    "路透社消息：苹果公司今日宣布其应用商店开发者数量同比增长百分之二十，平台交易额创历史新高，"
+    "公司表示生态系统的网络效应持续增强，更多开发者带来更多用户。"
+)
+EDITED = STORY.replace("今日", "周二").replace("创历史新高", "再创新高") + " 记者 张三"
+OTHER = (
+    "微软公司发布季度财报，Azure云服务收入增长百分之三十一，企业客户数量继续扩大，"
+    "管理层上调全年业绩指引并宣布新的股票回购计划。"
+)
+
+
+def test_minhash_is_deterministic():
+    signature = minhash(STORY)
+    assert len(signature) == NUM_PERMUTATIONS
+    assert signature == minhash(STORY)
+    # 空白、标点和大小写不影响签名
+    assert minhash(STORY.replace("，", " , ").upper()) == signature
+
+
+def test_similarity_ranks_near_duplicates_above_unrelated_text():
+    base = minhash(STORY)
+    assert similarity(base, minhash(STORY)) == 1.0
+    assert similarity(base, minhash(EDITED)) >= 0.6
+    assert similarity(base, minhash(OTHER)) < 0.2
+
+
+def test_short_text_has_no_signature():
+    assert minhash("苹果发布会") is None
+
+
+def test_similarity_of_mismatched_signatures_is_zero():
+    assert similarity([], []) == 0.0
+    assert similarity([1, 2], [1, 2, 3]) == 0.0
+
+
+def test_signature_roundtrip():
+    signature = minhash(STORY)
+    assert unpack_signature(pack_signature(signature)) == signature
+
+
+def test_best_match_respects_threshold():
+    base = minhash(STORY)
+    candidates = [
+        {"date": "2024-06-01", "signature": minhash(OTHER)},
+        {"date": "2024-06-02", "signature": minhash(EDITED)},
+    ]
+    record, score = best_match(base, candidates, 0.5)
+    assert record["date"] == "2024-06-02"
+    assert score == similarity(base, minhash(EDITED))
+    assert best_match(base, candidates, 1.01) is None
+
+
+def test_news_text_joins_news_fields():
+    text = news_text({"news_summary": "摘要", "close": 1.0}, {"raw_news_text": "原文"}, None)
+    assert text == "摘要\n原文"
+
+
+def test_dedup_settings_default_and_override(monkeypatch):
+    monkeypatch.delenv("NEWS_DEDUP_MODE", raising=False)
+    assert dedup_settings()["mode"] == "off"
+    assert dedup_settings("REUSE")["mode"] == "reuse"
+    assert dedup_settings("unknown")["mode"] == "off"
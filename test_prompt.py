@@ -0,0 +1,72 @@
+# test_prompt.py - 预解析的提示词模板
+import pytest
+
+from prompt import PromptTemplate, get_available_templates, get_prompt_template, get_template, validate_records
+
+
+def test_template_collects_required_fields():
+    template = PromptTemplate("demo", "股票 {symbol} 的新闻: {news_summary}，历史: {history_info}")
+    assert template.required_fields == {"symbol", "news_summary", "history_info"}
+    assert template.missing_fields({"symbol": "AAPL"}) == ["history_info", "news_summary"]
+    assert template.missing_fields({"symbol": "AAPL", "news_summary": "", "history_info": ""}) == []
+
+
+def test_render_matches_str_format():
+    text = "{symbol} 收盘 {close}，{{字面量}}"
+    template = PromptTemplate("demo", text)
+    params = {"symbol": "AAPL", "close": 101.5}
+    assert template.render(**params) == text.format(**params)
+
+
+def test_render_with_format_spec_falls_back_to_str_format():
+    template = PromptTemplate("demo", "收盘 {close:.2f}")
+    assert template.render(close=1.0) == "收盘 1.00"
+
+
+def test_render_missing_field_raises_key_error():
+    template = PromptTemplate("demo", "{symbol} {news_summary}")
+    with pytest.raises(KeyError):
+        template.render(symbol="AAPL")
+
+
+def test_validate_records_reports_missing_fields_per_record():
+    name = get_available_templates()[0]
+    fields = get_template(name).required_fields
+    complete = {field: "x" for field in fields}
+    missing = validate_records(name, [complete, {}])
+    assert missing[0] == []
+    assert missing[1] == sorted(fields)
+
+
+def test_get_template_reuses_parsed_template():
+    name = get_available_templates()[0]
+    assert get_template(name) is get_template(name)
+    assert get_template(name).text is get_prompt_template(name)
+
+
+def test_unknown_template_raises_value_error():
+    with pytest.raises(ValueError):
+        get_template("no_such_template")
+
+
+def test_validate_prompts_reports_errors_and_compile_keeps_list():
+    from news_agent import compile_analysis_prompts, validate_analysis_prompts
+
+    today_info = [{"symbol": "AAPL", "news_summary": "新闻"}, {"symbol": "MSFT"}]
+    prompts, errors = validate_analysis_prompts(today_info, [None, None], ["network_effect"] * 2)
+    assert prompts[0] is not None and errors[0] is None
+    assert prompts[1] is None and errors[1]["missing"] == ["news_summary"]
+    assert compile_analysis_prompts(today_info, [None, None], ["network_effect"] * 2) == [prompts[0], "分析失败"]
+
+
+def test_invalid_inputs_skip_the_llm(isolated_env, fake_llm):
+    from news_agent import AnalyzerSession
+
+    today_info = [{"symbol": "AAPL", "close": 100.0, "news_summary": "新闻"}, {"symbol": "MSFT", "close": 100.0}]
+    before = fake_llm.requests
+    with AnalyzerSession() as session:
+        state = session.run("gpt-4o-mini", ["AAPL", "MSFT"], ["network_effect"] * 2, today_info_list=today_info)
+    # 只有 AAPL 的分析和历史总结发出了请求
+    assert fake_llm.requests - before == 2
+    assert state.analysis_errors[1]["missing"] == ["news_summary"]
+    assert state.analysis_results[1] == state.analysis_errors[1]["message"]
@@ -0,0 +1,76 @@
+# test_results_store.py - 分析结果的保存、查询和导出
+import csv
+import json
+
+import pytest
+
+from results_store import RESULT_FIELDS, ResultsStore
+
+
+def _record(symbol, date, result, model_name="gpt-4o-mini", created_at=100.0, style="network_effect"):
+    return {
+        "symbol": symbol, "date": date, "style": style, "model_name": model_name, "prompt_hash": "h",
+        "result": result, "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        "created_at": created_at
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    store.append_many([
+        _record("AAPL", "2024-06-03", "苹果第一天"),
+        _record("AAPL", "2024-06-04", "苹果第二天"),
+        _record("AAPL", "2024-06-04", "苹果第二天新模型", model_name="gpt-4o", created_at=200.0),
+        _record("MSFT", "2024-06-04", "微软第二天", style="network_effect_analysis"),
+    ])
+    return store
+
+
+def test_append_keeps_newest_result_per_prompt(store):
+    # 同一条结果重复合并不会产生重复记录，较旧的结果不覆盖较新的结果
+    assert store.append_many([_record("AAPL", "2024-06-03", "苹果第一天")]) == 0
+    assert store.append_many([_record("AAPL", "2024-06-03", "旧结果", created_at=50.0)]) == 0
+    assert store.append_many([_record("AAPL", "2024-06-03", "重跑结果", created_at=300.0)]) == 1
+    [record] = store.query(["AAPL"], end_date="2024-06-03")
+    assert record["result"] == "重跑结果" and record["total_tokens"] == 15 and record["cached"] is False
+
+
+def test_query_filters_by_symbol_date_style_and_model(store):
+    assert [r["result"] for r in store.query(["AAPL"], start_date="2024-06-04")] == ["苹果第二天", "苹果第二天新模型"]
+    assert [r["symbol"] for r in store.query(start_date="2024-06-04", end_date="2024-06-04")] == [
+        "AAPL", "AAPL", "MSFT"
+    ]
+    assert [r["result"] for r in store.query(style="network_effect_analysis")] == ["微软第二天"]
+    assert [r["result"] for r in store.query(model_name="gpt-4o")] == ["苹果第二天新模型"]
+    assert store.query(["GOOG"]) == []
+
+
+def test_latest_only_returns_newest_per_symbol_date_and_style(store):
+    latest = store.query(["AAPL"], latest_only=True)
+    assert [(r["date"], r["result"]) for r in latest] == [
+        ("2024-06-03", "苹果第一天"), ("2024-06-04", "苹果第二天新模型")
+    ]
+
+
+def test_export_formats(store, tmp_path):
+    assert store.export(str(tmp_path / "all.json")) == 4
+    records = json.loads((tmp_path / "all.json").read_text(encoding="utf-8"))
+    assert [r["result"] for r in records] == [r["result"] for r in store.query()]
+    assert store.export(str(tmp_path / "aapl.jsonl"), symbols=["AAPL"], latest_only=True) == 2
+    lines = (tmp_path / "aapl.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["result"] for line in lines] == ["苹果第一天", "苹果第二天新模型"]
+    assert store.export(str(tmp_path / "msft.csv"), symbols=["MSFT"]) == 1
+    with open(tmp_path / "msft.csv", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == RESULT_FIELDS and rows[0]["result"] == "微软第二天"
+    # 没有符合条件的结果时导出空数组
+    assert store.export(str(tmp_path / "none.json"), symbols=["GOOG"]) == 0
+    assert json.loads((tmp_path / "none.json").read_text(encoding="utf-8")) == []
+
+
+def test_stats(store):
+    assert store.stats() == {
+        "results": 4, "symbols": 2, "first_date": "2024-06-03", "last_date": "2024-06-04",
+        "prompt_tokens": 40, "completion_tokens": 20, "total_tokens": 60
+    }
@@ -0,0 +1,101 @@
+# test_service.py - 相同请求的合并
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from service import AnalysisService, SingleFlight
+
+
+def test_single_flight_coalesces_same_key():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "结果"
+
+    async def main():
+        return await asyncio.gather(*[flight.do("AAPL", work) for _ in range(5)])
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["结果"] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert flight.in_flight() == 0
+
+
+def test_single_flight_runs_different_keys_separately_and_forgets_finished_keys():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def main():
+        await asyncio.gather(flight.do("AAPL", work), flight.do("MSFT", work))
+        await flight.do("AAPL", work)
+
+    asyncio.run(main())
+    assert flight.calls == 3
+    assert flight.shared == 0
+
+
+def test_single_flight_shares_exceptions():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("失败")
+
+    async def main():
+        return await asyncio.gather(*[flight.do("k", fail) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.calls == 1
+
+
+class _FakeSession:
+    def __init__(self):
+        self.calls = []
+
+    async def arun(self, model, symbols, styles, prompt_params_list=None, date=None):
+        self.calls.append(prompt_params_list[0])
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(
+            analysis_results=[f"分析 {prompt_params_list[0]}"],
+            history_results=["历史"],
+            analysis_errors=[None],
+            history_errors=[None],
+        )
+
+
+def test_service_key_includes_params():
+    session = _FakeSession()
+    service = AnalysisService(session=session)
+    same = {"symbol": "AAPL", "date": "2024-06-03", "params": {"news_summary": "新闻A", "extra": 1}}
+    reordered = {"symbol": "AAPL", "date": "2024-06-03", "params": {"extra": 1, "news_summary": "新闻A"}}
+    different = {"symbol": "AAPL", "date": "2024-06-03", "params": {"news_summary": "新闻B"}}
+
+    async def main():
+        return await asyncio.gather(
+            service.analyze(same), service.analyze(reordered), service.analyze(different)
+        )
+
+    first, second, third = asyncio.run(main())
+    assert len(session.calls) == 2
+    assert first["analysis_result"] == second["analysis_result"]
+    assert second["coalesced"] is True
+    assert third["coalesced"] is False
+    assert "新闻B" in third["analysis_result"]
+    assert service.stats() == {"requests": 3, "analyses": 2, "coalesced": 1, "in_flight": 0}
+
+
+def test_service_rejects_invalid_requests():
+    service = AnalysisService(session=_FakeSession())
+    with pytest.raises(ValueError):
+        asyncio.run(service.analyze({"symbol": ""}))
+    with pytest.raises(ValueError):
+        asyncio.run(service.analyze({"symbol": "AAPL", "params": ["not", "a", "dict"]}))
@@ -0,0 +1,220 @@
+# test_workflow.py - 分析工作流
+import threading
+
+import pytest
+
+import news_agent
+from history_store import get_history_store
+from news_agent import AnalyzerSession
+
+SYMBOLS = ["AAPL", "MSFT"]
+STYLES = ["network_effect"] * len(SYMBOLS)
+
+
+def _today_info(symbols, news="发布季度财报，用户规模持续增长。"):
+    """历史日期的K线中没有新闻，直接传入今日信息"""
+    return [{"symbol": symbol, "close": 100.0, "news_summary": f"{symbol} {news}"} for symbol in symbols]
+
+
+@pytest.fixture
+def session(isolated_env):
+    with AnalyzerSession() as session:
+        yield session
+
+
+def test_analysis_and_history_branches_run_in_parallel(session, monkeypatch):
+    # 两个分支都要等到对方开始后才能继续，串行执行时会超时
+    barrier = threading.Barrier(2, timeout=5)
+    analyze, summarize = news_agent.analyze_stocks, news_agent.summarize_history
+
+    def analyze_stocks(state, config=None):
+        barrier.wait()
+        return analyze(state, config)
+
+    def summarize_history(state, config=None):
+        barrier.wait()
+        return summarize(state, config)
+
+    monkeypatch.setattr(news_agent, "analyze_stocks", analyze_stocks)
+    monkeypatch.setattr(news_agent, "summarize_history", summarize_history)
+    state = session.run("gpt-4o-mini", SYMBOLS, STYLES)
+    assert all(result.startswith("模拟分析结果") for result in state.analysis_results)
+    assert all(result.startswith("模拟分析结果") for result in state.history_results)
+
+
+def test_save_results_joins_both_branches(session):
+    state = session.run("gpt-4o-mini", SYMBOLS, STYLES, today_info_list=_today_info(SYMBOLS), date="2024-06-03")
+    # 两个分支的结果在汇合后的 save_results 中一起写入
+    assert get_history_store().get_many(SYMBOLS, as_of="2024-06-03") == dict(zip(SYMBOLS, state.history_results))
+    assert {"analyze_stocks", "summarize_history", "save_results"} <= set(state.perf_summary["nodes"])
+
+
+def test_stream_yields_tokens_then_results_per_symbol(session):
+    events = list(session.stream("gpt-4o-mini", SYMBOLS, STYLES, stream_tokens=True))
+    assert events[-1]["type"] == "done"
+    state = events[-1]["state"]
+    for kind, results in (("analysis", state.analysis_results), ("history", state.history_results)):
+        for i, symbol in enumerate(SYMBOLS):
+            tokens = [e for e in events if e["type"] == "token" and e["kind"] == kind and e["index"] == i]
+            [result] = [e for e in events if e["type"] == kind and e["index"] == i]
+            # 每只股票的文本片段都在其结果事件之前产出，拼接后与结果一致
+            assert len(tokens) > 1
+            assert events.index(tokens[-1]) < events.index(result)
+            assert "".join(e["delta"] for e in tokens) == result["result"] == results[i]
+            assert result["symbol"] == symbol and results[i].startswith("模拟分析结果")
+    assert get_history_store().get_many(SYMBOLS) == dict(zip(SYMBOLS, state.history_results))
+
+
+def test_empty_completions_are_errors_and_not_saved(isolated_env, monkeypatch):
+    from benchmark import FakeLLMServer
+    from llm_call import is_error_result
+
+    server = FakeLLMServer(latency=0.0, jitter=0.0, response_size=0).start()
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    try:
+        with AnalyzerSession() as empty_session:
+            for stream_tokens in (False, True):
+                events = list(empty_session.stream("gpt-4o-mini", SYMBOLS, STYLES, stream_tokens=stream_tokens))
+                state = events[-1]["state"]
+                assert all(is_error_result(result) for result in state.analysis_results + state.history_results)
+            state = empty_session.run("gpt-4o-mini", SYMBOLS, STYLES)
+            assert all(is_error_result(result) for result in state.analysis_results)
+    finally:
+        server.stop()
+    assert get_history_store().get_many(SYMBOLS) == {}
+
+
+def test_incremental_rerun_reuses_unchanged_symbols(session, fake_llm):
+    today_info = _today_info(SYMBOLS)
+    first = session.run("gpt-4o-mini", SYMBOLS, STYLES, today_info_list=today_info, date="2024-06-03", incremental=True)
+    assert first.reused == [False, False]
+    before = fake_llm.requests
+    # 同一天输入不变时直接复用，即使上次运行已经写入了当天的历史总结
+    second = session.run("gpt-4o-mini", SYMBOLS, STYLES, today_info_list=today_info, date="2024-06-03", incremental=True)
+    assert second.reused == [True, True]
+    assert fake_llm.requests == before
+    assert second.analysis_results == first.analysis_results
+    assert second.history_results == first.history_results
+    # 只有新闻变化的股票重新分析
+    changed = _today_info(["AAPL"]) + _today_info(["MSFT"], news="宣布裁员，用户流失。")
+    third = session.run("gpt-4o-mini", SYMBOLS, STYLES, today_info_list=changed, date="2024-06-03", incremental=True)
+    assert third.reused == [True, False]
+    assert fake_llm.requests - before == 2
+
+
+def test_incremental_results_are_not_reused_on_another_date(session, fake_llm):
+    today_info = _today_info(SYMBOLS)
+    session.run("gpt-4o-mini", SYMBOLS, STYLES, today_info_list=today_info, date="2024-06-03", incremental=True)
+    state = session.run("gpt-4o-mini", SYMBOLS, STYLES, today_info_list=today_info, date="2024-06-04", incremental=True)
+    assert state.reused == [False, False]
+
+
+def test_incremental_without_saving_history_leaves_fingerprints_to_caller(session):
+    today_info = _today_info(SYMBOLS)
+    state = session.run(
+        "gpt-4o-mini", SYMBOLS, STYLES, today_info_list=today_info, date="2024-06-03",
+        incremental=True, save_history=False
+    )
+    assert get_history_store().get_fingerprints(SYMBOLS) == {}
+    # 调用方写入历史信息和指纹后，下次运行可以复用
+    store = get_history_store()
+    store.put_many(list(zip(SYMBOLS, state.history_results)), "2024-06-03")
+    store.put_fingerprints(list(zip(SYMBOLS, state.input_fingerprints, state.analysis_results, state.history_results)))
+    rerun = session.run("gpt-4o-mini", SYMBOLS, STYLES, today_info_list=today_info, date="2024-06-03", incremental=True)
+    assert rerun.reused == [True, True]
+
+
+def test_pipeline_processes_each_symbol_end_to_end(session, monkeypatch):
+    symbols = [f"S{i}" for i in range(6)]
+    lock = threading.Lock()
+    active = {"now": 0, "peak": 0}
+    prepare = news_agent.prepare_data
+
+    def prepare_data(state):
+        with lock:
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+        try:
+            threading.Event().wait(0.02)
+            return prepare(state)
+        finally:
+            with lock:
+                active["now"] -= 1
+
+    monkeypatch.setattr(news_agent, "prepare_data", prepare_data)
+    state = session.run_pipeline(
+        "gpt-4o-mini", symbols, ["network_effect"] * 6, today_info_list=_today_info(symbols),
+        date="2024-06-03", max_in_flight=2
+    )
+    # 同时处理的股票数不超过 max_in_flight，结果按输入顺序归位
+    assert active["peak"] == 2
+    assert all(result.startswith("模拟分析结果") for result in state.analysis_results + state.history_results)
+    assert get_history_store().get_many(symbols, as_of="2024-06-03") == dict(zip(symbols, state.history_results))
+    assert state.perf_summary["nodes"]["process_symbol"] > 0
+
+
+def test_interrupted_pipeline_resumes_with_incremental(session, fake_llm, monkeypatch):
+    symbols = ["AAPL", "MSFT", "GOOG"]
+    today_info = _today_info(symbols)
+    compile_prompts = news_agent.compile_prompts
+
+    def fail_on_goog(state, config=None):
+        if state.stock_list == ["GOOG"]:
+            raise RuntimeError("模拟中断")
+        return compile_prompts(state, config)
+
+    monkeypatch.setattr(news_agent, "compile_prompts", fail_on_goog)
+    with pytest.raises(RuntimeError):
+        session.run_pipeline(
+            "gpt-4o-mini", symbols, ["network_effect"] * 3, today_info_list=today_info,
+            date="2024-06-03", incremental=True, max_in_flight=1
+        )
+    monkeypatch.setattr(news_agent, "compile_prompts", compile_prompts)
+    before = fake_llm.requests
+    state = session.run_pipeline(
+        "gpt-4o-mini", symbols, ["network_effect"] * 3, today_info_list=today_info,
+        date="2024-06-03", incremental=True, max_in_flight=1
+    )
+    # 中断前已完成的股票各自保存了结果和指纹，重新运行时只处理 GOOG
+    assert state.reused == [True, True, False]
+    assert fake_llm.requests - before == 2
+
+
+def test_backfill_chains_history_day_by_day(session, monkeypatch):
+    from results_store import get_results_store
+
+    days = ["2024-06-03", "2024-06-04", "2024-06-05"]
+    daily_info = {
+        "AAPL": {
+            day: {"news_summary": f"AAPL {day} 发布新品，用户增长。", "raw_news_text": f"AAPL {day} 原始新闻。"}
+            for day in days
+        }
+    }
+    history_infos = []
+    compile_prompts = news_agent.compile_prompts
+
+    def recording(state, config=None):
+        history_infos.append((state.analysis_styles[0], state.date, state.history_info[0]))
+        return compile_prompts(state, config)
+
+    monkeypatch.setattr(news_agent, "compile_prompts", recording)
+    result = session.backfill(
+        "gpt-4o-mini", ["AAPL", "AAPL"], days[0], days[-1],
+        analysis_styles=["network_effect", "network_effect_analysis"], daily_info=daily_info
+    )
+    records = result["results"]["AAPL"]
+    # 同一股票的每个分析风格各自回填全部交易日，结果依次排列
+    styles = ["network_effect", "network_effect_analysis"]
+    assert [(r["style"], r["date"]) for r in records] == [(style, day) for style in styles for day in days]
+    assert all(r["analysis_error"] is None and r["history_result"].startswith("模拟分析结果") for r in records)
+    # 每天的历史信息由前一天的历史总结生成
+    for style in styles:
+        chain = [r for r in records if r["style"] == style]
+        infos = [info for s, _, info in history_infos if s == style]
+        assert len(infos) == len(days)
+        for previous, info in zip(chain, infos[1:]):
+            assert previous["history_result"] in info
+    store = get_history_store()
+    assert store.get("AAPL", as_of=days[1]) in {r["history_result"] for r in records if r["date"] == days[1]}
+    assert len(store.get_versions("AAPL")) == len(days)
+    assert get_results_store().stats()["results"] == len(records)